@@ -9,16 +9,18 @@ from qm.qua import *
 from qualang_tools.multi_user import qm_session
 from qualang_tools.results import progress_counter
 from qualang_tools.units import unit
-from qualang_tools.bakery.randomized_benchmark_c1 import c1_table
 
 from qualibrate import QualibrationNode
 from iqcc_research.quam_config.components.quam_root import Quam
+from iqcc_research.quam_config.lib.clifford_compiler import CAYLEY_TABLE, INVERSE_TABLE, play_clifford_sequence
+from iqcc_research.quam_config.lib.rb_simulator import max_recovery_error, random_sequences
 from calibration_utils.single_qubit_randomized_benchmarking import (
     Parameters,
     process_raw_dataset,
     fit_raw_data,
     log_fitted_results,
     plot_raw_data_with_fit,
+    plot_crosstalk_matrix,
 )
 from qualibration_libs.parameters import get_qubits
 from qualibration_libs.runtime import simulate_and_plot
@@ -33,7 +35,8 @@ state of the resonator afterward. Each random sequence is derived on the FPGA fo
 maximum depth (specified as an input) and played for each depth asked by the user
 (the sequence is truncated to the desired depth). Each truncated sequence ends with the
 recovery gate, found at each step thanks to a preloaded lookup table (Cayley table),
-that will bring the qubit back to its ground state.
+that will bring the qubit back to its ground state. Each Clifford is compiled into at
+most one x90 or x180 pulse surrounded by virtual Z rotations (see lib/clifford_compiler).
 
 If the readout has been calibrated and is good enough, then state discrimination can be
 applied to only return the state of the qubit. Otherwise, the 'I' and 'Q' quadratures
@@ -50,8 +53,19 @@ Prerequisites:
     - (optional) Having calibrated the DRAG parameters (nodes 10a and 10b or 10c).
     - Having specified the desired flux point if relevant (qubit.z.flux_point).
 
+With simultaneous_rb, independent sequences are played on all the qubits, in two
+configurations per sequence and depth: isolated, where the qubits are driven one after the
+other, each qubit being measured right after its own sequence, and all the qubits driven
+together. The isolated and simultaneous errors per Clifford and their difference
+(addressability) are extracted from the same program. This doubles the number of shots of
+a plain RB run, the isolated shot lasting N sequences and readouts for N qubits.
+With measure_crosstalk_matrix, every qubit is instead measured while driving each qubit
+alone and all the qubits together, which also gives the crosstalk matrix of the error
+induced on idle qubits, at the cost of N + 1 shots per sequence and depth, i.e. N + 1
+times the machine time of a plain RB run (21 times on 20 qubits).
+
 State update:
-    - The averaged single qubit gate fidelity: qubit.gate_fidelity["averaged"].
+    - The averaged single qubit gate fidelity: qubit.gate_fidelity["averaged"] (isolated).
 """
 
 
@@ -93,18 +107,36 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
     num_depths = max_circuit_depth // delta_clifford
     seed = node.parameters.seed  # Pseudo-random number generator seed
     strict_timing = node.parameters.use_strict_timing
-    # List of recovery gates from the lookup table
-    inv_gates = [int(np.where(c1_table[i, :] == 0)[0][0]) for i in range(24)]
 
-    def generate_sequence():
-        cayley = declare(int, value=c1_table.flatten().tolist())
-        inv_list = declare(int, value=inv_gates)
+    simultaneous = node.parameters.simultaneous_rb
+    if simultaneous:
+        assert node.parameters.depth_only_program, "simultaneous_rb requires depth_only_program."
+        # Each qubit gets its own pseudo-random generator, seeded from a common base seed
+        seed = seed if seed is not None else int(np.random.randint(2**16))
+        if node.parameters.measure_crosstalk_matrix:
+            # Every qubit is measured while driving each qubit alone, and while driving all the qubits
+            drive_configurations = [[i] for i in range(num_qubits)] + [list(range(num_qubits))]
+            drive_labels = qubits.get_names() + ["all"]
+        else:
+            # The qubits driven one after the other, and all the qubits driven together
+            drive_configurations = ["isolated", list(range(num_qubits))]
+            drive_labels = ["isolated", "all"]
+    else:
+        drive_configurations = [None]
+
+    def declare_sequence_generator(seed_offset=0):
+        cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+        inv_list = declare(int, value=INVERSE_TABLE.tolist())
         current_state = declare(int)
         step = declare(int)
+        rand = Random(seed=seed if seed_offset == 0 else seed + seed_offset)
+        return cayley, inv_list, current_state, step, rand
+
+    def generate_sequence():
+        cayley, inv_list, current_state, step, rand = declare_sequence_generator()
         sequence = declare(int, size=max_circuit_depth + 1)
         inv_gate = declare(int, size=max_circuit_depth + 1)
         i = declare(int)
-        rand = Random(seed=seed)
 
         assign(current_state, 0)
         with for_(i, 0, i < max_circuit_depth, i + 1):
@@ -115,87 +147,66 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
 
         return sequence, inv_gate
 
-    def play_sequence(sequence_list, depth, qubit):
-        i = declare(int)
-        with for_(i, 0, i <= depth, i + 1):
-            with switch_(sequence_list[i], unsafe=True):
-                with case_(0):
-                    qubit.xy.wait(qubit.xy.operations["x180"].length // 4)
-                with case_(1):  # x180
-                    qubit.xy.play("x180")
-                with case_(2):  # y180
-                    qubit.xy.play("y180")
-                with case_(3):  # Z180
-                    qubit.xy.play("y180")
-                    qubit.xy.play("x180")
-                with case_(4):  # Z90 X180 Z-180
-                    qubit.xy.play("x90")
-                    qubit.xy.play("y90")
-                with case_(5):  # Z-90 Y-90 Z-90
-                    qubit.xy.play("x90")
-                    qubit.xy.play("-y90")
-                with case_(6):  # Z-90 X180 Z-180
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                with case_(7):  # Z-90 Y90 Z-90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("-y90")
-                with case_(8):  # X90 Z90
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(9):  # X-90 Z-90
-                    qubit.xy.play("y90")
-                    qubit.xy.play("-x90")
-                with case_(10):  # z90 X90 Z90
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("x90")
-                with case_(11):  # z90 X-90 Z90
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("-x90")
-                with case_(12):  # x90
-                    qubit.xy.play("x90")
-                with case_(13):  # -x90
-                    qubit.xy.play("-x90")
-                with case_(14):  # y90
-                    qubit.xy.play("y90")
-                with case_(15):  # -y90
-                    qubit.xy.play("-y90")
-                with case_(16):  # Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(17):  # -Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("x90")
-                with case_(18):  # Y-90 Z-90
-                    qubit.xy.play("x180")
-                    qubit.xy.play("y90")
-                with case_(19):  # Y90 Z90
-                    qubit.xy.play("x180")
-                    qubit.xy.play("-y90")
-                with case_(20):  # Y90 Z-90
-                    qubit.xy.play("y180")
-                    qubit.xy.play("x90")
-                with case_(21):  # Y-90 Z90
-                    qubit.xy.play("y180")
-                    qubit.xy.play("-x90")
-                with case_(22):  # x90 Z-90
-                    qubit.xy.play("x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(23):  # -x90 Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("-x90")
+    def measure(i, qubit):
+        if node.parameters.use_state_discrimination:
+            qubit.readout_state(state[i])
+            save(state[i], state_st[i])
+        else:
+            qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
+            save(I[i], I_st[i])
+            save(Q[i], Q_st[i])
+
+    def play(sequence_list, depth, qubit):
+        # The strict_timing ensures that the sequence will be played without gaps
+        if strict_timing:
+            with strict_timing_():
+                # Play the random sequence of desired depth
+                play_clifford_sequence(sequence_list, depth, qubit)
+        else:
+            play_clifford_sequence(sequence_list, depth, qubit)
+
+    def play_and_measure(sequence_lists, depth, multiplexed_qubits, driven_qubits=None):
+        """
+        Play the sequences on the driven qubits (all the qubits by default) and measure all the qubits.
+        With driven_qubits="isolated", each qubit plays its sequence and is measured while the others are idle.
+        """
+        with for_(n, 0, n < n_avg, n + 1):
+            # Initialize the qubits
+            for i, qubit in multiplexed_qubits.items():
+                qubit.reset(node.parameters.reset_type, node.parameters.simulate)
+                # Align the two elements to play the sequence after qubit initialization
+            align()
+            if driven_qubits == "isolated":
+                for i, qubit in multiplexed_qubits.items():
+                    play(sequence_lists[i], depth, qubit)
+                    align()
+                    measure(i, qubit)
+                    align()
+            else:
+                # Manipulate the qubits
+                for i, qubit in multiplexed_qubits.items():
+                    if driven_qubits is not None and i not in driven_qubits:
+                        continue
+                    play(sequence_lists[i], depth, qubit)
+                align()
+                # Readout the qubits
+                for i, qubit in multiplexed_qubits.items():
+                    measure(i, qubit)
+                align()
 
     # Register the sweep axes to be added to the dataset when fetching data
     depths = np.arange(1, max_circuit_depth + 0.1, delta_clifford)
+    # Pre-flight check of the Cayley and inverse tables and of the pulse mapping, on host-simulated sequences
+    assert max_recovery_error(random_sequences(10, max_circuit_depth, seed), depths.astype(int)) < 1e-6, (
+        "The recovery gates do not bring the simulated sequences back to the ground state."
+    )
     node.namespace["sweep_axes"] = {
         "qubit": xr.DataArray(qubits.get_names()),
         "nb_of_sequences": xr.DataArray(np.arange(num_of_sequences), attrs={"long_name": "Number of sequences"}),
         "depths": xr.DataArray(depths, attrs={"long_name": "Number of Clifford gates"}),
     }
+    if simultaneous:
+        node.namespace["sweep_axes"]["driven"] = xr.DataArray(drive_labels, attrs={"long_name": "Driven qubits"})
     with program() as node.namespace["qua_program"]:
         I, I_st, Q, Q_st, n, n_st = node.machine.declare_qua_variables()
         state = [declare(int) for _ in range(num_qubits)]
@@ -209,73 +220,81 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
         m = declare(int)
         m_st = declare_stream()
 
-        for multiplexed_qubits in qubits.batch():
+        # The simultaneous RB drives all the qubits together, regardless of the multiplexing
+        batches = [dict(enumerate(qubits))] if simultaneous else qubits.batch()
+        for multiplexed_qubits in batches:
             # Initialize the QPU in terms of flux points (flux tunable transmons and/or tunable couplers)
             for qubit in multiplexed_qubits.values():
                 node.machine.initialize_qpu(target=qubit)
             align()
 
+            if node.parameters.depth_only_program:
+                # A single sequence shared by the qubits, or an independent sequence per qubit for simultaneous RB
+                generated = list(multiplexed_qubits) if simultaneous else [None]
+                generators = {i: declare_sequence_generator(seed_offset=i or 0) for i in generated}
+                sequences = {i: declare(int, size=max_circuit_depth + 1) for i in generated}
+                if simultaneous:
+                    sequence_lists = sequences
+                else:
+                    sequence_lists = {i: sequences[None] for i in multiplexed_qubits}
+
             # QUA for_ loop over the random sequences
             with for_(m, 0, m < num_of_sequences, m + 1):
                 # Save the counter for the progress bar
                 save(m, m_st)
-                # Generate the random sequence of length max_circuit_depth
-                sequence_list, inv_gate_list = generate_sequence()
-                assign(depth_target, 1)  # Initialize the current depth to 1
-
-                with for_(depth, 1, depth <= max_circuit_depth, depth + 1):
-                    # Replacing the last gate in the sequence with the sequence's inverse gate
-                    # The original gate is saved in 'saved_gate' and is being restored at the end
-                    assign(saved_gate, sequence_list[depth])
-                    assign(sequence_list[depth], inv_gate_list[depth - 1])
-                    # Only played the depth corresponding to target_depth
-                    with if_(depth == depth_target):
-                        with for_(n, 0, n < n_avg, n + 1):
-                            # Initialize the qubits
-                            for i, qubit in multiplexed_qubits.items():
-                                qubit.reset(node.parameters.reset_type, node.parameters.simulate)
-                                # Align the two elements to play the sequence after qubit initialization
-                            align()
-                            # Manipulate the qubits
-                            for i, qubit in multiplexed_qubits.items():
-                                # The strict_timing ensures that the sequence will be played without gaps
-                                if strict_timing:
-                                    with strict_timing_():
-                                        # Play the random sequence of desired depth
-                                        play_sequence(sequence_list, depth, qubit)
-                                else:
-                                    play_sequence(sequence_list, depth, qubit)
-                            align()
-                            # Readout the qubits
-                            for i, qubit in multiplexed_qubits.items():
-                                if node.parameters.use_state_discrimination:
-                                    qubit.readout_state(state[i])
-                                    save(state[i], state_st[i])
-                                else:
-                                    qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
-                                    save(I[i], I_st[i])
-                                    save(Q[i], Q_st[i])
-                            align()
-                        # Go to the next depth
-                        assign(depth_target, depth_target + delta_clifford)
-                    # Reset the last gate of the sequence back to the original Clifford gate
-                    # (that was replaced by the recovery gate at the beginning)
-                    assign(sequence_list[depth], saved_gate)
+                if node.parameters.depth_only_program:
+                    # The sequence is only extended up to the next measured depth, and the recovery gate is
+                    # updated from the state of the sequence after each new Clifford
+                    for cayley, inv_list, current_state, step, rand in generators.values():
+                        assign(current_state, 0)
+                    assign(depth, 0)
+                    with for_(depth_target, 1, depth_target <= max_circuit_depth, depth_target + delta_clifford):
+                        with while_(depth < depth_target):
+                            for i, (cayley, inv_list, current_state, step, rand) in generators.items():
+                                assign(step, rand.rand_int(24))
+                                assign(sequences[i][depth], step)
+                                assign(current_state, cayley[current_state * 24 + step])
+                            assign(depth, depth + 1)
+                        # The recovery gate is played after the last Clifford, it is overwritten when extending
+                        for i, (cayley, inv_list, current_state, step, rand) in generators.items():
+                            assign(sequences[i][depth], inv_list[current_state])
+                        for driven_qubits in drive_configurations:
+                            play_and_measure(sequence_lists, depth, multiplexed_qubits, driven_qubits)
+                else:
+                    # Generate the random sequence of length max_circuit_depth
+                    sequence_list, inv_gate_list = generate_sequence()
+                    sequence_lists = {i: sequence_list for i in multiplexed_qubits}
+                    assign(depth_target, 1)  # Initialize the current depth to 1
+
+                    with for_(depth, 1, depth <= max_circuit_depth, depth + 1):
+                        # Replacing the last gate in the sequence with the sequence's inverse gate
+                        # The original gate is saved in 'saved_gate' and is being restored at the end
+                        assign(saved_gate, sequence_list[depth])
+                        assign(sequence_list[depth], inv_gate_list[depth - 1])
+                        # Only played the depth corresponding to target_depth
+                        with if_(depth == depth_target):
+                            play_and_measure(sequence_lists, depth, multiplexed_qubits)
+                            # Go to the next depth
+                            assign(depth_target, depth_target + delta_clifford)
+                        # Reset the last gate of the sequence back to the original Clifford gate
+                        # (that was replaced by the recovery gate at the beginning)
+                        assign(sequence_list[depth], saved_gate)
 
         with stream_processing():
             m_st.save("n")
+
+            def buffered(stream):
+                stream = stream.buffer(n_avg).map(FUNCTIONS.average())
+                if simultaneous:
+                    stream = stream.buffer(len(drive_configurations))
+                return stream.buffer(num_depths).buffer(num_of_sequences)
+
             for i in range(num_qubits):
                 if node.parameters.use_state_discrimination:
-                    state_st[i].buffer(n_avg).map(FUNCTIONS.average()).buffer(num_depths).buffer(num_of_sequences).save(
-                        f"state{i + 1}"
-                    )
+                    buffered(state_st[i]).save(f"state{i + 1}")
                 else:
-                    I_st[i].buffer(n_avg).map(FUNCTIONS.average()).buffer(num_depths).buffer(num_of_sequences).save(
-                        f"I{i + 1}"
-                    )
-                    Q_st[i].buffer(n_avg).map(FUNCTIONS.average()).buffer(num_depths).buffer(num_of_sequences).save(
-                        f"Q{i + 1}"
-                    )
+                    buffered(I_st[i]).save(f"I{i + 1}")
+                    buffered(Q_st[i]).save(f"Q{i + 1}")
 
 
 # %% {Simulate}
@@ -337,6 +356,13 @@ def analyse_data(node: QualibrationNode[Parameters, Quam]):
     node.results["ds_raw"] = process_raw_dataset(node.results["ds_raw"], node)
     node.results["ds_fit"], fit_results = fit_raw_data(node.results["ds_raw"], node)
     node.results["fit_results"] = {k: asdict(v) for k, v in fit_results.items()}
+    if node.parameters.simultaneous_rb and node.parameters.measure_crosstalk_matrix:
+        # Error per Clifford of each measured qubit when driving each qubit alone
+        crosstalk = node.results["ds_fit"].crosstalk_matrix
+        node.results["crosstalk_matrix"] = {
+            q: {d: float(crosstalk.sel(qubit=q, driven_qubit=d)) for d in crosstalk.driven_qubit.values}
+            for q in crosstalk.qubit.values
+        }
 
     # Log the relevant information extracted from the data analysis
     log_fitted_results(node.results["fit_results"], log_callable=node.log)
@@ -356,6 +382,8 @@ def plot_data(node: QualibrationNode[Parameters, Quam]):
     node.results["figures"] = {
         "amplitude": fig_raw_fit,
     }
+    if node.parameters.simultaneous_rb and node.parameters.measure_crosstalk_matrix:
+        node.results["figures"]["crosstalk_matrix"] = plot_crosstalk_matrix(node.results["ds_fit"])
 
 
 # %% {Update_state}
@@ -9,13 +9,19 @@ from qm.qua import *
 from qualang_tools.multi_user import qm_session
 from qualang_tools.results import progress_counter
 from qualang_tools.units import unit
-from qualang_tools.bakery.randomized_benchmark_c1 import c1_table
 
 from qualibrate import QualibrationNode
 from iqcc_research.quam_config.components.quam_root import Quam
+from iqcc_research.quam_config.lib.clifford_compiler import (
+    CAYLEY_TABLE,
+    INVERSE_TABLE,
+    PULSE_COUNTS_PER_CLIFFORD,
+    play_clifford_sequence,
+)
 from calibration_utils.single_qubit_randomized_benchmarking_interleaved import (
     Parameters,
     get_interleaved_gate_index,
+    sequence_durations,
 )
 from calibration_utils.single_qubit_randomized_benchmarking import (
     process_raw_dataset,
@@ -98,12 +104,12 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
     num_depths = max_circuit_depth // delta_clifford
     seed = node.parameters.seed  # Pseudo-random number generator seed
     interleaved_gate_index = get_interleaved_gate_index(node.parameters.interleaved_gate_operation)
-    # List of recovery gates from the lookup table
-    inv_gates = [int(np.where(c1_table[i, :] == 0)[0][0]) for i in range(24)]
+    # The identity costs no pulse in the compiled Cliffords, an interleaved "I" is played as an idle of one x180 pulse
+    interleave_idle = node.parameters.interleaved_gate_operation == "I"
 
     def generate_sequence(interleaved_gate_index):
-        cayley = declare(int, value=c1_table.flatten().tolist())
-        inv_list = declare(int, value=inv_gates)
+        cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+        inv_list = declare(int, value=INVERSE_TABLE.tolist())
         current_state = declare(int)
         step = declare(int)
         sequence = declare(int, size=2 * max_circuit_depth + 1)
@@ -125,79 +131,8 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
 
         return sequence, inv_gate
 
-    def play_sequence(sequence_list, depth, qubit):
-        i = declare(int)
-        with for_(i, 0, i <= depth, i + 1):
-            with switch_(sequence_list[i], unsafe=True):
-                with case_(0):
-                    qubit.xy.wait(qubit.xy.operations["x180"].length // 4)
-                with case_(1):  # x180
-                    qubit.xy.play("x180")
-                with case_(2):  # y180
-                    qubit.xy.play("y180")
-                with case_(3):  # Z180
-                    qubit.xy.play("y180")
-                    qubit.xy.play("x180")
-                with case_(4):  # Z90 X180 Z-180
-                    qubit.xy.play("x90")
-                    qubit.xy.play("y90")
-                with case_(5):  # Z-90 Y-90 Z-90
-                    qubit.xy.play("x90")
-                    qubit.xy.play("-y90")
-                with case_(6):  # Z-90 X180 Z-180
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                with case_(7):  # Z-90 Y90 Z-90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("-y90")
-                with case_(8):  # X90 Z90
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(9):  # X-90 Z-90
-                    qubit.xy.play("y90")
-                    qubit.xy.play("-x90")
-                with case_(10):  # z90 X90 Z90
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("x90")
-                with case_(11):  # z90 X-90 Z90
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("-x90")
-                with case_(12):  # x90
-                    qubit.xy.play("x90")
-                with case_(13):  # -x90
-                    qubit.xy.play("-x90")
-                with case_(14):  # y90
-                    qubit.xy.play("y90")
-                with case_(15):  # -y90
-                    qubit.xy.play("-y90")
-                with case_(16):  # Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(17):  # -Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("-y90")
-                    qubit.xy.play("x90")
-                with case_(18):  # Y-90 Z-90
-                    qubit.xy.play("x180")
-                    qubit.xy.play("y90")
-                with case_(19):  # Y90 Z90
-                    qubit.xy.play("x180")
-                    qubit.xy.play("-y90")
-                with case_(20):  # Y90 Z-90
-                    qubit.xy.play("y180")
-                    qubit.xy.play("x90")
-                with case_(21):  # Y-90 Z90
-                    qubit.xy.play("y180")
-                    qubit.xy.play("-x90")
-                with case_(22):  # x90 Z-90
-                    qubit.xy.play("x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("x90")
-                with case_(23):  # -x90 Z90
-                    qubit.xy.play("-x90")
-                    qubit.xy.play("y90")
-                    qubit.xy.play("-x90")
+    def interleaved_idle(qubit):
+        return qubit.xy.operations["x180"].length // 4 if interleave_idle else None
 
     # Register the sweep axes to be added to the dataset when fetching data
     depths = np.arange(1, max_circuit_depth + 0.1, delta_clifford)
@@ -218,6 +153,15 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
         # QUA variable for the loop over random sequences
         m = declare(int)
         m_st = declare_stream()
+        # Number of x90 and x180 pulses of the sequence played at each depth
+        x90_per_clifford = declare(int, value=PULSE_COUNTS_PER_CLIFFORD["x90"].tolist())
+        x180_per_clifford = declare(int, value=PULSE_COUNTS_PER_CLIFFORD["x180"].tolist())
+        x90_count = declare(int)
+        x180_count = declare(int)
+        x90_total = declare(int)
+        x180_total = declare(int)
+        x90_count_st = [declare_stream() for _ in range(num_qubits)]
+        x180_count_st = [declare_stream() for _ in range(num_qubits)]
 
         for multiplexed_qubits in qubits.batch():
             # Initialize the QPU in terms of flux points (flux tunable transmons and/or tunable couplers)
@@ -232,8 +176,13 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
                 # Generate the random sequence of length max_circuit_depth
                 sequence_list, inv_gate_list = generate_sequence(interleaved_gate_index=interleaved_gate_index)
                 assign(depth_target, 2)  # Initialize the current depth to 1
+                assign(x90_count, 0)
+                assign(x180_count, 0)
 
                 with for_(depth, 1, depth <= 2 * max_circuit_depth, depth + 1):
+                    # Pulses of the gates before 'depth', which are the original gates of the sequence
+                    assign(x90_count, x90_count + x90_per_clifford[sequence_list[depth - 1]])
+                    assign(x180_count, x180_count + x180_per_clifford[sequence_list[depth - 1]])
                     # Replacing the last gate in the sequence with the sequence's inverse gate
                     # The original gate is saved in 'saved_gate' and is being restored at the end
                     assign(saved_gate, sequence_list[depth])
@@ -252,9 +201,9 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
                                 if strict_timing:
                                     with strict_timing_():
                                         # Play the random sequence of desired depth
-                                        play_sequence(sequence_list, depth, qubit)
+                                        play_clifford_sequence(sequence_list, depth, qubit, interleaved_idle(qubit))
                                 else:
-                                    play_sequence(sequence_list, depth, qubit)
+                                    play_clifford_sequence(sequence_list, depth, qubit, interleaved_idle(qubit))
                             align()
                             # Readout the qubits
                             for i, qubit in multiplexed_qubits.items():
@@ -266,6 +215,12 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
                                     save(I[i], I_st[i])
                                     save(Q[i], Q_st[i])
                             align()
+                        # Save the pulses of the sequence, including the recovery gate
+                        assign(x90_total, x90_count + x90_per_clifford[inv_gate_list[depth - 1]])
+                        assign(x180_total, x180_count + x180_per_clifford[inv_gate_list[depth - 1]])
+                        for i, qubit in multiplexed_qubits.items():
+                            save(x90_total, x90_count_st[i])
+                            save(x180_total, x180_count_st[i])
                         # Go to the next depth
                         assign(depth_target, depth_target + 2 * delta_clifford)
                     # Reset the last gate of the sequence back to the original Clifford gate
@@ -275,6 +230,8 @@ def create_qua_program(node: QualibrationNode[Parameters, Quam]):
         with stream_processing():
             m_st.save("n")
             for i in range(num_qubits):
+                x90_count_st[i].buffer(num_depths).buffer(num_of_sequences).save(f"x90_count{i + 1}")
+                x180_count_st[i].buffer(num_depths).buffer(num_of_sequences).save(f"x180_count{i + 1}")
                 if node.parameters.use_state_discrimination:
                     state_st[i].buffer(n_avg).map(FUNCTIONS.average()).buffer(num_depths).buffer(num_of_sequences).save(
                         f"state{i + 1}"
@@ -345,11 +302,18 @@ def load_data(node: QualibrationNode[Parameters, Quam]):
 def analyse_data(node: QualibrationNode[Parameters, Quam]):
     """Analyse the raw data and store the fitted data in another xarray dataset "ds_fit" and the fitted results in the "fit_results" dictionary."""
     node.results["ds_raw"] = process_raw_dataset(node.results["ds_raw"], node)
+    node.results["ds_raw"]["sequence_duration"] = sequence_durations(node.results["ds_raw"], node)
     node.results["ds_fit"], fit_results = fit_raw_data(node.results["ds_raw"], node)
     node.results["fit_results"] = {k: asdict(v) for k, v in fit_results.items()}
 
     # Log the relevant information extracted from the data analysis
     log_fitted_results(node.results["fit_results"], log_callable=node.log)
+    for q in node.namespace["qubits"]:
+        ds_q = node.results["ds_raw"].sel(qubit=q.name)
+        node.log(
+            f"{q.name}: {float(ds_q.x90_count.mean()):.1f} x90 and {float(ds_q.x180_count.mean()):.1f} x180 pulses, "
+            f"{float(ds_q.sequence_duration.mean()):.0f} ns per sequence on average"
+        )
     node.outcomes = {
         qubit_name: ("successful" if fit_result["success"] else "failed")
         for qubit_name, fit_result in node.results["fit_results"].items()
@@ -21,13 +21,18 @@ Prerequisites:
 
 # %% {Imports}
 from qualibrate import QualibrationNode, NodeParameters
-from iqcc_research.quam_config.components import Quam, Transmon
+from iqcc_research.quam_config.components import Quam
 from iqcc_research.quam_config.macros import qua_declaration, active_reset, readout_state
 from iqcc_research.quam_config.lib.plot_utils import QubitGrid, grid_iter
 from iqcc_research.quam_config.lib.save_utils import fetch_results_as_xarray, load_dataset, save_node
 from qualibration_libs.analysis.fitting import fit_decay_exp, decay_exp
 from qualang_tools.results import progress_counter, fetching_tool
-from iqcc_research.quam_config.lib.RB_z_rotations import c1_table_XZ
+from iqcc_research.quam_config.lib.clifford_compiler import (
+    AVERAGE_PULSES_PER_CLIFFORD,
+    CAYLEY_TABLE,
+    INVERSE_TABLE,
+    play_clifford_sequence,
+)
 from qualang_tools.multi_user import qm_session
 from qualang_tools.units import unit
 from qm import SimulationConfig
@@ -96,8 +101,6 @@ seed = node.parameters.seed  # Pseudo-random number generator seed
 # Flag to enable state discrimination if the readout has been calibrated (rotated blobs and threshold)
 state_discrimination = node.parameters.use_state_discrimination
 strict_timing = node.parameters.use_strict_timing
-# List of recovery gates from the lookup table
-inv_gates = [int(np.where(c1_table_XZ[i, :] == 0)[0][0]) for i in range(24)]
 
 
 # %% {Utility functions}
@@ -106,8 +109,8 @@ def power_law(power, a, b, p):
 
 
 def generate_sequence():
-    cayley = declare(int, value=c1_table_XZ.flatten().tolist())
-    inv_list = declare(int, value=inv_gates)
+    cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+    inv_list = declare(int, value=INVERSE_TABLE.tolist())
     current_state = declare(int)
     step = declare(int)
     sequence = declare(int, size=max_circuit_depth + 1)
@@ -125,129 +128,6 @@ def generate_sequence():
     return sequence, inv_gate
 
 
-def play_sequence(sequence_list, depth, qubit: Transmon):
-    i = declare(int)
-    with for_(i, 0, i <= depth, i + 1):
-        with switch_(sequence_list[i], unsafe=False):
-            with case_(0): # I
-                pass
-            
-            with case_(1): # X180
-                qubit.xy.play("x180")
-                
-            with case_(2): # Y180
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x180")
-                qubit.xy.frame_rotation(np.pi/2)
-                             
-            with case_(3): # Y180,X180
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi)
-                qubit.xy.play("x90")  
-                              
-            with case_(4): # x90, y90
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                                
-            with case_(5): # x90, -y90
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                
-            with case_(6): # x90, y90
-                qubit.xy.play("-x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                
-            with case_(7): # -x90, -y90
-                qubit.xy.play("-x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                
-            with case_(8): # y90 x90      
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                
-            with case_(9): # y90 -x90      
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("-x90")
-
-            with case_(10): # -y90 x90      
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-
-            with case_(11): # -y90 -x90      
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("-x90")
-                                                
-            with case_(12): # x90
-                qubit.xy.play("x90")
-                
-            with case_(13): # -x90
-                qubit.xy.play("-x90")
-                
-            with case_(14): # y90
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                                
-            with case_(15): # -y90
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                                
-            with case_(16): # Z90
-                qubit.xy.frame_rotation(np.pi/2)
-                
-            with case_(17): # -Z90
-                qubit.xy.frame_rotation(-np.pi/2)
-                
-            with case_(18): # x180 y90
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                
-            with case_(19):  # x180 -y90
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                
-            with case_(20): # Y180 X90
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                                
-            with case_(21): # Y180 -X90
-                qubit.xy.frame_rotation(-np.pi/2)
-                qubit.xy.play("x90")
-                qubit.xy.frame_rotation(np.pi/2)
-                qubit.xy.play("-x90")
-                qubit.xy.frame_rotation(-np.pi/2)
-                
-            with case_(22): # x90 Y90 X90
-                qubit.xy.play("x180")
-                qubit.xy.frame_rotation(np.pi/2)
-                
-            with case_(23): # -x90 Y90 -X90
-                qubit.xy.play("x180")
-                qubit.xy.frame_rotation(-np.pi/2)
-
-
 # %% {QUA_program}
 with program() as randomized_benchmarking:
     depth = declare(int)  # QUA variable for the varying depth
@@ -292,9 +172,9 @@ with program() as randomized_benchmarking:
                         if strict_timing:
                             with strict_timing_():
                                 # Play the random sequence of desired depth
-                                play_sequence(sequence_list, depth, qubit)
+                                play_clifford_sequence(sequence_list, depth, qubit)
                         else:
-                            play_sequence(sequence_list, depth, qubit)
+                            play_clifford_sequence(sequence_list, depth, qubit)
                         # Align the two elements to measure after playing the circuit.
                         qubit.align()
                         readout_state(qubit, state[i])
@@ -369,10 +249,8 @@ elif node.parameters.load_data_id is None:
     da_fit = fit_decay_exp(da_state, "m")
     # Extract the decay rate
     alpha = np.exp(da_fit.sel(fit_vals="decay"))
-    # average_gate_per_clifford = 45/24 = 1.875
-    num_of_x_gates = 0*3 + 1*8 + 2*13
-    num_of_z_gates = 0*4 + 1*7 + 2*11 + 3*2
-    average_gate_per_clifford = (num_of_x_gates + 0*num_of_z_gates) / 24
+    # Physical pulses per Clifford with the virtual-Z decomposition of the Clifford compiler (5/6)
+    average_gate_per_clifford = AVERAGE_PULSES_PER_CLIFFORD
     # EPC from here: https://qiskit.org/textbook/ch-quantum-hardware/randomized-benchmarking.html#Step-5:-Fit-the-results
     EPC = (1 - alpha) - (1 - alpha) / 2
     EPG = EPC / average_gate_per_clifford
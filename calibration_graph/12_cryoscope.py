@@ -21,11 +21,11 @@ import matplotlib
 from iqcc_research.quam_config.lib.plot_utils import QubitGrid, grid_iter
 from iqcc_research.quam_config.lib.save_utils import fetch_results_as_xarray
 import xarray as xr
-from scipy.optimize import curve_fit, minimize
-from scipy.signal import deconvolve, lfilter, convolve
 from qualibrate import QualibrationNode, NodeParameters
 from typing import Optional, Literal, List
-from iqcc_research.quam_config.lib.cryoscope_tools import cryoscope_frequency, estimate_fir_coefficients, two_expdecay, expdecay, savgol
+from iqcc_research.quam_config.lib.cryoscope_tools import cryoscope_flux, design_cryoscope_filters, align_step_responses
+from iqcc_research.quam_config.lib.opx_filters import OPXFilterChain, validate_step_response
+from iqcc_research.quam_config.lib.instrument_limits import filter_limits
 
 
 # %% {Node_parameters}
@@ -39,6 +39,10 @@ class Parameters(NodeParameters):
     simulate: bool = False
     timeout: int = 100
     reset_filters: bool = True
+    ellipse_correction: bool = False
+    num_exponentials: int = 2
+    fir_length: int = 28
+    max_predicted_step_deviation: float = 0.01
     load_data_id: Optional[int] = None
     
 node = QualibrationNode(
@@ -113,9 +117,9 @@ cryoscope_len = node.parameters.cryoscope_len  # The length of the cryoscope in
 assert cryoscope_len % 16 == 0, 'cryoscope_len is not multiple of 16 nanoseconds'
 
 baked_signals = {}
-# Baked flux pulse segments with 1ns resolution
-
-baked_signals = baked_waveform(qubits[0].z.operations['const'].amplitude * amplitude_factor, qubits[0]) 
+# Baked flux pulse segments with 1ns resolution, one set per qubit since every qubit is pulsed on its own flux line
+for qubit in qubits:
+    baked_signals[qubit.name] = baked_waveform(qubit.z.operations['const'].amplitude * amplitude_factor, qubit)
 
 cryoscope_time = np.arange(1, cryoscope_len + 1, 1)  # x-axis for plotting - must be in ns
 
@@ -131,11 +135,9 @@ with program() as cryoscope:
     idx = declare(int)
     idx2 = declare(int)
     flag = declare(bool)
-    qubit = qubits[0]
-    i = 0
-    
+
     # Bring the active qubits to the desired frequency point
-    machine.set_all_fluxes(flux_point=flux_point, target=qubit)
+    machine.set_all_fluxes(flux_point=flux_point, target=qubits[0])
 
     # Outer loop for averaging
     with for_(n, 0, n < n_avg, n + 1):
@@ -150,7 +152,7 @@ with program() as cryoscope:
                     for qubit in qubits:
                         active_reset(qubit)
                 else:
-                    wait(qubit.thermalization_time * u.ns)
+                    wait(max(qubit.thermalization_time for qubit in qubits) * u.ns)
                 align()
                 # Play first X/2
                 for qubit in qubits:
@@ -175,11 +177,12 @@ with program() as cryoscope:
                     # elif tomo == 'y90':
                     with else_():
                         qubit.xy.play("y90")
-                # Measure resonator state after the sequence
+                # Measure the state of all the qubits after the sequence
                 align()
-                qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
-                assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
-                save(state[i], state_st[i])
+                for i, qubit in enumerate(qubits):
+                    qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
+                    assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
+                    save(state[i], state_st[i])
 
 
         # The first 16-32 nanoseconds
@@ -191,7 +194,7 @@ with program() as cryoscope:
                     for qubit in qubits:
                         active_reset(qubit)
                 else:
-                    wait(qubit.thermalization_time * u.ns)
+                    wait(max(qubit.thermalization_time for qubit in qubits) * u.ns)
                 align()
                 # Play first X/2
                 for qubit in qubits:
@@ -204,7 +207,8 @@ with program() as cryoscope:
                 with switch_(idx):
                     for j in range(16):
                         with case_(j):
-                            baked_signals[j].run()
+                            for qubit in qubits:
+                                baked_signals[qubit.name][j].run()
                 # Wait for the idle time set slightly above the maximum flux pulse duration to ensure that the 2nd x90
                 # pulse arrives after the longest flux pulse
                 for qubit in qubits:
@@ -216,11 +220,12 @@ with program() as cryoscope:
                     # elif tomo == 'y90':
                     with else_():
                         qubit.xy.play("y90")
-                # Measure resonator state after the sequence
+                # Measure the state of all the qubits after the sequence
                 align()
-                qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
-                assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
-                save(state[i], state_st[i])
+                for i, qubit in enumerate(qubits):
+                    qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
+                    assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
+                    save(state[i], state_st[i])
 
         with for_(t, 8, t < cryoscope_len // 4, t + 4):
 
@@ -234,7 +239,7 @@ with program() as cryoscope:
                         for qubit in qubits:
                             active_reset(qubit)
                     else:
-                        wait(qubit.thermalization_time * u.ns)
+                        wait(max(qubit.thermalization_time for qubit in qubits) * u.ns)
                     align()
                     # Play first X/2
                     for qubit in qubits:
@@ -246,8 +251,9 @@ with program() as cryoscope:
                     with switch_(idx):
                         for j in range(16):
                             with case_(j):
-                                baked_signals[j].run() 
-                                qubits[0].z.play('const', duration=t-4, amplitude_scale =amplitude_factor)
+                                for qubit in qubits:
+                                    baked_signals[qubit.name][j].run()
+                                    qubit.z.play('const', duration=t-4, amplitude_scale =amplitude_factor)
 
                     # Wait for the idle time set slightly above the maximum flux pulse duration to ensure that the 2nd x90
                     # pulse arrives after the longest flux pulse
@@ -260,11 +266,12 @@ with program() as cryoscope:
                         with else_():
                             qubit.xy.play("y90")
 
-                    # Measure resonator state after the sequence
+                    # Measure the state of all the qubits after the sequence
                     align()
-                    qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
-                    assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
-                    save(state[i], state_st[i])
+                    for i, qubit in enumerate(qubits):
+                        qubit.resonator.measure("readout", qua_vars=(I[i], Q[i]))
+                        assign(state[i], Cast.to_int(I[i] > qubit.resonator.operations["readout"].threshold))
+                        save(state[i], state_st[i])
 
     with stream_processing():
         # for the progress counter
@@ -305,233 +312,102 @@ elif node.parameters.load_data_id is None:
 if not node.parameters.simulate:
     if node.parameters.load_data_id is None:
         # Fetch the data from the OPX and convert it into a xarray with corresponding axes (from most inner to outer loop)
-        ds = fetch_results_as_xarray(job.result_handles, [qubit], {"axis": ["x","y"], "time": cryoscope_time})
+        ds = fetch_results_as_xarray(job.result_handles, qubits, {"axis": ["x","y"], "time": cryoscope_time})
         plot_process = True
         node.results['ds'] = ds
     else:
         node = node.load_from_id(node.parameters.load_data_id)
         ds = node.results["ds"]
-# %%
+# %% {Data_analysis}
 if not node.parameters.simulate:
     if plot_process:
-        ds.state.sel(qubit= qubits[0].name).plot(hue = 'axis')
+        ds.state.plot(hue='axis', col='qubit')
         plt.show()
 
-    sg_order = 2
-    sg_range = 3
-    qubit = qubits[0]
-    da = ds.state.sel(qubit= qubit.name)
-
-    flux_cryoscope_q = cryoscope_frequency(da, 
-                                           quad_term=qubit.freq_vs_flux_01_quad_term,
-                                           stable_time_indices=(20, cryoscope_len-20),  
-                                           sg_order=sg_order,
-                                           sg_range=sg_range, plot=plot_process)
-    plt.show()
+    # flux seen by all the qubits at once, the frequency to flux conversion is done once per qubit
+    flux_cryoscope = cryoscope_flux(ds.state,
+                                    quad_terms=[machine.qubits[q].freq_vs_flux_01_quad_term for q in ds.qubit.values],
+                                    stable_time_indices=(20, -20),
+                                    sg_order=2,
+                                    sg_range=3,
+                                    ellipse_correction=node.parameters.ellipse_correction)
+    node.results['ds']['flux'] = flux_cryoscope
 
 # %%
 if not node.parameters.simulate and node.parameters.reset_filters:
-        # extract the rising part of the data for analysis
-    threshold = flux_cryoscope_q.max().values*0.6 # Set the threshold value
-    rise_index = np.argmax(flux_cryoscope_q.values > threshold) + 1
-    drop_index =  len(flux_cryoscope_q) - 4
-    flux_cryoscope_tp = flux_cryoscope_q.sel(time=slice(rise_index,drop_index ))
-    flux_cryoscope_tp = flux_cryoscope_tp.assign_coords(
-        time=flux_cryoscope_tp.time - rise_index + 1)
-
-
-    f,axs = plt.subplots(2)
-    flux_cryoscope_q.plot(ax = axs[0])
-    axs[0].axvline(rise_index, color='r', lw = 0.5, ls = '--')
-    axs[0].axvline(drop_index, color='r', lw = 0.5, ls = '--')
-    flux_cryoscope_tp.plot(ax = axs[1])
-    node.results['figure'] = f
-    plt.show()
-    
-# %%
-if not node.parameters.simulate and node.parameters.reset_filters:
-    # Fit two exponents
-    # Filtering the data might improve the fit at the first few nS, play with range to achieve this
-    filtered_flux_cryoscope_q = savgol(flux_cryoscope_tp, 'time', range = 3, order = 2)
-    da = flux_cryoscope_tp
-
-    first_vals = da.sel(time=slice(0, 1)).mean().values
-    final_vals = da.sel(time=slice(50, None)).mean().values
-
-    try:
-        p0 = [final_vals, -1+first_vals/final_vals, 50]
-        fit, _  = curve_fit(expdecay, da.time[5:], da[5:],
-                p0=p0)
-    except:
-        fit = p0
-        print('single exp fit failed')
-    try:
-        p0 = [fit[0], fit[1], 5, fit[1], fit[2]]
-        fit2, _ = curve_fit(two_expdecay, filtered_flux_cryoscope_q.time[4:], filtered_flux_cryoscope_q[4:],
-                p0 = p0)
-    except:
-        fit2 = p0
-        print('two exp fit failed')
-        
-    if plot_process:
-        da.plot(marker = '.')
-        # plt.plot(filtered_flux_cryoscope_q.time, filtered_flux_cryoscope_q, label = 'filtered')
-        plt.plot(da.time, expdecay(da.time, *fit), label = 'fit single exp')
-        if fit2 is not None:
-            plt.plot(da.time, two_expdecay(da.time, *fit2), label = 'fit two exp')
-        plt.legend()
-        plt.show()
-
-    # Print fit2 parameters nicely (two_expdecay function)
-    if fit2 is not None:
-        print("Fit2 parameters (two_expdecay function):")
-        print(f"s: {fit2[0]:.6f}")
-        print(f"a: {fit2[1]:.6f}")
-        print(f"t: {fit2[2]:.6f}")
-        print(f"a2: {fit2[3]:.6f}")
-        print(f"t2: {fit2[4]:.6f}")
-
-    # Print fit parameters nicely (expdecay function)
-    print("\nFit parameters (expdecay function):")
-    print(f"s: {fit[0]:.6f}")
-    print(f"a: {fit[1]:.6f}")
-    print(f"t: {fit[2]:.6f}")
-
-    # %%
-    from qualang_tools.digital_filters import exponential_decay, single_exponential_correction, bounce_and_delay_correction, calc_filter_taps
-
-    feedforward_taps_1exp, feedback_tap_1exp = calc_filter_taps(exponential=list(zip([fit[1]*1.0],[fit[2]])))
-    feedforward_taps_2exp, feedback_tap_2exp = calc_filter_taps(exponential=list(zip([fit2[1],fit2[3]],[fit2[2],fit2[4]])))
-
-    FIR_1exp = feedforward_taps_1exp
-    FIR_2exp = feedforward_taps_2exp
-    IIR_1exp = [1,-feedback_tap_1exp[0]]
-    IIR_2exp = convolve([1,-feedback_tap_2exp[0]],[1,-feedback_tap_2exp[1]], mode='full')
-    
-    filtered_response_long_1exp = lfilter(FIR_1exp,IIR_1exp, flux_cryoscope_q)
-    filtered_response_long_2exp = lfilter(FIR_2exp,IIR_2exp, flux_cryoscope_q)
-
-    if plot_process:
-        f,ax = plt.subplots()
-        ax.plot(flux_cryoscope_q.time,flux_cryoscope_q,label = 'data')
-        ax.plot(flux_cryoscope_q.time,filtered_response_long_1exp,label = 'filtered long time 1exp')
-        ax.plot(flux_cryoscope_q.time,filtered_response_long_2exp,label = 'filtered long time 2exp')
-        ax.set_ylim([final_vals*0.9,final_vals*1.05])
-        ax.legend()
-        plt.show()
-
-
-
-# %%
-if not node.parameters.simulate and node.parameters.reset_filters:
-    ####  FIR filter for the response
-    fitting_approach = '2exp'
-    if fitting_approach == '1exp':
-        filtered_response_long = filtered_response_long_1exp
-        long_FIR = FIR_1exp
-        long_IIR = IIR_1exp
-    elif fitting_approach == '2exp':
-        filtered_response_long = filtered_response_long_2exp
-        long_FIR = FIR_2exp
-        long_IIR = IIR_2exp
-    
-    flux_q = flux_cryoscope_q.copy()
-    flux_q.values = filtered_response_long
-    flux_q_tp = flux_q.sel(time=slice(rise_index, 200)) # calculate the FIR only based on the first 200 nS
-    flux_q_tp = flux_q_tp.assign_coords(
-        time=flux_q_tp.time - rise_index)
-    final_vals = flux_q_tp.sel(time=slice(100, None)).mean().values
-    step = np.ones(len(flux_q)+100)*final_vals
-    fir_est = estimate_fir_coefficients(step, flux_q_tp.values, 28)
-
-    FIR_new = fir_est
-
-    convolved_fir = convolve(long_FIR,FIR_new, mode='full')
-    filtered_response_Full = lfilter(convolved_fir,long_IIR, flux_cryoscope_q)
-
-    if plot_process:
-        flux_cryoscope_q.plot(label =  'data')
-        plt.plot(filtered_response_long, label = 'filtered long time')
-        plt.plot(filtered_response_Full, label = 'filtered full, deconvolved')
-        plt.axhline(final_vals*1.001, color = 'k')
-        plt.axhline(final_vals*0.999, color = 'k')
-        plt.ylim([final_vals*0.95,final_vals*1.05])
-        plt.legend()
-        plt.show()
-
-
-# %%
-if not node.parameters.simulate and node.parameters.reset_filters:
-    def find_diff(x, y, y0, plot = False):
-        filterd_y  = lfilter(x,[1,0], y)
-        diffs = np.sum(np.abs(filterd_y - y0))
-        if plot:
-            plt.plot(filterd_y)
-        return diffs
-
-    result = minimize(find_diff, x0=FIR_new, args = (filtered_response_long[:100],np.mean(filtered_response_long[rise_index+50:drop_index])),
-                      bounds = [(-3,3)]*len(FIR_new))
-
-    convolved_fir = convolve(long_FIR,result.x, mode='full')
-    if np.abs(np.max(convolved_fir)) > 2:
-        convolved_fir=1.99*convolved_fir/np.max(np.abs(convolved_fir))
-    filtered_response_Full = lfilter(convolved_fir,long_IIR, flux_cryoscope_q)
-
-    if plot_process:
-        flux_cryoscope_q.plot(label =  'data')
-        plt.plot(filtered_response_long, label = 'filtered long time')
-        plt.plot(filtered_response_Full, label = 'filtered full, fitted')
-        plt.axhline(final_vals*1.001, color = 'k')
-        plt.axhline(final_vals*0.999, color = 'k')
-        plt.ylim([final_vals*0.95,final_vals*1.05])
-        plt.legend()
-        plt.show()
+    # exponential (IIR) and FIR corrections of all the qubits
+    filters = design_cryoscope_filters(flux_cryoscope,
+                                       n_components=node.parameters.num_exponentials,
+                                       fir_length=node.parameters.fir_length,
+                                       limits=[filter_limits(machine.qubits[q].z.opx_output) for q in flux_cryoscope.qubit.values])
+    node.results['filters'] = filters
+
+    # emulate the designed taps on the hardware of each flux line, and reject the ones not flattening the step
+    aligned_flux, _ = align_step_responses(flux_cryoscope)
+    filters_accepted = {}
+    filter_taps = {}
+    for q in filters.qubit.values:
+        if not filters.success.sel(qubit=q):
+            filters_accepted[q] = False
+            continue
+        # on the LF-FEM the exponentials have their own sections, on the OPX+ they are merged into the taps
+        if filters.exponential_sections.sel(qubit=q):
+            exponential = list(zip(filters.amplitude.sel(qubit=q).values.tolist(), filters.tau.sel(qubit=q).values.tolist()))
+            feedback = []
+        else:
+            exponential = []
+            feedback = filters.feedback.sel(qubit=q).values.tolist()
+        feedforward = filters.feedforward.sel(qubit=q).values
+        chain = OPXFilterChain.from_port(machine.qubits[q].z.opx_output,
+                                         feedforward=feedforward[~np.isnan(feedforward)].tolist(),
+                                         feedback=feedback,
+                                         exponential=exponential)
+        filter_taps[q] = {'fir': chain.feedforward, 'iir': chain.feedback, 'exponential': chain.exponential}
+        filters_accepted[q], report = validate_step_response(chain, aligned_flux.sel(qubit=q).values,
+                                                             tolerance=node.parameters.max_predicted_step_deviation)
+        print(f"{q}: predicted step deviation {report['max_deviation']:.2e}"
+              + (f", limits violated: {report['violations']}" if report['violations'] else ""))
+
+    for q in filters.qubit.values:
+        print(f"{q}: " + ", ".join(f"a{i+1} = {a:.4f}, t{i+1} = {t:.1f} ns" for i, (a, t) in
+                                   enumerate(zip(filters.amplitude.sel(qubit=q).values, filters.tau.sel(qubit=q).values))))
 
 # %%
-if not node.parameters.simulate and node.parameters.reset_filters:
+if not node.parameters.simulate:
     # plotting the results
-    fig,ax = plt.subplots()
-    ax.plot(flux_cryoscope_q.time,flux_cryoscope_q/np.mean(flux_cryoscope_q[-50:]),label = 'data')
-    ax.plot(flux_cryoscope_q.time,filtered_response_long/np.mean(filtered_response_long[-50:]),'--', label = 'slow rise correction')
-    ax.plot(flux_q.time,filtered_response_Full/np.mean(filtered_response_Full[-50:]),'--', label = 'expected corrected response')
-    ax.axhline(1.001, color = 'k')
-    ax.axhline(0.999, color = 'k')
-    ax.set_ylim([0.95,1.05])
-    ax.legend()
-    ax.set_xlabel('time (ns)')
-    ax.set_ylabel('normalized amplitude')
-    node.results['figure'] = fig
-elif not node.parameters.simulate:
-    fig,ax = plt.subplots()
-    ax.plot(flux_cryoscope_q.time,flux_cryoscope_q/np.mean(flux_cryoscope_q[-50:]),label = 'data')
-    ax.axhline(1.001, color = 'k')
-    ax.axhline(0.999, color = 'k')
-    ax.set_ylim([0.95,1.05])
-    ax.set_xlabel('time (ns)')
-    ax.set_ylabel('normalized amplitude')    
-    ax.legend()
+    fig, axs = plt.subplots(1, flux_cryoscope.sizes['qubit'], squeeze=False, figsize=(5 * flux_cryoscope.sizes['qubit'], 4))
+    for ax, q in zip(axs[0], flux_cryoscope.qubit.values):
+        flux_q = flux_cryoscope.sel(qubit=q)
+        ax.plot(flux_q.time, flux_q / np.mean(flux_q[-50:]), label='data')
+        if node.parameters.reset_filters:
+            corrected_q = filters.corrected_flux.sel(qubit=q)
+            ax.plot(corrected_q.time, corrected_q / np.mean(corrected_q[-50:]), '--', label='expected corrected response')
+        ax.axhline(1.001, color='k')
+        ax.axhline(0.999, color='k')
+        ax.set_ylim([0.95, 1.05])
+        ax.set_xlabel('time (ns)')
+        ax.set_ylabel('normalized amplitude')
+        ax.set_title(q)
+        ax.legend()
     node.results['figure'] = fig
+    plt.show()
+
 # %%
 if not node.parameters.simulate and node.parameters.reset_filters:
     node.results['fit_results'] = {}
-    for q in qubits:
-        node.results['fit_results'][q.name] = {}
-        node.results['fit_results'][q.name]['fir'] = convolved_fir.tolist()
-        if fitting_approach == '1exp':
-            node.results['fit_results'][q.name]['iir'] = feedback_tap_1exp
-        elif fitting_approach == '2exp':
-            node.results['fit_results'][q.name]['iir']  = feedback_tap_2exp  
+    for q in filters.qubit.values:
+        if filters_accepted[q]:
+            node.results['fit_results'][q] = filter_taps[q]
 
 # %% {Update_state}
 
 if not node.parameters.simulate and node.parameters.reset_filters:
     with node.record_state_updates():
-        for qubit in qubits:
-            qubit.z.opx_output.feedforward_filter = convolved_fir.tolist()
-            if fitting_approach == '1exp':
-                qubit.z.opx_output.feedback_filter = feedback_tap_1exp
-            elif fitting_approach == '2exp':
-                qubit.z.opx_output.feedback_filter = feedback_tap_2exp
+        for q, fit_result in node.results['fit_results'].items():
+            machine.qubits[q].z.opx_output.feedforward_filter = fit_result['fir']
+            machine.qubits[q].z.opx_output.feedback_filter = fit_result['iir']
+            if fit_result['exponential']:
+                machine.qubits[q].z.opx_output.exponential_filter = fit_result['exponential']
 
 # %% {Save_results}
 node.results['initial_parameters'] = node.parameters.model_dump()
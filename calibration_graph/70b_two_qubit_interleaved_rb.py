@@ -48,10 +48,12 @@ from qualang_tools.results import progress_counter, fetching_tool
 
 from qualibrate import NodeParameters, QualibrationNode
 
-from calibration_utils.two_qubit_interleaved_rb.circuit_utils import layerize_quantum_circuit, process_circuit_to_integers
+from calibration_utils.two_qubit_interleaved_rb.circuit_utils import circuit_to_layer_integers
 from calibration_utils.two_qubit_interleaved_rb.qua_utils import QuaProgramHandler
 from calibration_utils.two_qubit_interleaved_rb.cloud_utils import write_sync_hook
 from calibration_utils.two_qubit_interleaved_rb.rb_utils import InterleavedRB
+from calibration_utils.two_qubit_interleaved_rb.clifford_table import generate_circuits_as_ints
+from calibration_utils.two_qubit_interleaved_rb import parallel_utils
 from calibration_utils.two_qubit_interleaved_rb.plot_utils import gate_mapping
 
 from iqcc_research.quam_config.lib.plot_utils import plot_samples
@@ -72,7 +74,12 @@ class Parameters(NodeParameters):
     flux_point_joint_or_independent: Literal["joint", "independent"] = "joint"
     reset_type_thermal_or_active: Literal["thermal", "active"] = "thermal"
     reduce_to_1q_cliffords: bool = True
+    use_clifford_table: bool = True # draw the circuits from the precomputed 2Q Clifford table instead of qiskit
+    num_generation_workers: int = 1 # processes generating the qiskit circuits (when use_clifford_table is False)
     use_input_stream: bool = False
+    double_buffered_input_stream: bool = True # alternate the batches between two input streams
+    packed_input_stream: bool = True # send 4 gates per integer in the input streams
+    parallel_pairs: bool = False # run the pairs with no shared qubit or coupler simultaneously (without input streams), check the gate timing in the simulator first
     simulate: bool = False
     simulation_duration_ns: int = 10000
     load_data_id: Optional[int] = None
@@ -107,20 +114,35 @@ config = machine.generate_config()
 
 # %% {Random circuit generation}
 
-interleaved_RB = InterleavedRB(
-    target_gate=node.parameters.target_gate,
-    amplification_lengths=node.parameters.circuit_lengths,
-    num_circuits_per_length=node.parameters.num_circuits_per_length,
-    basis_gates=node.parameters.basis_gates,
-    num_qubits=2,
-    reduce_to_1q_cliffords=node.parameters.reduce_to_1q_cliffords,
-    seed=node.parameters.seed
-)
+if node.parameters.use_clifford_table:
+    transpiled_circuits_as_ints = generate_circuits_as_ints(
+        circuit_lengths=node.parameters.circuit_lengths,
+        num_circuits_per_length=node.parameters.num_circuits_per_length,
+        target_gate=node.parameters.target_gate,
+        reduce_to_1q_cliffords=node.parameters.reduce_to_1q_cliffords,
+        seed=node.parameters.seed
+    )
+else:
+    interleaved_RB = InterleavedRB(
+        target_gate=node.parameters.target_gate,
+        amplification_lengths=node.parameters.circuit_lengths,
+        num_circuits_per_length=node.parameters.num_circuits_per_length,
+        basis_gates=node.parameters.basis_gates,
+        num_qubits=2,
+        reduce_to_1q_cliffords=node.parameters.reduce_to_1q_cliffords,
+        seed=node.parameters.seed,
+        generate_circuits=node.parameters.num_generation_workers == 1
+    )
 
-transpiled_circuits = interleaved_RB.transpiled_circuits
-transpiled_circuits_as_ints = {}
-for l, circuits in transpiled_circuits.items():
-    transpiled_circuits_as_ints[l] = [process_circuit_to_integers(layerize_quantum_circuit(qc)) for qc in circuits]
+    if node.parameters.num_generation_workers > 1:
+        transpiled_circuits_as_ints = parallel_utils.generate_circuits_as_ints(
+            interleaved_RB, interleaved=True, num_workers=node.parameters.num_generation_workers
+        )
+    else:
+        transpiled_circuits = interleaved_RB.transpiled_circuits
+        transpiled_circuits_as_ints = {}
+        for l, circuits in transpiled_circuits.items():
+            transpiled_circuits_as_ints[l] = [circuit_to_layer_integers(qc) for qc in circuits]
 
 circuits_as_ints = []
 for circuits_per_len in transpiled_circuits_as_ints.values():
@@ -132,7 +154,11 @@ for circuits_per_len in transpiled_circuits_as_ints.values():
 
 num_pairs = len(qubit_pairs)
 
-qua_program_handler = QuaProgramHandler(node, num_pairs, circuits_as_ints, machine, qubit_pairs)
+qua_program_handler = QuaProgramHandler(
+    node, num_pairs, circuits_as_ints, machine, qubit_pairs, double_buffered=node.parameters.double_buffered_input_stream,
+    packed=node.parameters.packed_input_stream, parallel=node.parameters.parallel_pairs and not node.parameters.use_input_stream
+)
+print(f"Qubit pair groups: {[[qubit_pairs[i].name for i in group] for group in qua_program_handler.pair_groups]}")
 
 rb = qua_program_handler.get_qua_program()
 
@@ -149,19 +175,16 @@ elif node.parameters.load_data_id is None:
     
     with qm_session(qmm, config, timeout=node.parameters.timeout) as qm:
         if node.parameters.use_input_stream:
-            num_sequences = len(qua_program_handler.sequence_lengths)
-            circuits_as_ints_batched_padded = [batch + [0] * (qua_program_handler.max_current_sequence_length - len(batch)) for batch in qua_program_handler.circuits_as_ints_batched]    
-            
             if machine.network['cloud']:
-                write_sync_hook(circuits_as_ints_batched_padded)
+                write_sync_hook(
+                    qua_program_handler.circuits_as_ints_batched_padded * num_pairs, qua_program_handler.input_stream_names
+                )
 
                 job = qm.execute(rb,
                         terminal_output=True,options={"sync_hook": "sync_hook.py"})
             else:
                 job = qm.execute(rb)
-                for id, batch in enumerate(circuits_as_ints_batched_padded):
-                    job.push_to_input_stream("sequence", batch)
-                    print(f"{id}/{num_sequences}: Received ")
+                qua_program_handler.push_sequences(job)
         
         else:
             job = qm.execute(rb)
@@ -172,6 +195,10 @@ elif node.parameters.load_data_id is None:
             n = results.fetch_all()[0]
             # Progress bar
             progress_counter(n, node.parameters.num_averages, start_time=results.start_time)
+        
+        if node.parameters.use_input_stream and len(qua_program_handler.sequence_lengths) > 1:
+            idle_times = qua_program_handler.input_stream_idle_times(job)
+            print(f"OPX idle time between batches: {idle_times.mean() / 1e3:.1f} us on average, {idle_times.max() / 1e3:.1f} us at most")
 
 # %% {Plot_sequence}
 
@@ -227,13 +254,15 @@ probs_00 = probs_00.astype(int)
 ds_transposed = ds.rename({"shots": "average", "sequence": "repeat", "depths": "circuit_depth"})
 ds_transposed = ds_transposed.transpose("qubit", "repeat", "circuit_depth", "average")
 
+rb_results = {}
 for qp in qubit_pairs:
 
-    rb_result = RBResult(
+    rb_results[qp.name] = rb_result = RBResult(
         circuit_depths=list(node.parameters.circuit_lengths),
         num_repeats=node.parameters.num_circuits_per_length,
         num_averages=node.parameters.num_averages,
-        state=ds_transposed.sel(qubit=qp.name).state.data
+        state=ds_transposed.sel(qubit=qp.name).state.data,
+        qubit_pair=qp.name
     )
 
     rb_result.plot_with_fidelity()
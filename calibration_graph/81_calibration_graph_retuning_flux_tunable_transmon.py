@@ -4,6 +4,7 @@ from qualibrate.orchestration.basic_orchestrator import BasicOrchestrator
 from qualibrate.parameters import GraphParameters
 from qualibrate.qualibration_graph import QualibrationGraph
 from qualibrate.qualibration_library import QualibrationLibrary
+from iqcc_research.quam_config.lib.fit_telemetry import reset_graph_run_telemetry, summarize_graph_run_telemetry
 
 library = QualibrationLibrary.get_active_library()
 
@@ -12,39 +13,41 @@ class Parameters(GraphParameters):
     qubits: List[str] = ["q1"]
 
 
+nodes = {
+    "IQ_blobs": library.nodes["07_iq_blobs"].copy(name="IQ_blobs"),
+    "ramsey_vs_flux_calibration": library.nodes["09_ramsey_vs_flux_calibration"].copy(
+        name="ramsey_vs_flux_calibration"
+    ),
+    "power_rabi_error_amplification_x180": library.nodes["04b_power_rabi"].copy(
+        name="power_rabi_error_amplification_x180",
+        max_number_pulses_per_sweep=200,
+        min_amp_factor=0.98,
+        max_amp_factor=1.02,
+        amp_factor_step=0.002,
+        use_state_discrimination=True,
+    ),
+    "power_rabi_error_amplification_x90": library.nodes["04b_power_rabi"].copy(
+        name="power_rabi_error_amplification_x90",
+        max_number_pulses_per_sweep=200,
+        min_amp_factor=0.98,
+        max_amp_factor=1.02,
+        amp_factor_step=0.002,
+        operation="x90",
+        update_x90=False,
+        use_state_discrimination=True,
+    ),
+    "Randomized_benchmarking": library.nodes["11a_single_qubit_randomized_benchmarking"].copy(
+        name="Randomized_benchmarking",
+        use_state_discrimination=True,
+        delta_clifford=20,
+        num_random_sequences=500,
+    ),
+}
+
 g = QualibrationGraph(
     name="FluxTunableTransmon_Retuning",
     parameters=Parameters(),
-    nodes={
-        "IQ_blobs": library.nodes["07_iq_blobs"].copy(name="IQ_blobs"),
-        "ramsey_vs_flux_calibration": library.nodes["09_ramsey_vs_flux_calibration"].copy(
-            name="ramsey_vs_flux_calibration"
-        ),
-        "power_rabi_error_amplification_x180": library.nodes["04b_power_rabi"].copy(
-            name="power_rabi_error_amplification_x180",
-            max_number_pulses_per_sweep=200,
-            min_amp_factor=0.98,
-            max_amp_factor=1.02,
-            amp_factor_step=0.002,
-            use_state_discrimination=True,
-        ),
-        "power_rabi_error_amplification_x90": library.nodes["04b_power_rabi"].copy(
-            name="power_rabi_error_amplification_x90",
-            max_number_pulses_per_sweep=200,
-            min_amp_factor=0.98,
-            max_amp_factor=1.02,
-            amp_factor_step=0.002,
-            operation="x90",
-            update_x90=False,
-            use_state_discrimination=True,
-        ),
-        "Randomized_benchmarking": library.nodes["11a_single_qubit_randomized_benchmarking"].copy(
-            name="Randomized_benchmarking",
-            use_state_discrimination=True,
-            delta_clifford=20,
-            num_random_sequences=500,
-        ),
-    },
+    nodes=nodes,
     connectivity=[
         ("IQ_blobs", "ramsey_vs_flux_calibration"),
         ("ramsey_vs_flux_calibration", "power_rabi_error_amplification_x180"),
@@ -54,4 +57,10 @@ g = QualibrationGraph(
     orchestrator=BasicOrchestrator(skip_failed=False),
 )
 
+reset_graph_run_telemetry()
 g.run()
+# %% {Fit_telemetry}
+# Wall time (or batched call share), number of function evaluations and success of all the fits of the graph run
+fit_telemetry = summarize_graph_run_telemetry()
+for node_name, node_summary in fit_telemetry["nodes"].items():
+    nodes[node_name].log(f"Fit telemetry: {node_summary}")
@@ -44,7 +44,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
 import time
-import quam_libs.lib.cryoscope_tools as cryoscope_tools
+import iqcc_research.quam_config.lib.cryoscope_tools as cryoscope_tools
 start = time.time()
 # %% {Node_parameters}
 class Parameters(NodeParameters):
@@ -61,6 +61,8 @@ class Parameters(NodeParameters):
         flux_amp (float): Amplitude of flux pulse
         update_lo (bool): Whether to update local oscillator frequency
         fit_single_exponential (bool): Use single vs double exponential fit
+        fitting_method (str): Joint variable-projection fit ("varpro") or sequential fits with optimized start fractions ("sequential")
+        fitting_base_fractions (List[float]): Start fractions of the sequential fit, its length sets the number of exponentials
         update_state (bool): Update system state with fit results
         flux_point_joint_or_independent (str): Flux point handling method
         simulate (bool): Run in simulation mode
@@ -83,6 +85,7 @@ class Parameters(NodeParameters):
     frequency_step_in_mhz: float = 0.45
     flux_amp : float = 0.06
     update_lo: bool = True
+    fitting_method: Literal["varpro", "sequential"] = "varpro"
     fitting_base_fractions: List[float] = [0.4, 0.15, 0.07] # fraction of times from which to fit each exponential
     update_state: bool = False
     flux_point_joint_or_independent: Literal["joint", "independent"] = "joint"
@@ -310,9 +313,17 @@ for q in qubits:
     fit_results[q.name] = {}
     t_data = flux_response.sel(qubit=q.name).time.values
     y_data = flux_response.sel(qubit=q.name).values
-    fit_successful, best_fractions, best_components, best_a_dc, best_rms = cryoscope_tools.optimize_start_fractions(
-        t_data, y_data, node.parameters.fitting_base_fractions, bounds_scale=0.5
-        )
+    if node.parameters.fitting_method == "varpro":
+        # all the exponentials are fitted jointly, the number of components is set by the base fractions
+        fit_successful, best_components, best_a_dc, residual = cryoscope_tools.varpro_exp_fit(
+            t_data, y_data, len(node.parameters.fitting_base_fractions)
+            )
+        best_fractions = None
+        best_rms = np.sqrt(np.mean(residual**2))
+    else:
+        fit_successful, best_fractions, best_components, best_a_dc, best_rms = cryoscope_tools.optimize_start_fractions(
+            t_data, y_data, node.parameters.fitting_base_fractions, bounds_scale=0.5
+            )
 
     fit_results[q.name]["fit_successful"] = fit_successful
     fit_results[q.name]["best_fractions"] = best_fractions
@@ -405,9 +416,9 @@ if node.parameters.load_data_id is None:
         with node.record_state_updates():
             for q in qubits:
                 if fit_results[q.name]["fit_successful"]:
-                    q.z.opx_output.exponential_filter = [[amp / best_a_dc, tau] 
-                        for amp, tau in fit_results[q.name]["best_components"]
-                        ]
+                    q.z.opx_output.exponential_filter = cryoscope_tools.exponential_filter_taps(
+                        fit_results[q.name]["best_components"], fit_results[q.name]["best_a_dc"]
+                        )
                     print("updated the exponential filter")
 
 # %% {Save_results}
@@ -5,7 +5,9 @@ from dataclasses import dataclass
 from typing import Tuple
 from qualibrate import QualibrationNode
 from qualibration_libs.data import convert_IQ_to_V
-from qualibration_libs.analysis import fit_decay_exp
+from qualibration_libs.analysis import fit_decay_exp, decay_exp
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+from iqcc_research.quam_config.lib.fit_cache import FitCache, fit_with_warm_start, update_fit_cache
 
 
 @dataclass
@@ -74,15 +76,30 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
         Dataset containing the fit results.
     """
 
-    # Fit the exponential decay
-    if node.parameters.use_state_discrimination:
-        fit_data = fit_decay_exp(ds.state, "idle_time")
+    telemetry = FitTelemetry()
+    data = ds.state if node.parameters.use_state_discrimination else ds.I
+    # Fit the exponential decay, starting from the last successful fit of each qubit when available
+    if node.parameters.warm_start_fit:
+        cache = FitCache()
+        fit_data = fit_with_warm_start(
+            data,
+            "idle_time",
+            "decay_exp",
+            telemetry.instrument(fit_decay_exp, model=decay_exp),
+            node.name,
+            cache,
+            telemetry=telemetry,
+        )
     else:
-        fit_data = fit_decay_exp(ds.I, "idle_time")
+        fit_data = telemetry.instrument(fit_decay_exp, model=decay_exp)(data, "idle_time")
 
     ds_fit = xr.merge([ds, fit_data.rename("fit_data")])
     # Extract the relevant fitted parameters
     fit_data, fit_results = _extract_relevant_fit_parameters(ds_fit)
+    # Store the successful fits as the starting point of the next run
+    if node.parameters.warm_start_fit:
+        update_fit_cache(fit_data.fit_data, fit_data.success, "decay_exp", node.name, cache)
+    telemetry.attach_to_node(node)
 
     return fit_data, fit_results
 
@@ -6,6 +6,9 @@ from qualibration_libs.parameters import QubitsExperimentNodeParameters, CommonN
 class NodeSpecificParameters(RunnableParameters):
     num_shots: int = 1000
     """Number of averages to perform. Default is 1000."""
+    warm_start_fit: bool = True
+    """Whether to start the fit from the last successful fit parameters of each qubit, falling back to generic
+    initial guesses when the warm fit fails. Default is True."""
 
 
 class Parameters(
@@ -6,7 +6,8 @@ import xarray as xr
 
 from qualibrate import QualibrationNode
 from qualibration_libs.data import convert_IQ_to_V
-from qualibration_libs.analysis import fit_decay_exp
+from qualibration_libs.analysis import fit_decay_exp, decay_exp
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -74,14 +75,16 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
         Dataset containing the fit results.
     """
     ds_fit = ds
+    telemetry = FitTelemetry()
     # # Fit the exponential decay
     if node.parameters.use_state_discrimination:
-        fit_data = fit_decay_exp(ds_fit.state, "idle_time")
+        fit_data = telemetry.instrument(fit_decay_exp, model=decay_exp)(ds_fit.state, "idle_time")
     else:
-        fit_data = fit_decay_exp(ds_fit.I, "idle_time")
+        fit_data = telemetry.instrument(fit_decay_exp, model=decay_exp)(ds_fit.I, "idle_time")
     ds_fit = xr.merge([ds, fit_data.rename("fit_data")])
 
     ds_fit, fit_results = _extract_relevant_fit_parameters(ds_fit)
+    telemetry.attach_to_node(node)
     return ds_fit, fit_results
 
 
@@ -6,7 +6,9 @@ import xarray as xr
 
 from qualibrate import QualibrationNode
 from qualibration_libs.data import convert_IQ_to_V
-from qualibration_libs.analysis import fit_oscillation
+from qualibration_libs.analysis import fit_oscillation, oscillation
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+from iqcc_research.quam_config.lib.fit_cache import FitCache, fit_with_warm_start, update_fit_cache
 from iqcc_research.quam_config.instrument_limits import instrument_limits
 
 
@@ -71,13 +73,24 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     xr.Dataset
         Dataset containing the fit results.
     """
+    telemetry = FitTelemetry()
     if node.parameters.max_number_pulses_per_sweep == 1:
         ds_fit = ds.sel(nb_of_pulses=1)
-        # Fit the power Rabi oscillations
-        if node.parameters.use_state_discrimination:
-            fit_vals = fit_oscillation(ds_fit.state, "amp_prefactor")
+        data = ds_fit.state if node.parameters.use_state_discrimination else ds_fit.I
+        # Fit the power Rabi oscillations, starting from the last successful fit of each qubit when available
+        if node.parameters.warm_start_fit:
+            cache = FitCache()
+            fit_vals = fit_with_warm_start(
+                data,
+                "amp_prefactor",
+                "oscillation",
+                telemetry.instrument(fit_oscillation, model=oscillation),
+                _fit_cache_key(node),
+                cache,
+                telemetry=telemetry,
+            )
         else:
-            fit_vals = fit_oscillation(ds_fit.I, "amp_prefactor")
+            fit_vals = telemetry.instrument(fit_oscillation, model=oscillation)(data, "amp_prefactor")
 
         ds_fit = xr.merge([ds, fit_vals.rename("fit")])
     else:
@@ -96,9 +109,18 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
 
     # Extract the relevant fitted parameters
     fit_data, fit_results = _extract_relevant_fit_parameters(ds_fit, node)
+    # Store the successful fits as the starting point of the next run
+    if node.parameters.max_number_pulses_per_sweep == 1 and node.parameters.warm_start_fit:
+        update_fit_cache(fit_data.fit, fit_data.success, "oscillation", _fit_cache_key(node), cache)
+    telemetry.attach_to_node(node)
     return fit_data, fit_results
 
 
+def _fit_cache_key(node: QualibrationNode) -> str:
+    """The Rabi frequency depends on the calibrated operation, which is thus part of the fit cache key."""
+    return f"{node.name}/{node.parameters.operation}"
+
+
 def _extract_relevant_fit_parameters(fit: xr.Dataset, node: QualibrationNode):
     """Add metadata to the dataset and fit results."""
     limits = [instrument_limits(q.xy) for q in node.namespace["qubits"]]
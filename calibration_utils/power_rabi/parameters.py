@@ -20,6 +20,9 @@ class NodeSpecificParameters(RunnableParameters):
     """Maximum number of Rabi pulses per sweep. Default is 1."""
     update_x90: bool = True
     """Flag to update the x90 pulse amplitude. Default is True."""
+    warm_start_fit: bool = True
+    """Whether to start the fit from the last successful fit parameters of each qubit, falling back to generic
+    initial guesses when the warm fit fails. Default is True."""
 
 
 class Parameters(
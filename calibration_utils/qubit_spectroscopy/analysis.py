@@ -7,6 +7,7 @@ import xarray as xr
 from qualibrate import QualibrationNode
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
 from qualibration_libs.analysis import peaks_dips
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 from iqcc_research.quam_config.instrument_limits import instrument_limits
 
 
@@ -87,10 +88,12 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     # rotate the data to the new I axis
     ds_fit = ds_fit.assign({"I_rot": ds_fit.I * np.cos(ds_fit.iw_angle) + ds_fit.Q * np.sin(ds_fit.iw_angle)})
     # Find the peak with minimal prominence as defined, if no such peak found, returns nan
-    fit_vals = peaks_dips(ds_fit.I_rot, dim="detuning", prominence_factor=5)
+    telemetry = FitTelemetry()
+    fit_vals = telemetry.instrument(peaks_dips)(ds_fit.I_rot, dim="detuning", prominence_factor=5)
     ds_fit = xr.merge([ds_fit, fit_vals])
     # Extract the relevant fitted parameters
     fit_data, fit_results = _extract_relevant_fit_parameters(ds_fit, node)
+    telemetry.attach_to_node(node)
     return fit_data, fit_results
 
 
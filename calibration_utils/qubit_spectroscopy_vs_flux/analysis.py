@@ -5,8 +5,9 @@ from typing import Dict, Tuple
 import numpy as np
 import xarray as xr
 from qualibrate import QualibrationNode
-from qualibration_libs.analysis import fit_oscillation, peaks_dips
+from qualibration_libs.analysis import fit_oscillation, oscillation, peaks_dips
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -90,12 +91,14 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
         Dataset containing the fit results.
     """
 
-    peak_freq = peaks_dips(ds.IQ_abs, dim="detuning", prominence_factor=5)
+    telemetry = FitTelemetry()
+    peak_freq = telemetry.instrument(peaks_dips)(ds.IQ_abs, dim="detuning", prominence_factor=5)
     # Fit to a cosine using the qiskit function: a * np.cos(2 * np.pi * f * t + phi) + offset
-    fit_results_da = fit_oscillation(peak_freq.position.dropna(dim="flux_bias"), "flux_bias")
+    fit_results_da = telemetry.instrument(fit_oscillation, model=oscillation)(peak_freq.position.dropna(dim="flux_bias"), "flux_bias")
     fit_results_ds = xr.merge([fit_results_da.rename("fit_results"), peak_freq.position.rename("peak_freq")])
     # Extract the relevant fitted parameters
     fit_dataset, fit_results = _extract_relevant_fit_parameters(fit_results_ds, node)
+    telemetry.attach_to_node(node)
     return fit_dataset, fit_results
 
 
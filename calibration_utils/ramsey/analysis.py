@@ -6,7 +6,9 @@ import xarray as xr
 
 from qualibrate import QualibrationNode
 from qualibration_libs.data import convert_IQ_to_V
-from qualibration_libs.analysis import fit_oscillation_decay_exp
+from qualibration_libs.analysis import fit_oscillation_decay_exp, oscillation_decay_exp
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+from iqcc_research.quam_config.lib.fit_cache import FitCache, fit_with_warm_start, update_fit_cache
 
 
 @dataclass
@@ -66,14 +68,30 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     xr.Dataset
         Dataset containing the fit results.
     """
-    if node.parameters.use_state_discrimination:
-        fit = fit_oscillation_decay_exp(ds.state, "idle_time")
+    telemetry = FitTelemetry()
+    data = ds.state if node.parameters.use_state_discrimination else ds.I
+    # Fit the Ramsey oscillations, starting from the last successful fit of each qubit when available
+    if node.parameters.warm_start_fit:
+        cache = FitCache()
+        fit = fit_with_warm_start(
+            data,
+            "idle_time",
+            "oscillation_decay_exp",
+            telemetry.instrument(fit_oscillation_decay_exp, model=oscillation_decay_exp),
+            node.name,
+            cache,
+            telemetry=telemetry,
+        )
     else:
-        fit = fit_oscillation_decay_exp(ds.I, "idle_time")
+        fit = telemetry.instrument(fit_oscillation_decay_exp, model=oscillation_decay_exp)(data, "idle_time")
 
     ds_fit = xr.merge([ds, fit.rename("fit")])
 
     ds_fit, fit_results = _extract_relevant_fit_parameters(ds_fit, node)
+    # Store the successful fits as the starting point of the next run
+    if node.parameters.warm_start_fit:
+        update_fit_cache(ds_fit.fit, ds_fit.success, "oscillation_decay_exp", node.name, cache)
+    telemetry.attach_to_node(node)
     return ds_fit, fit_results
 
 
@@ -9,6 +9,9 @@ class NodeSpecificParameters(RunnableParameters):
     """Number of averages to perform. Default is 100."""
     frequency_detuning_in_mhz: float = 1.0
     """Frequency detuning in MHz. Default is 1.0 MHz."""
+    warm_start_fit: bool = True
+    """Whether to start the fit from the last successful fit parameters of each qubit, falling back to generic
+    initial guesses when the warm fit fails. Default is True."""
 
 
 class Parameters(
@@ -8,6 +8,7 @@ from qualibrate import QualibrationNode
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
 from iqcc_research.quam_config.instrument_limits import instrument_limits
 from qualibration_libs.analysis import fit_oscillation_decay_exp, oscillation_decay_exp, peaks_dips
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -60,7 +61,8 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
         Dataset containing the fit results.
     """
     # # TODO: explain the data analysis
-    fit_data = fit_oscillation_decay_exp(ds.state, "idle_times")
+    telemetry = FitTelemetry()
+    fit_data = telemetry.instrument(fit_oscillation_decay_exp, model=oscillation_decay_exp)(ds.state, "idle_times")
     fit_data.attrs = {"long_name": "time", "units": "µs"}
     fitted = oscillation_decay_exp(
         ds.state.idle_times,
@@ -128,6 +130,7 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
         )
         for q in ds_fit.qubit.values
     }
+    telemetry.attach_to_node(node)
 
     return ds_fit, fit_results
 
@@ -1,4 +1,5 @@
 import logging
+import time
 from dataclasses import dataclass
 from typing import Tuple, Dict
 import numpy as np
@@ -7,6 +8,8 @@ import xarray as xr
 from qualibrate import QualibrationNode
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
 from qualibration_libs.analysis import peaks_dips
+from iqcc_research.quam_config.lib.fit_utils import fit_resonator, fit_resonator_circle
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -15,6 +18,9 @@ class FitParameters:
 
     frequency: float
     fwhm: float
+    q_loaded: float
+    q_external: float
+    q_internal: float
     success: bool
 
 
@@ -36,11 +42,12 @@ def log_fitted_results(fit_results: Dict, log_callable=None):
         s_qubit = f"Results for qubit {q}: "
         s_freq = f"\tResonator frequency: {1e-9 * fit_results[q]['frequency']:.3f} GHz | "
         s_fwhm = f"FWHM: {1e-3 * fit_results[q]['fwhm']:.1f} kHz | "
+        s_quality = f"Q: {fit_results[q]['q_loaded']:,.0f}, Qe: {fit_results[q]['q_external']:,.0f}, Qi: {fit_results[q]['q_internal']:,.0f}\n"
         if fit_results[q]["success"]:
             s_qubit += " SUCCESS!\n"
         else:
             s_qubit += " FAIL!\n"
-        log_callable(s_qubit + s_freq + s_fwhm)
+        log_callable(s_qubit + s_freq + s_fwhm + s_quality)
 
 
 def process_raw_dataset(ds: xr.Dataset, node: QualibrationNode):
@@ -54,7 +61,12 @@ def process_raw_dataset(ds: xr.Dataset, node: QualibrationNode):
 
 def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, dict[str, FitParameters]]:
     """
-    Fit the T1 relaxation time for each qubit according to ``a * np.exp(t * decay) + offset``.
+    Fit the resonator frequency and quality factors for each qubit.
+
+    The complex transmission of all the qubits is fitted at once with the closed-form circle fit
+    (cable delay removal, algebraic circle fit and phase vs frequency fit). Only the qubits for
+    which the circle fit quality is poor are refitted with the full lmfit resonator model.
+    The Lorentzian dip fit of the amplitude is kept for plotting.
 
     Parameters:
     -----------
@@ -68,36 +80,95 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     xr.Dataset
         Dataset containing the fit results.
     """
+    telemetry = FitTelemetry()
     # Fit the resonator line
-    fit_results = peaks_dips(ds.IQ_abs, "detuning")
+    fit_results = telemetry.instrument(peaks_dips)(ds.IQ_abs, "detuning")
+    # Fit the complex transmission
+    circle_fit = _fit_resonator_circle_with_fallback(ds, node, telemetry)
+    fit_results = fit_results.assign(
+        {name: circle_fit[name] for name in ["omega_r", "Q", "Qe", "Qi", "circle_residual", "fit_method"]}
+    )
+    fit_results = fit_results.assign(resonator_fit_success=circle_fit.success)
     # Extract the relevant fitted parameters
     fit_data, fit_results = _extract_relevant_fit_parameters(fit_results, node)
+    telemetry.attach_to_node(node)
     return fit_data, fit_results
 
 
+def _fit_resonator_circle_with_fallback(
+    ds: xr.Dataset, node: QualibrationNode, telemetry: FitTelemetry
+) -> xr.Dataset:
+    """Circle fit of all qubits at once, falling back to the lmfit resonator model for the qubits with a poor fit."""
+    start = time.perf_counter()
+    circle_fit = fit_resonator_circle(
+        ds.I + 1j * ds.Q,
+        ds.full_freq,
+        "detuning",
+        max_residual=node.parameters.circle_fit_max_residual,
+    )
+    # the circle fit is batched over all qubits, only the share of each qubit in the batched call is known
+    wall_time_share = (time.perf_counter() - start) / circle_fit.sizes["qubit"]
+    for q in circle_fit.qubit.values:
+        fit_q = circle_fit.sel(qubit=q)
+        telemetry.record(
+            "fit_resonator_circle",
+            q,
+            None,
+            None,
+            float(fit_q.circle_residual),
+            bool(fit_q.success),
+            batch_wall_time_share=wall_time_share,
+        )
+    circle_fit = circle_fit.assign(fit_method=("qubit", np.full(circle_fit.sizes["qubit"], "circle")))
+    for q in node.namespace["qubits"]:
+        if circle_fit.success.sel(qubit=q.name):
+            continue
+        start = time.perf_counter()
+        try:
+            fit, _ = fit_resonator(ds.sel(qubit=q.name).rename(detuning="freq"), q.resonator.RF_frequency)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"lmfit resonator fit failed for qubit {q.name}: {e}")
+            telemetry.record("fit_resonator", q.name, time.perf_counter() - start, None, None, False)
+            continue
+        telemetry.record_model_result("fit_resonator", q.name, fit, time.perf_counter() - start)
+        Qe = fit.params["Qe_real"].value + 1j * fit.params["Qe_imag"].value
+        Q = fit.params["Q"].value
+        loc = dict(qubit=q.name)
+        circle_fit["omega_r"].loc[loc] = fit.params["omega_r"].value + q.resonator.RF_frequency
+        circle_fit["Q"].loc[loc] = Q
+        circle_fit["Qe"].loc[loc] = np.abs(Qe)
+        circle_fit["Qi"].loc[loc] = 1 / (1 / Q - np.real(1 / Qe))
+        circle_fit["success"].loc[loc] = fit.success
+        circle_fit["fit_method"].loc[loc] = "lmfit"
+    return circle_fit
+
+
 def _extract_relevant_fit_parameters(fit: xr.Dataset, node: QualibrationNode):
     """Add metadata to the dataset and fit results."""
     # Add metadata to fit results
     fit.attrs = {"long_name": "frequency", "units": "Hz"}
     # Get the fitted resonator frequency
     full_freq = np.array([q.resonator.RF_frequency for q in node.namespace["qubits"]])
-    res_freq = fit.position + full_freq
+    res_freq = fit.omega_r
     fit = fit.assign_coords(res_freq=("qubit", res_freq.data))
     fit.res_freq.attrs = {"long_name": "resonator frequency", "units": "Hz"}
-    # Get the fitted FWHM
-    fwhm = np.abs(fit.width)
+    # Get the FWHM from the loaded quality factor
+    fwhm = np.abs(fit.omega_r / fit.Q)
     fit = fit.assign_coords(fwhm=("qubit", fwhm.data))
     fit.fwhm.attrs = {"long_name": "resonator fwhm", "units": "Hz"}
     # Assess whether the fit was successful or not
-    freq_success = np.abs(res_freq.data) < node.parameters.frequency_span_in_mhz * 1e6 + full_freq
-    fwhm_success = np.abs(fwhm.data) < node.parameters.frequency_span_in_mhz * 1e6 + full_freq
-    success_criteria = freq_success & fwhm_success
+    freq_success = np.abs(res_freq.data - full_freq) < node.parameters.frequency_span_in_mhz * 1e6
+    fwhm_success = np.abs(fwhm.data) < node.parameters.frequency_span_in_mhz * 1e6
+    success_criteria = freq_success & fwhm_success & fit.resonator_fit_success.data
     fit = fit.assign_coords(success=("qubit", success_criteria))
 
     fit_results = {
         q: FitParameters(
             frequency=fit.sel(qubit=q).res_freq.values.__float__(),
             fwhm=fit.sel(qubit=q).fwhm.values.__float__(),
+            q_loaded=fit.sel(qubit=q).Q.values.__float__(),
+            q_external=fit.sel(qubit=q).Qe.values.__float__(),
+            q_internal=fit.sel(qubit=q).Qi.values.__float__(),
             success=fit.sel(qubit=q).success.values.__bool__(),
         )
         for q in fit.qubit.values
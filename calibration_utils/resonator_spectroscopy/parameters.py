@@ -1,6 +1,7 @@
 from qualibrate import NodeParameters
 from qualibrate.parameters import RunnableParameters
 from qualibration_libs.parameters import QubitsExperimentNodeParameters, CommonNodeParameters
+from iqcc_research.quam_config.lib.fit_utils import CIRCLE_FIT_MAX_RESIDUAL
 
 
 class NodeSpecificParameters(RunnableParameters):
@@ -10,6 +11,9 @@ class NodeSpecificParameters(RunnableParameters):
     """Span of frequencies to sweep in MHz. Default is 30 MHz."""
     frequency_step_in_mhz: float = 0.1
     """Step size for frequency sweep in MHz. Default is 0.1 MHz."""
+    circle_fit_max_residual: float = CIRCLE_FIT_MAX_RESIDUAL
+    """Maximum rms distance of the data from the fitted circle, in units of the circle radius (e.g. 0.05 for a
+    scatter of 5% of the radius), above which the lmfit resonator model is used instead. Default is 0.05."""
 
 
 class Parameters(
@@ -7,6 +7,7 @@ import xarray as xr
 from qualibrate import QualibrationNode
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
 from qualibration_libs.analysis import peaks_dips
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -106,8 +107,10 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     ds_fit = ds_fit.assign_coords({"optimal_power": (["qubit"], optimal_power.data)})
 
     # Define a function to fit the resonator line at the optimal power for each qubit
+    telemetry = FitTelemetry()
+
     def _select_optimal_power(ds, qubit):
-        return peaks_dips(
+        return telemetry.instrument(peaks_dips)(
             ds.sel(power=ds["optimal_power"].sel(qubit=qubit).data, method="nearest").sel(qubit=qubit).IQ_abs,
             "detuning",
         )
@@ -120,6 +123,7 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
 
     # Extract the relevant fitted parameters
     fit_dataset, fit_results = _extract_relevant_fit_parameters(ds_fit, node)
+    telemetry.attach_to_node(node)
     return fit_dataset, fit_results
 
 
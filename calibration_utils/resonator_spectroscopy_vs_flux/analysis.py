@@ -6,7 +6,8 @@ import xarray as xr
 
 from qualibrate import QualibrationNode
 from qualibration_libs.data import add_amplitude_and_phase, convert_IQ_to_V
-from qualibration_libs.analysis import fit_oscillation
+from qualibration_libs.analysis import fit_oscillation, oscillation
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
 
 
 @dataclass
@@ -94,10 +95,12 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     # Find the minimum of each frequency line to follow the resonance vs flux
     peak_freq = ds.IQ_abs.idxmin(dim="detuning")
     # Fit to a cosine using the qiskit function: a * np.cos(2 * np.pi * f * t + phi) + offset
-    fit_results_da = fit_oscillation(peak_freq.dropna(dim="flux_bias"), "flux_bias")
+    telemetry = FitTelemetry()
+    fit_results_da = telemetry.instrument(fit_oscillation, model=oscillation)(peak_freq.dropna(dim="flux_bias"), "flux_bias")
     fit_results_ds = xr.merge([fit_results_da.rename("fit_results"), peak_freq.rename("peak_freq")])
     # Extract the relevant fitted parameters
     fit_dataset, fit_results = _extract_relevant_fit_parameters(fit_results_ds, node)
+    telemetry.attach_to_node(node)
     return fit_dataset, fit_results
 
 
@@ -1,6 +1,6 @@
 from .parameters import Parameters
 from .analysis import process_raw_dataset, fit_raw_data, log_fitted_results
-from .plotting import plot_raw_data_with_fit
+from .plotting import plot_raw_data_with_fit, plot_crosstalk_matrix
 
 __all__ = [
     "Parameters",
@@ -8,4 +8,5 @@ __all__ = [
     "fit_raw_data",
     "log_fitted_results",
     "plot_raw_data_with_fit",
+    "plot_crosstalk_matrix",
 ]
@@ -1,12 +1,15 @@
 import logging
 from dataclasses import dataclass
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 import numpy as np
 import xarray as xr
 
 from qualibrate import QualibrationNode
 from qualibration_libs.data import convert_IQ_to_V
-from qualibration_libs.analysis import fit_decay_exp
+from qualibration_libs.analysis import fit_decay_exp, decay_exp
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+from iqcc_research.quam_config.lib.clifford_compiler import AVERAGE_PULSES_PER_CLIFFORD
+from iqcc_research.quam_config.lib.rb_bootstrap import bootstrap_rb_decay, confidence_interval
 
 
 @dataclass
@@ -16,6 +19,10 @@ class FitParameters:
     error_per_clifford: float
     error_per_gate: float
     success: bool
+    simultaneous_error_per_clifford: Optional[float] = None
+    addressability: Optional[float] = None
+    error_per_clifford_ci: Optional[Tuple[float, float]] = None
+    error_per_gate_ci: Optional[Tuple[float, float]] = None
 
 
 def log_fitted_results(fit_results: Dict, log_callable=None):
@@ -34,7 +41,17 @@ def log_fitted_results(fit_results: Dict, log_callable=None):
         log_callable = logging.getLogger(__name__).info
     for q in fit_results.keys():
         s_qubit = f"Results for qubit {q}: "
-        s_fidelity = f"\tSingle qubit gate fidelity: {100 * (1 - fit_results[q]['error_per_gate']):.3f} %\n"
+        s_fidelity = f"\tSingle qubit gate fidelity: {100 * (1 - fit_results[q]['error_per_gate']):.3f} %"
+        if fit_results[q].get("error_per_gate_ci") is not None:
+            low, high = fit_results[q]["error_per_gate_ci"]
+            s_fidelity += f" (95% CI {100 * (1 - high):.3f} - {100 * (1 - low):.3f} %)"
+        s_fidelity += "\n"
+        if fit_results[q].get("simultaneous_error_per_clifford") is not None:
+            s_fidelity += (
+                f"\tError per Clifford isolated: {fit_results[q]['error_per_clifford']:.2e}, "
+                f"simultaneous: {fit_results[q]['simultaneous_error_per_clifford']:.2e} "
+                f"(addressability {fit_results[q]['addressability']:.2e})\n"
+            )
         if fit_results[q]["success"]:
             s_qubit += " SUCCESS!\n"
         else:
@@ -71,12 +88,18 @@ def fit_raw_data(ds: xr.Dataset, node: QualibrationNode) -> Tuple[xr.Dataset, di
     else:
         ds_fit["averaged_data"] = 1 - ds.I.mean(dim="nb_of_sequences")
     # Fit the exponential decay
-    fit_data = fit_decay_exp(ds_fit["averaged_data"], "depths")
+    telemetry = FitTelemetry()
+    fit_data = telemetry.instrument(fit_decay_exp, model=decay_exp)(ds_fit["averaged_data"], "depths")
 
     ds_fit = xr.merge([ds, fit_data.rename("fit_data")])
+    if node.parameters.num_bootstrap_resamples:
+        ds_fit["error_per_clifford_ci"] = _bootstrap_error_per_clifford(
+            ds_fit, node.parameters.use_state_discrimination, node.parameters.num_bootstrap_resamples
+        )
 
     # Extract the relevant fitted parameters
     fit_data, fit_results = _extract_relevant_fit_parameters(ds_fit, node)
+    telemetry.attach_to_node(node)
 
     return ds_fit, fit_results
 
@@ -85,11 +108,16 @@ def _extract_relevant_fit_parameters(fit: xr.Dataset, node: QualibrationNode):
     """Add metadata to the dataset and fit results."""
     # Extract the decay rate
     alpha = np.exp(fit.fit_data.sel(fit_vals="decay"))
-    # average_gate_per_clifford = 45/24 = 1.875
-    average_gate_per_clifford = (1 * 3 + 9 * 2 + 1 * 4 + 2 * 3 + 4 * 2 + 2 * 3) / 24
+    # Physical pulses per Clifford with the virtual-Z decomposition of the Clifford compiler (5/6)
+    average_gate_per_clifford = AVERAGE_PULSES_PER_CLIFFORD
     # EPC from here: https://qiskit.org/textbook/ch-quantum-hardware/randomized-benchmarking.html#Step-5:-Fit-the-results
     fit["error_per_clifford"] = (1 - alpha) * (1 - 1 / 2)
+    if "driven" in fit.dims:
+        _extract_simultaneous_rb_parameters(fit)
     fit["error_per_gate"] = fit["error_per_clifford"] / average_gate_per_clifford
+    has_ci = "error_per_clifford_ci" in fit
+    if has_ci:
+        fit["error_per_gate_ci"] = fit["error_per_clifford_ci"] / average_gate_per_clifford
     # Assess whether the fit was successful or not
     nan_success = np.isnan(fit.error_per_gate)
     rb_success = (0 < fit.error_per_gate) & (fit.error_per_gate < 1)
@@ -97,14 +125,87 @@ def _extract_relevant_fit_parameters(fit: xr.Dataset, node: QualibrationNode):
     fit = fit.assign({"success": success_criteria})
 
     # Save fitting results
+    simultaneous = "driven" in fit.dims
     fit_results = {
         q: FitParameters(
             error_per_clifford=float(fit.sel(qubit=q)["error_per_clifford"]),
             error_per_gate=float(fit.sel(qubit=q)["error_per_gate"]),
             success=bool(fit.sel(qubit=q).success),
+            simultaneous_error_per_clifford=(
+                float(fit.sel(qubit=q)["simultaneous_error_per_clifford"]) if simultaneous else None
+            ),
+            addressability=float(fit.sel(qubit=q)["addressability"]) if simultaneous else None,
+            error_per_clifford_ci=(
+                tuple(float(v) for v in fit.sel(qubit=q)["error_per_clifford_ci"].values) if has_ci else None
+            ),
+            error_per_gate_ci=tuple(float(v) for v in fit.sel(qubit=q)["error_per_gate_ci"].values) if has_ci else None,
         )
         for q in fit.qubit.values
     }
     node.outcomes = {q: "successful" if fit_results[q].success else "fail" for q in fit.qubit.values}
 
     return fit, fit_results
+
+
+def _extract_simultaneous_rb_parameters(fit: xr.Dataset):
+    """
+    Derive the isolated and simultaneous error per Clifford and the crosstalk-addressability matrix from the decays
+    measured with each qubit driven alone and with all the qubits driven ('driven' dimension).
+
+    When the qubits were driven one after the other in a single 'isolated' configuration rather than each alone,
+    the isolated error per Clifford is the one of that configuration and there is no crosstalk matrix.
+
+    The diagonal of the crosstalk matrix is the isolated error per Clifford of each qubit. The off-diagonal element
+    (q, d) is the error per Clifford induced on the idle qubit q by driving the qubit d alone. It is obtained from
+    the decay of the contrast of q towards the offset of its own isolated RB fit, with a log-linear fit in the
+    depth, since the decay of an idle qubit is usually too small for a full exponential fit.
+    """
+    error_per_clifford = fit.error_per_clifford
+    qubits = fit.qubit.values
+    if "isolated" in fit.driven.values:
+        isolated = error_per_clifford.sel(driven="isolated", drop=True)
+        simultaneous = error_per_clifford.sel(driven="all", drop=True)
+        fit["error_per_clifford"] = isolated
+        if "error_per_clifford_ci" in fit:
+            fit["error_per_clifford_ci"] = fit.error_per_clifford_ci.sel(driven="isolated", drop=True)
+        fit["simultaneous_error_per_clifford"] = simultaneous
+        fit["addressability"] = simultaneous - isolated
+        return
+    isolated = error_per_clifford.sel(driven=xr.DataArray(qubits, dims="qubit", coords={"qubit": qubits}))
+    isolated = isolated.drop_vars("driven")
+    simultaneous = error_per_clifford.sel(driven="all", drop=True)
+    # Error per Clifford of the idle qubits, from the decay of their contrast
+    offset = fit.fit_data.sel(fit_vals="offset", drop=True).sel(driven=xr.DataArray(qubits, dims="qubit"))
+    offset = offset.drop_vars("driven", errors="ignore")
+    spectator = fit.averaged_data.sel(driven=qubits)
+    contrast = (spectator - offset) / (spectator.isel(depths=0) - offset)
+    log_contrast = np.log(contrast.where(contrast > 0))
+    slope = log_contrast.polyfit("depths", 1, skipna=True).polyfit_coefficients.sel(degree=1, drop=True)
+    spectator_error = (1 - np.exp(np.minimum(slope, 0))) * (1 - 1 / 2)
+    is_diagonal = spectator_error.qubit == spectator_error.driven
+    crosstalk = xr.where(is_diagonal, error_per_clifford.sel(driven=qubits), spectator_error)
+    fit["error_per_clifford"] = isolated
+    if "error_per_clifford_ci" in fit:
+        ci = fit.error_per_clifford_ci.sel(driven=xr.DataArray(qubits, dims="qubit", coords={"qubit": qubits}))
+        fit["error_per_clifford_ci"] = ci.drop_vars("driven")
+    fit["simultaneous_error_per_clifford"] = simultaneous
+    fit["addressability"] = simultaneous - isolated
+    fit["crosstalk_matrix"] = crosstalk.rename(driven="driven_qubit").transpose("qubit", "driven_qubit")
+
+
+def _bootstrap_error_per_clifford(ds: xr.Dataset, use_state_discrimination: bool, num_resamples: int) -> xr.DataArray:
+    """
+    The 95% confidence interval of the error per Clifford, from a vectorized bootstrap over the random sequences.
+
+    All the resampled decays of all the qubits are fitted at once with the batched solver of lib/rb_bootstrap.
+    """
+    sequences = 1 - (ds.state if use_state_discrimination else ds.I)
+    sequences = sequences.transpose(..., "nb_of_sequences", "depths")
+    alpha = bootstrap_rb_decay(sequences.depths.values, sequences.values, num_resamples)
+    low, high = confidence_interval((1 - alpha) * (1 - 1 / 2))
+    batch = sequences.isel(nb_of_sequences=0, depths=0, drop=True)
+    return xr.DataArray(
+        np.stack([low, high], axis=-1),
+        dims=batch.dims + ("bound",),
+        coords={**batch.coords, "bound": ["low", "high"]},
+    )
@@ -19,6 +19,20 @@ class NodeSpecificParameters(RunnableParameters):
     """Delta clifford (number of Clifford gates between the RB sequences). Default is 20."""
     seed: Optional[int] = None
     """Seed for the random number generator. Default is None."""
+    num_bootstrap_resamples: int = 1000
+    """Number of bootstrap resamples of the random sequences for the 95% confidence intervals of the error per
+    Clifford and per gate. 0 disables the bootstrap. Default is 1000."""
+    depth_only_program: bool = True
+    """Generate and play the random sequences only at the measured depths, updating the recovery gate with each new
+    Clifford, instead of looping over all the depths up to max_circuit_depth. Default is True."""
+    simultaneous_rb: bool = False
+    """Play independent random sequences on all the qubits, driving the qubits one after the other (isolated) and all
+    together. This gives the isolated and simultaneous error per Clifford of each qubit in a single program, with
+    2 shots per sequence and depth instead of 1. Requires depth_only_program. Default is False."""
+    measure_crosstalk_matrix: bool = False
+    """With simultaneous_rb, measure every qubit while driving each qubit alone instead of the isolated
+    configuration, which also gives the crosstalk matrix of the error induced on idle qubits. This takes N + 1 shots
+    per sequence and depth for N qubits. Default is False."""
 
 
 class Parameters(
@@ -1,6 +1,7 @@
 from typing import List
 import xarray as xr
 import numpy as np
+import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
 
@@ -64,6 +65,28 @@ def plot_individual_data_with_fit(ax: Axes, ds: xr.Dataset, qubit: dict[str, str
     -----
     - If the fit dataset is provided, the fitted curve is plotted along with the raw data.
     """
+    if "driven" in fit.dims:
+        # Simultaneous RB: the decay with the qubit driven alone, and with all the qubits driven
+        isolated = "isolated" if "isolated" in fit.driven.values else qubit["qubit"]
+        for driven, label, color in [(isolated, "isolated", "C0"), ("all", "simultaneous", "C1")]:
+            _plot_decay(ax, ds, fit.sel(driven=driven), color=color, label=label)
+        ax.legend(loc="upper right")
+        text = (
+            f"1Q RB fidelity = {100*(1 - float(fit.error_per_gate.values)):.3f}%\n"
+            f"addressability = {float(fit.addressability.values):.2e}"
+        )
+    else:
+        _plot_decay(ax, ds, fit)
+        text = f"1Q RB fidelity = {100*(1 - float(fit.error_per_gate.values)):.3f}%"
+    ax.grid("all")
+    ax.set_title(qubit["qubit"], pad=22)
+    ax.set_xlabel("Circuit depth")
+    ax.set_ylabel("qubit state" if hasattr(fit, "state") else "I quadrature [mV]")
+    ax.text(0.15, 0.9, text, transform=ax.transAxes)
+
+
+def _plot_decay(ax: Axes, ds: xr.Dataset, fit: xr.Dataset, color: str = "C0", label: str = None):
+    """Plot the averaged data of a single decay with its error bars and its fit."""
     # Fitted decay
     fitted = decay_exp(
         fit.depths,
@@ -73,10 +96,8 @@ def plot_individual_data_with_fit(ax: Axes, ds: xr.Dataset, qubit: dict[str, str
     )
     if hasattr(fit, "state"):
         data = fit.state
-        label = "qubit state"
     elif hasattr(fit, "I"):
         data = fit.I
-        label = "I quadrature [mV]"
     else:
         raise RuntimeError("The dataset must contain either 'I' or 'state' for the plotting function to work.")
     data_std = data.std(dim="nb_of_sequences") / np.sqrt(ds.nb_of_sequences.size)
@@ -87,15 +108,36 @@ def plot_individual_data_with_fit(ax: Axes, ds: xr.Dataset, qubit: dict[str, str
         fmt=".",
         capsize=2,
         elinewidth=0.5,
+        color=color,
+        label=label,
     )
-    ax.grid("all")
-    ax.set_title(qubit["qubit"], pad=22)
-    ax.set_xlabel("Circuit depth")
-    ax.set_ylabel(label)
-    ax.plot(fit.depths, fitted, "r--", label="fit")
-    ax.text(
-        0.15,
-        0.9,
-        f"1Q RB fidelity = {100*(1 - float(fit.error_per_gate.values)):.3f}%",
-        transform=ax.transAxes,
-    )
+    ax.plot(fit.depths, fitted, "--", color="r" if label is None else color, label="fit" if label is None else None)
+
+
+def plot_crosstalk_matrix(fits: xr.Dataset):
+    """
+    Plots the crosstalk-addressability matrix of a simultaneous RB.
+
+    Parameters
+    ----------
+    fits : xr.Dataset
+        The dataset containing the 'crosstalk_matrix' (qubit x driven_qubit) error per Clifford.
+
+    Returns
+    -------
+    Figure
+        The matplotlib figure object containing the plot.
+    """
+    matrix = fits.crosstalk_matrix
+    fig, ax = plt.subplots(figsize=(6, 5))
+    image = ax.imshow(matrix.values, cmap="viridis")
+    for (i, j), value in np.ndenumerate(matrix.values):
+        ax.text(j, i, f"{value:.1e}", ha="center", va="center", color="w", fontsize=8)
+    ax.set_xticks(range(matrix.driven_qubit.size), matrix.driven_qubit.values)
+    ax.set_yticks(range(matrix.qubit.size), matrix.qubit.values)
+    ax.set_xlabel("Driven qubit")
+    ax.set_ylabel("Measured qubit")
+    fig.colorbar(image, ax=ax, label="Error per Clifford")
+    ax.set_title("Simultaneous RB crosstalk matrix")
+    fig.tight_layout()
+    return fig
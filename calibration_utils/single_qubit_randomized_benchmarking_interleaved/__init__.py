@@ -1,7 +1,9 @@
 from .parameters import Parameters, get_interleaved_gate_name, get_interleaved_gate_index
+from .analysis import sequence_durations
 
 __all__ = [
     "Parameters",
     "get_interleaved_gate_name",
     "get_interleaved_gate_index",
+    "sequence_durations",
 ]
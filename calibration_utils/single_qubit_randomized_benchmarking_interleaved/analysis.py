@@ -0,0 +1,31 @@
+import xarray as xr
+from qualibrate import QualibrationNode
+
+
+def sequence_durations(ds: xr.Dataset, node: QualibrationNode) -> xr.DataArray:
+    """
+    The duration (in ns) of each played sequence, from its x90 and x180 pulse counts.
+
+    Parameters:
+    -----------
+    ds : xr.Dataset
+        Dataset containing the raw data, with the 'x90_count' and 'x180_count' of each sequence and depth.
+    node : QualibrationNode
+        The node, whose qubits give the pulse lengths. An interleaved "I" adds one idle of the x180 length per
+        interleaved gate, i.e. per Clifford of the depth.
+
+    Returns:
+    --------
+    xr.DataArray
+        The duration of each sequence, with the dimensions of the pulse counts.
+    """
+    durations = []
+    for q in node.namespace["qubits"]:
+        ds_q = ds.sel(qubit=q.name)
+        x90_length = q.xy.operations["x90"].length
+        x180_length = q.xy.operations["x180"].length
+        duration = ds_q.x90_count * x90_length + ds_q.x180_count * x180_length
+        if node.parameters.interleaved_gate_operation == "I":
+            duration = duration + ds_q.depths * x180_length
+        durations.append(duration)
+    return xr.concat(durations, dim="qubit").assign_attrs(long_name="Sequence duration", units="ns")
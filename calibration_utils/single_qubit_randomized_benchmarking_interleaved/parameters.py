@@ -2,6 +2,9 @@ from typing import Optional, Literal
 from qualibrate import NodeParameters
 from qualibrate.parameters import RunnableParameters
 from qualibration_libs.parameters import QubitsExperimentNodeParameters, CommonNodeParameters
+from iqcc_research.quam_config.lib.clifford_compiler import clifford_index
+
+INTERLEAVED_GATES = ["I", "x180", "y180", "x90", "-x90", "y90", "-y90"]
 
 
 class NodeSpecificParameters(RunnableParameters):
@@ -21,6 +24,9 @@ class NodeSpecificParameters(RunnableParameters):
     """Delta clifford (number of Clifford gates between the RB sequences). Default is 20."""
     seed: Optional[int] = None
     """Seed for the random number generator. Default is None."""
+    num_bootstrap_resamples: int = 1000
+    """Number of bootstrap resamples of the random sequences for the 95% confidence intervals of the error per
+    Clifford and per gate. 0 disables the bootstrap. Default is 1000."""
 
 
 class Parameters(
@@ -34,39 +40,14 @@ class Parameters(
 
 def get_interleaved_gate_name(gate_index: int) -> str:
     """Return the name of the gate based on its Clifford index."""
-    if gate_index == 0:
-        return "I"
-    elif gate_index == 1:
-        return "x180"
-    elif gate_index == 2:
-        return "y180"
-    elif gate_index == 12:
-        return "x90"
-    elif gate_index == 13:
-        return "-x90"
-    elif gate_index == 14:
-        return "y90"
-    elif gate_index == 15:
-        return "-y90"
-    else:
-        raise ValueError(f"Interleaved gate index {gate_index} doesn't correspond to a single operation")
+    for gate_operation in INTERLEAVED_GATES:
+        if clifford_index(gate_operation) == gate_index:
+            return gate_operation
+    raise ValueError(f"Interleaved gate index {gate_index} doesn't correspond to a single operation")
 
 
 def get_interleaved_gate_index(gate_operation) -> int:
-    """Return the Clifford gate index corresponding to the specified gate name."""
-    if gate_operation == "I":
-        return 0
-    elif gate_operation == "x180":
-        return 1
-    elif gate_operation == "y180":
-        return 2
-    elif gate_operation == "x90":
-        return 12
-    elif gate_operation == "-x90":
-        return 13
-    elif gate_operation == "y90":
-        return 14
-    elif gate_operation == "-y90":
-        return 15
-    else:
+    """Return the Clifford gate index (see lib/clifford_compiler) corresponding to the specified gate name."""
+    if gate_operation not in INTERLEAVED_GATES:
         raise ValueError(f"Gate operation {gate_operation} not recognized")
+    return clifford_index(gate_operation)
@@ -4,7 +4,7 @@ from typing import List, Tuple, Dict, Union
 
 from qiskit.circuit import QuantumCircuit
 from qiskit.converters import circuit_to_dag, dag_to_circuit
-from iqcc_research.quam_config.experiments.rb.rb_utils import EPS
+from calibration_utils.two_qubit_interleaved_rb.rb_utils import EPS
 
 # Gate to integer mapping for single qubit gates
 SINGLE_QUBIT_GATE_MAP = {
@@ -108,6 +108,44 @@ def process_circuit_to_integers(circuit: QuantumCircuit) -> List[int]:
     return result
 
 
+def circuit_to_layer_integers(circuit: QuantumCircuit) -> List[int]:
+    """
+    Layer a 2-qubit circuit and convert it to integers in a single pass over its instructions.
+
+    Equivalent to process_circuit_to_integers(layerize_quantum_circuit(circuit)), without building the DAG and the
+    intermediate circuits: each gate is placed in the layer following the last layer used on its qubits (the layers
+    of the DAG), and the layers are converted to integers as in 'process_circuit_to_integers'.
+
+    Args:
+        circuit: A Qiskit QuantumCircuit with 2 qubits
+
+    Returns:
+        List of integers representing the layers of the circuit
+    """
+    layers = []
+    qubit_depths = [0] * circuit.num_qubits
+
+    for instruction in circuit:
+        qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+        depth = max(qubit_depths[qubit] for qubit in qubits)
+        for qubit in qubits:
+            qubit_depths[qubit] = depth + 1
+        if depth == len(layers):
+            layers.append([7, 7])
+
+        if instruction.operation.name == 'barrier':
+            continue
+        gate_name = get_gate_name(instruction.operation)
+        if gate_name in TWO_QUBIT_GATE_MAP:
+            layers[depth] = gate_name
+        elif gate_name in SINGLE_QUBIT_GATE_MAP:
+            layers[depth][qubits[0]] = SINGLE_QUBIT_GATE_MAP[gate_name]
+        else:
+            raise ValueError(f"Unsupported gate: {gate_name}")
+
+    return [get_layer_integer([layer]) for layer in layers if layer != [7, 7]]
+
+
 def layerize_quantum_circuit(qc: QuantumCircuit) -> QuantumCircuit:
 
     dag = circuit_to_dag(qc)
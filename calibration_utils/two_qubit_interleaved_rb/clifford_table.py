@@ -0,0 +1,270 @@
+"""
+Precomputed table of the 11,520 two-qubit Cliffords, with a native decomposition of each of them.
+
+Every two-qubit Clifford is written as L @ R, with L one of the 576 products of single-qubit Cliffords and R one
+of 20 coset representatives, made of 0 to 3 CZ gates and single-qubit Cliffords. The Clifford L @ R_k has the
+index 576 * k + l, where l = 24 * a + b for L = C_a (control) x C_b (target), the single-qubit Cliffords being
+indexed as in 'clifford_compiler'. The representatives are chosen with the fewest CZ gates, and then the fewest
+layers, so that the decomposition of every Clifford uses the minimal number of CZ gates.
+
+Composing two Cliffords only requires the small 20 x 576 and 20 x 20 tables of the products R_k @ L and
+R_k @ R_k', and the single-qubit Cayley table, instead of an 11,520 x 11,520 table. Random sequences, their
+recovery gates and their native layers are therefore computed by integer array operations, for all the sequences
+at once. The layers use the integer codes of 'circuit_utils' (control gate * 8 + target gate with the 'sx', 'x'
+and 'rz' gates, and 64 for a CZ), and can be played directly by 'qua_utils'.
+
+The table is built once (about a second) and serialized to a .npz file, which is loaded by the next runs.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Sequence, Union
+
+import numpy as np
+from iqcc_research.quam_config.lib.clifford_compiler import (
+    CAYLEY_TABLE,
+    CLIFFORD_DECOMPOSITIONS,
+    CLIFFORD_UNITARIES,
+)
+from calibration_utils.two_qubit_interleaved_rb.circuit_utils import SINGLE_QUBIT_GATE_MAP, TWO_QUBIT_GATE_MAP
+
+NUM_LOCAL_CLIFFORDS = 24 * 24
+NUM_CLIFFORDS = 11520
+DEFAULT_TABLE_PATH = Path.home() / ".cache" / "iqcc_research" / "two_qubit_clifford_table.npz"
+
+_IDLE = SINGLE_QUBIT_GATE_MAP["idle"]
+_CZ_UNITARY = np.diag([1, 1, 1, -1]).astype(complex)
+_PULSE_GATES = {"x90": SINGLE_QUBIT_GATE_MAP["sx"], "x180": SINGLE_QUBIT_GATE_MAP["x"]}
+_RZ_GATES = {
+    1: SINGLE_QUBIT_GATE_MAP["rz(pi/2)"],
+    2: SINGLE_QUBIT_GATE_MAP["rz(pi)"],
+    3: SINGLE_QUBIT_GATE_MAP["rz(3pi/2)"],
+}
+
+
+def _unitary_keys(unitaries: np.ndarray) -> List[bytes]:
+    """Keys identifying a stack of 4x4 unitaries up to a global phase."""
+    flat = unitaries.reshape(len(unitaries), -1)
+    pivots = flat[np.arange(len(flat)), np.argmax(np.abs(flat) > 1e-6, axis=1)]
+    normalized = flat * (np.abs(pivots) / pivots)[:, None]
+    rounded = np.round(np.stack([normalized.real, normalized.imag], axis=-1) * 1e6).astype(np.int64)
+    return [row.tobytes() for row in rounded]
+
+
+def _single_qubit_slots(clifford: int) -> List[int]:
+    """The gates of a single-qubit Clifford in the slots (Z before, pulse, Z after) of a local layer."""
+    z_before, pulse, z_after = CLIFFORD_DECOMPOSITIONS[clifford]
+    return [
+        _RZ_GATES.get(z_before, _IDLE),
+        _IDLE if pulse is None else _PULSE_GATES[pulse],
+        _RZ_GATES.get(z_after, _IDLE),
+    ]
+
+
+def _local_layers(local: int) -> List[int]:
+    """The layers of the local Clifford C_a x C_b, the gates of the two qubits being played in parallel."""
+    control, target = divmod(local, 24)
+    layers = [
+        gate_control * len(SINGLE_QUBIT_GATE_MAP) + gate_target
+        for gate_control, gate_target in zip(_single_qubit_slots(control), _single_qubit_slots(target))
+    ]
+    return [layer for layer in layers if layer != _IDLE * len(SINGLE_QUBIT_GATE_MAP) + _IDLE]
+
+
+def _local_compose(state: np.ndarray, step: np.ndarray) -> np.ndarray:
+    """The local Clifford obtained by applying the local Clifford 'step' after 'state'."""
+    state_control, state_target = np.divmod(state, 24)
+    step_control, step_target = np.divmod(step, 24)
+    return 24 * CAYLEY_TABLE[state_control, step_control] + CAYLEY_TABLE[state_target, step_target]
+
+
+class TwoQubitCliffordTable:
+    """
+    The two-qubit Clifford group as integer tables, see the module documentation for the indexing.
+
+    Attributes:
+        rep_times_local (np.ndarray): (20, 576) indices of the products R_k @ L_l.
+        rep_times_rep (np.ndarray): (20, 20) indices of the products R_k @ R_k'.
+        inverse (np.ndarray): (11520,) indices of the inverse Cliffords.
+        layers (np.ndarray): (11520, max_layers) native layers of each Clifford, padded with -1.
+        single_qubit_cayley (np.ndarray): the single-qubit Cayley table the table was built with.
+    """
+
+    def __init__(
+        self,
+        rep_times_local: np.ndarray,
+        rep_times_rep: np.ndarray,
+        inverse: np.ndarray,
+        layers: np.ndarray,
+        single_qubit_cayley: np.ndarray,
+    ):
+        self.rep_times_local = rep_times_local
+        self.rep_times_rep = rep_times_rep
+        self.inverse = inverse
+        self.layers = layers
+        self.single_qubit_cayley = single_qubit_cayley
+        self.num_layers = (layers >= 0).sum(axis=1)
+        self.num_cz = (layers == TWO_QUBIT_GATE_MAP["cz"]).sum(axis=1)
+
+    @classmethod
+    def build(cls) -> "TwoQubitCliffordTable":
+        """Build the table from the single-qubit Cliffords and the CZ gate."""
+        local_unitaries = np.einsum("aij,bkl->abikjl", CLIFFORD_UNITARIES, CLIFFORD_UNITARIES).reshape(-1, 4, 4)
+        local_index = {key: local for local, key in enumerate(_unitary_keys(local_unitaries))}
+        local_layers = [_local_layers(local) for local in range(NUM_LOCAL_CLIFFORDS)]
+        # Local Cliffords with the fewest layers first, so that the first new coset found has the shortest decomposition
+        local_order = np.argsort([len(layers) for layers in local_layers], kind="stable")
+
+        reps, rep_layers = [np.eye(4, dtype=complex)], [[]]
+        previous_level = [0]
+        while len(reps) < NUM_CLIFFORDS // NUM_LOCAL_CLIFFORDS:
+            # Candidates with one more CZ: CZ @ L @ R, for R a representative with one CZ less
+            candidates, candidate_layers = [], []
+            for rep in previous_level:
+                for local in local_order:
+                    candidates.append(_CZ_UNITARY @ local_unitaries[local] @ reps[rep])
+                    candidate_layers.append(rep_layers[rep] + local_layers[local] + [TWO_QUBIT_GATE_MAP["cz"]])
+            candidates = np.array(candidates)
+            order = np.argsort([len(layers) for layers in candidate_layers], kind="stable")
+            candidates, candidate_layers = candidates[order], [candidate_layers[i] for i in order]
+
+            # A candidate is in the coset of R if candidate @ R^dagger is local
+            in_known_coset = np.zeros(len(candidates), dtype=bool)
+            for rep in reps:
+                keys = _unitary_keys(candidates @ rep.conj().T)
+                in_known_coset |= np.array([key in local_index for key in keys])
+            previous_level = []
+            while not in_known_coset.all():
+                new = int(np.argmin(in_known_coset))
+                previous_level.append(len(reps))
+                reps.append(candidates[new])
+                rep_layers.append(candidate_layers[new])
+                keys = _unitary_keys(candidates @ candidates[new].conj().T)
+                in_known_coset |= np.array([key in local_index for key in keys])
+
+        reps = np.array(reps)
+        unitaries = np.einsum("lij,kjm->klim", local_unitaries, reps).reshape(-1, 4, 4)
+        keys = _unitary_keys(unitaries)
+        index = {key: i for i, key in enumerate(keys)}
+        assert len(index) == NUM_CLIFFORDS, "The table does not span the two-qubit Clifford group."
+
+        def indices(products: np.ndarray) -> np.ndarray:
+            return np.array([index[key] for key in _unitary_keys(products.reshape(-1, 4, 4))]).reshape(
+                products.shape[:-2]
+            )
+
+        rep_times_local = indices(np.einsum("kij,ljm->klim", reps, local_unitaries))
+        rep_times_rep = indices(np.einsum("kij,ljm->klim", reps, reps))
+        inverse = indices(unitaries.conj().transpose(0, 2, 1))
+
+        all_layers = [rep_layers[k] + local_layers[l] for k in range(len(reps)) for l in range(NUM_LOCAL_CLIFFORDS)]
+        layers = np.full((NUM_CLIFFORDS, max(len(layers) for layers in all_layers)), -1, dtype=np.int8)
+        for i, clifford_layers in enumerate(all_layers):
+            layers[i, : len(clifford_layers)] = clifford_layers
+        return cls(rep_times_local, rep_times_rep, inverse, layers, CAYLEY_TABLE.copy())
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            rep_times_local=self.rep_times_local,
+            rep_times_rep=self.rep_times_rep,
+            inverse=self.inverse,
+            layers=self.layers,
+            single_qubit_cayley=self.single_qubit_cayley,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "TwoQubitCliffordTable":
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def compose(self, state: np.ndarray, step: np.ndarray) -> np.ndarray:
+        """The Cliffords obtained by applying the Cliffords 'step' after 'state' (element-wise)."""
+        step_rep, step_local = np.divmod(step, NUM_LOCAL_CLIFFORDS)
+        state_rep, state_local = np.divmod(state, NUM_LOCAL_CLIFFORDS)
+        # L_step @ R_step @ L_state @ R_state = L_step @ L_x @ R_x @ R_state = L_step @ L_x @ L_y @ R_y
+        x_rep, x_local = np.divmod(self.rep_times_local[step_rep, state_local], NUM_LOCAL_CLIFFORDS)
+        y_rep, y_local = np.divmod(self.rep_times_rep[x_rep, state_rep], NUM_LOCAL_CLIFFORDS)
+        local = _local_compose(_local_compose(y_local, x_local), step_local)
+        return y_rep * NUM_LOCAL_CLIFFORDS + local
+
+    def sequence_layers(self, cliffords: Sequence[int], interleaved_layer: Optional[int] = None) -> List[int]:
+        """The native layers of a sequence of Cliffords, with 'interleaved_layer' played after each of them if given."""
+        layers = self.layers[np.asarray(cliffords)]
+        if interleaved_layer is not None:
+            layers = np.concatenate([layers, np.full((len(layers), 1), interleaved_layer, dtype=layers.dtype)], axis=1)
+        layers = layers.ravel()
+        return layers[layers >= 0].tolist()
+
+
+@lru_cache(maxsize=None)
+def load_clifford_table(path: Optional[Union[str, Path]] = None) -> TwoQubitCliffordTable:
+    """
+    The two-qubit Clifford table, loaded from 'path' (default is '~/.cache/iqcc_research/'). The table is built and
+    saved there if it does not exist, or if it was built with another indexing of the single-qubit Cliffords.
+    """
+    path = DEFAULT_TABLE_PATH if path is None else Path(path)
+    if path.exists():
+        table = TwoQubitCliffordTable.load(path)
+        if np.array_equal(table.single_qubit_cayley, CAYLEY_TABLE):
+            return table
+    table = TwoQubitCliffordTable.build()
+    table.save(path)
+    return table
+
+
+def generate_circuits_as_ints(
+    circuit_lengths: Sequence[int],
+    num_circuits_per_length: int,
+    target_gate: Optional[Literal["cz", "idle_2q"]] = None,
+    reduce_to_1q_cliffords: bool = False,
+    seed: Optional[int] = None,
+    table: Optional[TwoQubitCliffordTable] = None,
+) -> Dict[int, List[List[int]]]:
+    """
+    Random RB circuits as native layer integers, without building and transpiling qiskit circuits.
+
+    Parameters:
+    -----------
+    circuit_lengths : sequence of int
+        The number of random Cliffords of the circuits.
+    num_circuits_per_length : int
+        The number of random circuits per length.
+    target_gate : str, optional
+        The gate interleaved after each random Clifford, 'cz' or 'idle_2q'. Default is None (standard RB).
+    reduce_to_1q_cliffords : bool, optional
+        Draw products of single-qubit Cliffords instead of two-qubit Cliffords. Default is False.
+    seed : int, optional
+        Seed of the random Cliffords. Default is None.
+    table : TwoQubitCliffordTable, optional
+        The Clifford table. Default is the one returned by 'load_clifford_table'.
+
+    Returns:
+    --------
+    dict
+        For each length, the list of circuits, each circuit being the list of its layer integers including the
+        recovery Clifford, in the format of 'process_circuit_to_integers'.
+    """
+    table = load_clifford_table() if table is None else table
+    rng = np.random.default_rng(seed)
+    num_choices = NUM_LOCAL_CLIFFORDS if reduce_to_1q_cliffords else NUM_CLIFFORDS
+    # The Clifford of the interleaved gate, the CZ being the representative of its own coset
+    interleaved = None if target_gate is None else TWO_QUBIT_GATE_MAP[target_gate]
+    interleaved_clifford = NUM_LOCAL_CLIFFORDS if target_gate == "cz" else 0
+
+    circuits = {}
+    for length in circuit_lengths:
+        cliffords = rng.integers(0, num_choices, size=(num_circuits_per_length, length))
+        state = np.zeros(num_circuits_per_length, dtype=int)
+        for depth in range(length):
+            state = table.compose(state, cliffords[:, depth])
+            if interleaved_clifford:
+                state = table.compose(state, np.full_like(state, interleaved_clifford))
+        recovery = table.inverse[state]
+        circuits[length] = [
+            table.sequence_layers(sequence, interleaved) + table.sequence_layers([recovery[i]])
+            for i, sequence in enumerate(cliffords)
+        ]
+    return circuits
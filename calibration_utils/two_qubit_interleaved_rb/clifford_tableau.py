@@ -0,0 +1,140 @@
+"""
+Batched symplectic tableaux of n-qubit Cliffords in numpy.
+
+A Clifford C on n qubits is stored as a (2n, 2n + 1) binary array, in the layout of qiskit's 'Clifford.tableau':
+row j (j < n) is the image C X_j C^dagger and row n + j the image C Z_j C^dagger, each given by its x bits, its
+z bits and its sign bit, the Pauli (x, z, r) being (-1)^r * i^(x.z) * X^x Z^z (so that x = z = 1 is Y). Any
+leading batch dimensions are allowed, so that all the sequences of an RB experiment are composed and inverted at
+once with bit operations, instead of composing qiskit 'Clifford' objects one at a time.
+"""
+
+import itertools
+from typing import Tuple
+
+import numpy as np
+
+_PAULIS = {
+    (0, 0): np.eye(2, dtype=complex),
+    (1, 0): np.array([[0, 1], [1, 0]], dtype=complex),
+    (0, 1): np.array([[1, 0], [0, -1]], dtype=complex),
+    (1, 1): np.array([[0, -1j], [1j, 0]], dtype=complex),
+}
+
+
+def num_qubits_of(tableau: np.ndarray) -> int:
+    return tableau.shape[-2] // 2
+
+
+def identity_tableau(num_qubits: int, batch_shape: Tuple[int, ...] = ()) -> np.ndarray:
+    """The tableau of the identity, repeated over 'batch_shape'."""
+    tableau = np.zeros(batch_shape + (2 * num_qubits, 2 * num_qubits + 1), dtype=np.uint8)
+    tableau[..., : 2 * num_qubits] = np.eye(2 * num_qubits, dtype=np.uint8)
+    return tableau
+
+
+def _pauli_matrix(x: np.ndarray, z: np.ndarray) -> np.ndarray:
+    """The matrix i^(x.z) X^x Z^z, with qubit 0 as the first tensor factor."""
+    matrix = np.eye(1, dtype=complex)
+    for x_bit, z_bit in zip(x, z):
+        matrix = np.kron(matrix, _PAULIS[(int(x_bit), int(z_bit))])
+    return matrix
+
+
+def tableau_from_unitary(unitary: np.ndarray) -> np.ndarray:
+    """The tableau of a Clifford unitary, with qubit 0 as the first tensor factor. Meant for a few qubits."""
+    num_qubits = int(np.log2(len(unitary)))
+    paulis = list(itertools.product([0, 1], repeat=2 * num_qubits))
+    tableau = np.zeros((2 * num_qubits, 2 * num_qubits + 1), dtype=np.uint8)
+    for row in range(2 * num_qubits):
+        generator = np.zeros(2 * num_qubits, dtype=np.uint8)
+        generator[row] = 1
+        image = unitary @ _pauli_matrix(generator[:num_qubits], generator[num_qubits:]) @ unitary.conj().T
+        for bits in paulis:
+            overlap = np.trace(_pauli_matrix(bits[:num_qubits], bits[num_qubits:]) @ image) / len(unitary)
+            if np.isclose(abs(overlap), 1):
+                tableau[row, :-1] = bits
+                tableau[row, -1] = 0 if overlap.real > 0 else 1
+                break
+        else:
+            raise ValueError("The unitary is not a Clifford.")
+    return tableau
+
+
+def compose_tableaux(state: np.ndarray, step: np.ndarray) -> np.ndarray:
+    """
+    The tableaux of the Cliffords obtained by applying 'step' after 'state', broadcast over the batch dimensions.
+
+    Each row of 'state' is a Pauli written in the generators X_j, Z_j, whose images by 'step' are multiplied
+    together. The products are tracked as i^e X^x Z^z, for which X^x1 Z^z1 X^x2 Z^z2 = (-1)^(z1.x2) X^(x1+x2) Z^(z1+z2).
+    """
+    num_qubits = num_qubits_of(state)
+    n2 = 2 * num_qubits
+    state, step = np.broadcast_arrays(state, step)
+    state_x, state_z = state[..., :num_qubits].astype(np.int64), state[..., num_qubits:n2].astype(np.int64)
+    step_x, step_z = step[..., :num_qubits].astype(np.int64), step[..., num_qubits:n2].astype(np.int64)
+    # Exponents of i of the rows of 'step' written as i^e X^x Z^z
+    step_exponent = 2 * step[..., n2].astype(np.int64) + np.sum(step_x * step_z, axis=-1)
+
+    x = np.zeros(state.shape[:-1] + (num_qubits,), dtype=np.int64)
+    z = np.zeros_like(x)
+    exponent = 2 * state[..., n2].astype(np.int64) + np.sum(state_x * state_z, axis=-1)
+    for generator in range(n2):
+        # The image of X_j (generator j) or Z_j (generator n + j), used by the rows of 'state' containing it
+        used = state[..., generator].astype(np.int64)
+        image_x = step_x[..., generator, None, :]
+        image_z = step_z[..., generator, None, :]
+        exponent += used * (step_exponent[..., generator, None] + 2 * np.sum(z * image_x, axis=-1))
+        x ^= used[..., None] * image_x
+        z ^= used[..., None] * image_z
+
+    composed = np.empty(state.shape, dtype=np.uint8)
+    composed[..., :num_qubits] = x
+    composed[..., num_qubits:n2] = z
+    composed[..., n2] = ((exponent - np.sum(x * z, axis=-1)) % 4) // 2
+    return composed
+
+
+def inverse_tableau(tableau: np.ndarray) -> np.ndarray:
+    """
+    The tableaux of the inverse Cliffords.
+
+    The symplectic part of the inverse is Omega S^T Omega, with Omega = [[0, I], [I, 0]]. The signs are then fixed
+    by composing with the Clifford: the product is a Pauli Q, and the inverse is followed by Q.
+    """
+    num_qubits = num_qubits_of(tableau)
+    n2 = 2 * num_qubits
+    symplectic = tableau[..., :n2]
+    swap = np.concatenate([np.arange(num_qubits, n2), np.arange(num_qubits)])
+    inverse = np.zeros_like(tableau)
+    inverse[..., :n2] = np.swapaxes(symplectic, -1, -2)[..., swap, :][..., :, swap]
+
+    signs = compose_tableaux(tableau, inverse)[..., n2].astype(np.int64)
+    # Q anticommutes with X_j if it has a Z on qubit j, and with Z_j if it has an X on qubit j
+    q_z, q_x = signs[..., :num_qubits], signs[..., num_qubits:]
+    anticommutes = (
+        np.sum(inverse[..., :num_qubits] * q_z[..., None, :], axis=-1)
+        + np.sum(inverse[..., num_qubits:n2] * q_x[..., None, :], axis=-1)
+    ) % 2
+    inverse[..., n2] = anticommutes
+    return inverse
+
+
+def sequence_inverse(tableaux: np.ndarray) -> np.ndarray:
+    """
+    The inverse of the product of Clifford sequences, i.e. their recovery Cliffords.
+
+    Parameters:
+    -----------
+    tableaux : np.ndarray
+        The tableaux of the Cliffords of the sequences, with shape (..., depth, 2n, 2n + 1), the first Clifford of
+        each sequence being applied first.
+
+    Returns:
+    --------
+    np.ndarray
+        The (..., 2n, 2n + 1) tableaux of the recovery Cliffords.
+    """
+    product = identity_tableau(num_qubits_of(tableaux), tableaux.shape[:-3])
+    for depth in range(tableaux.shape[-3]):
+        product = compose_tableaux(product, tableaux[..., depth, :, :])
+    return inverse_tableau(product)
@@ -1,16 +1,50 @@
-def write_sync_hook(circuits_as_ints_batched: list):
+import base64
+import io
 
+import numpy as np
+
+
+def encode_batches(circuits_as_ints_batched: list) -> str:
+    """
+    Encode padded batches as a base64 string of a compressed npz archive, in the smallest unsigned integer type
+    holding them (uint8 for gate codes, uint32 for packed gate codes).
+
+    The batches (of equal length) are stored as a single 2D array under the key 'batches'.
+    """
+    batches = np.asarray(circuits_as_ints_batched)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, batches=batches.astype(np.min_scalar_type(batches.max(initial=0))))
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def decode_batches(payload: str) -> np.ndarray:
+    """The inverse of 'encode_batches', as done by the sync hook."""
+    return np.load(io.BytesIO(base64.b64decode(payload)))["batches"]
+
+
+def write_sync_hook(circuits_as_ints_batched: list, input_stream_names: list[str] = ["sequence"]):
+    """
+    Write the sync hook pushing the batches to the input streams of the job on the cloud.
+
+    The batches are embedded in the hook as a binary payload (see 'encode_batches') rather than as Python lists, so
+    that the hook stays small and only decodes the payload before streaming it. The payload is embedded rather than
+    written to a separate file, since only the hook file is sent with the job.
+    """
     with open("sync_hook.py", "w") as f:
+        f.write("import base64\n")
+        f.write("import io\n\n")
+        f.write("import numpy as np\n")
         f.write("from iqcc_cloud_client.runtime import get_qm_job\n")
         f.write("from qm.qua import *\n\n")
         f.write("job = get_qm_job()\n")
         f.write("result = job.result_handles\n\n")
-        f.write("# The actual values from circuits_as_ints_batched\n")
-        f.write("circuits_as_ints_batched = [\n")
-        for batch in circuits_as_ints_batched:
-            f.write(f"    {batch},\n")
-        f.write("]\n\n")
+        f.write("# The batches of circuits_as_ints_batched, as a base64 encoded npz archive\n")
+        f.write(f'payload = "{encode_batches(circuits_as_ints_batched)}"\n')
+        f.write('circuits_as_ints_batched = np.load(io.BytesIO(base64.b64decode(payload)))["batches"]\n')
+        f.write(f"input_stream_names = {list(input_stream_names)}\n\n")
+        f.write("# Each input stream holds a single batch ahead of the program\n")
         f.write("for id, batch in enumerate(circuits_as_ints_batched):\n")
-        f.write('    job.push_to_input_stream("sequence", batch)\n')
-        f.write("    result.measurements.wait_for_values(id+1)\n")
-        f.write('    print(f"{id}: Received ", str(result.measurements.fetch(id)))')
\ No newline at end of file
+        f.write("    if id >= len(input_stream_names):\n")
+        f.write('        result.get("batch_end").wait_for_values(id - len(input_stream_names) + 1)\n')
+        f.write("    job.push_to_input_stream(input_stream_names[id % len(input_stream_names)], batch.tolist())\n")
+        f.write('    print(f"{id}: Pushed ")')
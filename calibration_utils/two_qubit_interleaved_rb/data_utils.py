@@ -3,6 +3,7 @@ import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
+from iqcc_research.quam_config.lib.rb_bootstrap import bootstrap_rb_decay, confidence_interval
 
 @dataclasses.dataclass
 class RBResult:
@@ -14,12 +15,14 @@ class RBResult:
         num_repeats (int): Number of repeated sequences at each circuit depth.
         num_averages (int): Number of averages for each sequence.
         state (np.ndarray): Measured states from the RB experiment.
+        qubit_pair (str): Name of the benchmarked qubit pair, shown in the plot titles. Default is None.
     """
 
     circuit_depths: list[int]
     num_repeats: int
     num_averages: int
     state: np.ndarray
+    qubit_pair: str = None
 
     def __post_init__(self):
         """
@@ -67,6 +70,7 @@ class RBResult:
         """
         A, alpha, B = self.fit_exponential()
         fidelity = self.get_fidelity(alpha)
+        fidelity_low, fidelity_high = self.bootstrap_fidelity()
 
         # std of average
         error_bars = (self.data == 0).stack(combined=("average", "repeat")).std(dim="combined").state.data / np.sqrt(self.num_repeats * self.num_averages)
@@ -95,7 +99,7 @@ class RBResult:
         plt.text(
             0.5,
             0.95,
-            f"2Q Clifford Fidelity = {fidelity * 100:.2f}%",
+            f"2Q Clifford Fidelity = {fidelity * 100:.2f}% (95% CI {fidelity_low * 100:.2f} - {fidelity_high * 100:.2f}%)",
             horizontalalignment="center",
             verticalalignment="top",
             fontdict={"fontsize": "large", "fontweight": "bold"},
@@ -104,7 +108,7 @@ class RBResult:
 
         plt.xlabel("Circuit Depth")
         plt.ylabel(r"Probability to recover to $|00\rangle$")
-        plt.title("2Q Randomized Benchmarking")
+        plt.title("2Q Randomized Benchmarking" + (f" {self.qubit_pair}" if self.qubit_pair else ""))
         plt.legend(framealpha=0)
         plt.show()
 
@@ -186,6 +190,23 @@ class RBResult:
 
         return fidelity
 
+    def bootstrap_fidelity(self, num_resamples: int = 1000, confidence: float = 0.95, seed: int = None):
+        """
+        Confidence interval of the fidelity per Clifford, from a vectorized bootstrap over the repeated sequences.
+
+        Args:
+            num_resamples (int): Number of bootstrap resamples of the sequences.
+            confidence (float): Confidence level of the interval.
+            seed (int): Seed of the resampling.
+
+        Returns:
+            tuple: Lower and upper bounds of the fidelity per Clifford.
+        """
+        recovery_per_repeat = (self.data.state == 0).mean(dim="average").transpose("repeat", "circuit_depth")
+        alpha = bootstrap_rb_decay(np.array(self.circuit_depths), recovery_per_repeat.values, num_resamples, seed)
+        low, high = confidence_interval(self.get_fidelity(alpha), confidence)
+        return float(low), float(high)
+
     def get_decay_curve(self):
         """
         Calculates the decay curve from the RB data.
@@ -0,0 +1,96 @@
+"""
+Parallel generation of the RB circuits, as layer integers.
+
+The random circuits of the different lengths are independent, so they are generated, transpiled and converted to
+layer integers in a pool of processes, by shards of a few circuits. Each shard starts from the rolling seed the
+serial generation would have reached at its first circuit, so that the output is identical to the serial one
+('generate_circuits_and_transpile' followed by 'process_circuit_to_integers') for the same seed.
+
+The pool forks the current process, so that the calibration nodes (scripts without a '__main__' guard) are not
+re-imported by the workers. Forking is only done on Linux: on macOS, forking a process that has loaded system
+frameworks or started threads is unsafe, and on Windows it is not available. Elsewhere than on Linux, the circuits
+are generated in the current process.
+"""
+
+import copy
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from calibration_utils.two_qubit_interleaved_rb.circuit_utils import circuit_to_layer_integers
+from calibration_utils.two_qubit_interleaved_rb.rb_utils import RBBase
+
+_worker_rb: Optional[RBBase] = None
+
+
+def _init_worker(rb: RBBase):
+    global _worker_rb
+    _worker_rb = rb
+
+
+def _generate_shard(length: int, rolling_seed: int, num_circuits: int, interleaved: bool) -> List[List[int]]:
+    """The layer integers of 'num_circuits' circuits of the given length, starting from the given rolling seed."""
+    rb = copy.copy(_worker_rb)
+    rb.rolling_seed = rolling_seed
+    rb.num_circuits_per_length = num_circuits
+    circuits = rb.transpile_per_clifford(rb.generate_circuits_per_length(length, interleaved))
+    return [circuit_to_layer_integers(qc) for qc in circuits]
+
+
+def shard_seeds(rb: RBBase, circuits_per_shard: int = 1) -> List[Tuple[int, int, int, int]]:
+    """
+    The shards of the circuits of an RB experiment, as (length index, length, rolling seed, number of circuits).
+
+    The serial generation draws one seed per random Clifford (two with 'reduce_to_1q_cliffords'), length after length
+    and circuit after circuit, from which the rolling seed of the first circuit of each shard is deduced.
+    """
+    seeds_per_clifford = 2 if rb.reduce_to_1q_cliffords and rb.num_qubits == 2 else 1
+    shards = []
+    rolling_seed = rb.seed
+    for length_index, length in enumerate(rb.circuit_lengths):
+        for first in range(0, rb.num_circuits_per_length, circuits_per_shard):
+            num_circuits = min(circuits_per_shard, rb.num_circuits_per_length - first)
+            shards.append((length_index, length, rolling_seed, num_circuits))
+            rolling_seed += seeds_per_clifford * length * num_circuits
+    return shards
+
+
+def generate_circuits_as_ints(
+    rb: RBBase,
+    interleaved: bool = False,
+    num_workers: Optional[int] = None,
+    circuits_per_shard: int = 1,
+) -> Dict[int, List[List[int]]]:
+    """
+    Generate, transpile and convert the circuits of an RB experiment to layer integers in a pool of processes.
+
+    Args:
+        rb (RBBase): The RB experiment, e.g. an 'InterleavedRB' created with 'generate_circuits=False'.
+        interleaved (bool): Interleave the target gate of the experiment. Default is False.
+        num_workers (int | None): The number of processes. Default is None (the number of CPUs). With a single
+            worker, or on other platforms than Linux, the shards are generated in the current process.
+        circuits_per_shard (int): The number of circuits generated per task. Default is 1.
+
+    Returns:
+        dict: For each circuit length, the layer integers of the circuits, as in 'process_circuit_to_integers'.
+    """
+    shards = shard_seeds(rb, circuits_per_shard)
+    arguments = [(length, rolling_seed, num_circuits, interleaved) for _, length, rolling_seed, num_circuits in shards]
+
+    if num_workers == 1 or not sys.platform.startswith("linux"):
+        _init_worker(rb)
+        results = [_generate_shard(*shard_arguments) for shard_arguments in arguments]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(rb,),
+        ) as executor:
+            results = list(executor.map(_generate_shard, *zip(*arguments)))
+
+    circuits_per_length = [[] for _ in rb.circuit_lengths]
+    for (length_index, _, _, _), circuits in zip(shards, results):
+        circuits_per_length[length_index].extend(circuits)
+    return dict(zip(rb.circuit_lengths, circuits_per_length))
@@ -10,6 +10,68 @@ from qualibrate import NodeParameters, QualibrationNode
 from iqcc_research.quam_config.components import Quam
 from qualang_tools.units import unit
 
+# Packed encoding of the input streams: the 67 gate codes fit in 7 bits, and 4 of them are sent per 32-bit QUA int
+BITS_PER_GATE = 7
+GATES_PER_WORD = 4
+GATE_MASK = (1 << BITS_PER_GATE) - 1
+
+
+def pack_gate_codes(gate_codes: list[int]) -> list[int]:
+    """Pack gate codes 4 per integer, the gate i being in the bits 7 * (i % 4) to 7 * (i % 4) + 6 of the integer i // 4."""
+    codes = np.zeros(-(-len(gate_codes) // GATES_PER_WORD) * GATES_PER_WORD, dtype=np.int64)
+    codes[: len(gate_codes)] = gate_codes
+    shifts = BITS_PER_GATE * np.arange(GATES_PER_WORD)
+    return (codes.reshape(-1, GATES_PER_WORD) << shifts).sum(axis=1).tolist()
+
+
+def unpack_gate_codes(words: list[int], num_gates: int) -> list[int]:
+    """The inverse of 'pack_gate_codes', as done on the OPX by 'play_packed_sequence'."""
+    return [(words[i // GATES_PER_WORD] >> (BITS_PER_GATE * (i % GATES_PER_WORD))) & GATE_MASK for i in range(num_gates)]
+
+def _pair_resources(qubit_pair: TransmonPair) -> set[str]:
+    """The names of the qubits and coupler used by a pair, including the qubits compensated during its CZ gate."""
+    resources = {qubit_pair.qubit_control.name, qubit_pair.qubit_target.name}
+    if qubit_pair.coupler:
+        resources.add(qubit_pair.coupler.name)
+    if "Cz" in qubit_pair.gates and hasattr(qubit_pair.gates["Cz"], "compensations"):
+        resources.update(compensation["qubit"].name for compensation in qubit_pair.gates["Cz"].compensations)
+    return resources
+
+
+def group_disjoint_qubit_pairs(qubit_pairs: list[TransmonPair]) -> list[list[int]]:
+    """
+    Group qubit pairs into sets of pairs with no shared qubit or coupler, which can be benchmarked simultaneously.
+
+    The groups are the colours of a greedy colouring of the conflict graph of the pairs: the pairs are taken by
+    decreasing number of conflicts, and each is added to the first group it has no conflict with. A pair is thus only
+    left out of a group if it conflicts with one of its pairs, i.e. the groups are maximal in the order they are played.
+
+    Returns:
+        list[list[int]]: The indices of the pairs of each group, in increasing order.
+    """
+    resources = [_pair_resources(qubit_pair) for qubit_pair in qubit_pairs]
+    conflicts = [
+        {j for j in range(len(qubit_pairs)) if j != i and resources[i] & resources[j]} for i in range(len(qubit_pairs))
+    ]
+    groups = []
+    for i in sorted(range(len(qubit_pairs)), key=lambda i: -len(conflicts[i])):
+        for group in groups:
+            if not conflicts[i] & set(group):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+    return [sorted(group) for group in groups]
+
+
+def rotate_circuits_per_length(circuits_as_ints: list[list[int]], num_circuits_per_length: int, shift: int) -> list[list[int]]:
+    """Rotate the circuits of each length by 'shift', so that pairs played simultaneously play different circuits."""
+    rotated = []
+    for first in range(0, len(circuits_as_ints), num_circuits_per_length):
+        circuits = circuits_as_ints[first : first + num_circuits_per_length]
+        rotated += circuits[shift % len(circuits) :] + circuits[: shift % len(circuits)]
+    return rotated
+
 def reset_qubits(node, control: Transmon, target: Transmon, thermalization_time: float | None = None):
     if node.parameters.reset_type == "active":
         active_reset(control, "readout")
@@ -207,7 +269,8 @@ def play_gate(gate: QuaVariable, qubit_pair: TransmonPair, state: QuaVariable, s
         
         with case_(66):
             
-            align()
+            # Only the elements of the pair are aligned, so that pairs played simultaneously do not wait for each other
+            qubit_pair.align()
             
             readout_state(qubit_pair.qubit_control, state_control, wait_depletion_time=False)
             readout_state(qubit_pair.qubit_target, state_target, wait_depletion_time=False)
@@ -226,7 +289,7 @@ def play_gate(gate: QuaVariable, qubit_pair: TransmonPair, state: QuaVariable, s
             # Reset the frame of the qubits in order not to accumulate rotations
             reset_frame(qubit_pair.qubit_control.xy.name, qubit_pair.qubit_target.xy.name)
             
-            align()
+            qubit_pair.align()
             
 def play_sequence(sequence: QuaArrayVariable, depth: int, qubit_pair: TransmonPair, state: list[QuaVariable], state_control: QuaVariable, state_target: QuaVariable, state_st, reset_type: Literal["thermal", "active"]): 
     
@@ -234,9 +297,44 @@ def play_sequence(sequence: QuaArrayVariable, depth: int, qubit_pair: TransmonPa
     with for_(i, 0, i < depth, i + 1):
         play_gate(sequence[i], qubit_pair, state, state_control, state_target, state_st, reset_type)    
 
+def play_parallel_sequences(sequences: list[QuaArrayVariable], depths: list[int], qubit_pairs: list[TransmonPair], state: list[QuaVariable], state_control: QuaVariable, state_target: QuaVariable, state_st: list, reset_type: Literal["thermal", "active"]):
+    """
+    Play the sequences of qubit pairs with no shared qubit or coupler simultaneously: the gate i of every pair is played
+    in the iteration i of a single loop, each pair only being aligned with itself (see 'group_disjoint_qubit_pairs').
+    A sequence shorter than the others is skipped once played.
+    The given state variables are used by the first pair, the other pairs get their own so that their measurements do
+    not overwrite each other.
+    """
+    if len(qubit_pairs) == 1:
+        play_sequence(sequences[0], depths[0], qubit_pairs[0], state, state_control, state_target, state_st[0], reset_type)
+        return
+
+    pair_states = [(state, state_control, state_target)] + [
+        (declare(int), declare(int), declare(int)) for _ in qubit_pairs[1:]
+    ]
+    i = declare(int)
+    max_depth = max(depths)
+    with for_(i, 0, i < max_depth, i + 1):
+        for sequence, depth, qubit_pair, pair_state, pair_state_st in zip(sequences, depths, qubit_pairs, pair_states, state_st):
+            if depth < max_depth:
+                with if_(i < depth):
+                    play_gate(sequence[i], qubit_pair, *pair_state, pair_state_st, reset_type)
+            else:
+                play_gate(sequence[i], qubit_pair, *pair_state, pair_state_st, reset_type)
+
+def play_packed_sequence(sequence: QuaArrayVariable, depth: int, qubit_pair: TransmonPair, state: list[QuaVariable], state_control: QuaVariable, state_target: QuaVariable, state_st, reset_type: Literal["thermal", "active"]):
+    """Play the first 'depth' gates of a sequence packed by 'pack_gate_codes', unpacking each gate with bit shifts."""
+    i = declare(int)
+    gate = declare(int)
+    with for_(i, 0, i < depth, i + 1):
+        # i >> 2 is the index i // 4 of the integer holding the gate i
+        assign(gate, (sequence[i >> 2] >> ((i & (GATES_PER_WORD - 1)) * BITS_PER_GATE)) & GATE_MASK)
+        play_gate(gate, qubit_pair, state, state_control, state_target, state_st, reset_type)
+
 class QuaProgramHandler:
     
-    def __init__(self, node: QualibrationNode, num_pairs: int, circuits_as_ints: list[int], machine: Quam, qubit_pairs: list[TransmonPair], max_sequence_length: int = 6000):
+    def __init__(self, node: QualibrationNode, num_pairs: int, circuits_as_ints: list[int], machine: Quam, qubit_pairs: list[TransmonPair], max_sequence_length: int = 6000,
+                 double_buffered: bool = False, packed: bool = False, parallel: bool = False):
         
         self.u = unit(coerce_to_integer=True)
         self.node = node
@@ -245,12 +343,67 @@ class QuaProgramHandler:
         self.machine = machine
         self.qubit_pairs = qubit_pairs
         self.max_sequence_length = max_sequence_length
+        # With double buffering, the batches alternate between two input streams, so that the host pushes the next
+        # batch while the current one is played instead of after it
+        self.double_buffered = double_buffered
+        self.input_stream_names = ["sequence_0", "sequence_1"] if double_buffered else ["sequence"]
+        # With packing, 4 gates are sent per integer, and max_sequence_length counts the integers of the input stream
+        self.packed = packed
+        gates_per_word = GATES_PER_WORD if packed else 1
+        # In parallel, the pairs with no shared qubit or coupler are played simultaneously, each pair of a group playing
+        # the circuits of each length in a different order
+        self.parallel = parallel
+        if parallel:
+            if self.node.parameters.use_input_stream:
+                raise ValueError("The qubit pairs can only be played in parallel without input streams")
+            self.pair_groups = group_disjoint_qubit_pairs(qubit_pairs)
+            if self.node.parameters.flux_point_joint_or_independent == "independent" and any(len(group) > 1 for group in self.pair_groups):
+                raise ValueError("The qubit pairs can only be played in parallel at the joint flux point")
+            positions = {i: position for group in self.pair_groups for position, i in enumerate(group)}
+            self.pair_circuits_as_ints = [
+                rotate_circuits_per_length(circuits_as_ints, self.node.parameters.num_circuits_per_length, positions[i])
+                for i in range(num_pairs)
+            ]
+        else:
+            self.pair_groups = [[i] for i in range(num_pairs)]
+            self.pair_circuits_as_ints = [circuits_as_ints] * num_pairs
         
         if self.node.parameters.use_input_stream:
-            self.circuits_as_ints_batched = split_list_by_integer_count(self.circuits_as_ints, self.max_sequence_length)
+            self.circuits_as_ints_batched = split_list_by_integer_count(self.circuits_as_ints, self.max_sequence_length * gates_per_word)
             self.circuits_as_ints_batched = [list(flatten(batch)) for batch in self.circuits_as_ints_batched]
             self.sequence_lengths = [len(batch) for batch in self.circuits_as_ints_batched]
-            self.max_current_sequence_length = max(len(seq) for seq in self.circuits_as_ints_batched)
+            if packed:
+                batches = [pack_gate_codes(batch) for batch in self.circuits_as_ints_batched]
+            else:
+                batches = self.circuits_as_ints_batched
+            self.max_current_sequence_length = max(len(seq) for seq in batches)
+            self.circuits_as_ints_batched_padded = [batch + [0] * (self.max_current_sequence_length - len(batch)) for batch in batches]
+    
+    def push_sequences(self, job, timeout: float = 3600):
+        """
+        Push the batches of all the qubit pairs to the input streams of a running job. Each input stream holds a single
+        batch ahead of the program: a batch is pushed once the batch played before it on the same stream is done.
+        """
+        batch_end = job.result_handles.get("batch_end")
+        batches = self.circuits_as_ints_batched_padded * self.num_pairs
+        num_streams = len(self.input_stream_names)
+        for id, batch in enumerate(batches):
+            if id >= num_streams:
+                batch_end.wait_for_values(id - num_streams + 1, timeout=timeout)
+            job.push_to_input_stream(self.input_stream_names[id % num_streams], batch)
+            print(f"{id}/{len(batches)}: Pushed ")
+    
+    def input_stream_idle_times(self, job) -> np.ndarray:
+        """
+        The time (in ns) the program waited for each batch after the first one, measured on the OPX as the time
+        between the end of a batch and the start of the next one (including the transfer by 'advance_input_stream').
+        The first batch of each qubit pair is preceded by the flux settings and the qubit initialization, and is skipped.
+        """
+        batch_start = job.result_handles.get("batch_start").fetch_all()["timestamp"]
+        batch_end = job.result_handles.get("batch_end").fetch_all()["timestamp"]
+        idle_times = batch_start[1:] - batch_end[:-1]
+        first_batches = np.arange(len(self.sequence_lengths), len(batch_start), len(self.sequence_lengths))
+        return np.delete(idle_times, first_batches - 1)
     
     def _get_qua_program_with_input_stream(self):
         
@@ -259,7 +412,10 @@ class QuaProgramHandler:
             n = declare(int)
             n_st = declare_stream()
             
-            sequence = declare_input_stream(int, name=f"sequence", size=self.max_current_sequence_length)
+            sequences = [declare_input_stream(int, name=name, size=self.max_current_sequence_length) for name in self.input_stream_names]
+            batch = declare(int)
+            batch_start_st = declare_stream()
+            batch_end_st = declare_stream()
             
             # The relevant streams
             state_control = declare(int)
@@ -284,17 +440,29 @@ class QuaProgramHandler:
                 # Align the two elements to play the sequence after qubit initialization
                 align()
                 
-                for l in self.sequence_lengths:
+                for j, l in enumerate(self.sequence_lengths):
+                    # The host pushes the batches of all the pairs in turn on the input streams (see 'push_sequences'),
+                    # so the input stream of a batch follows its index over all the pairs, not only over this pair
+                    batch_id = i * len(self.sequence_lengths) + j
+                    sequence = sequences[batch_id % len(sequences)]
                     advance_input_stream(sequence)
+                    assign(batch, batch_id)
+                    save(batch, batch_start_st)
 
                     with for_(n, 0, n < self.node.parameters.num_averages, n + 1):
                         
-                        play_sequence(sequence, l, qubit_pair, state, state_control, state_target, state_st[i], self.node.parameters.reset_type_thermal_or_active)
+                        play = play_packed_sequence if self.packed else play_sequence
+                        play(sequence, l, qubit_pair, state, state_control, state_target, state_st[i], self.node.parameters.reset_type_thermal_or_active)
                                     
                         save(n, n_st)
+                    
+                    # Signals the host that the input stream of this batch can receive the next one
+                    save(batch, batch_end_st)
 
             with stream_processing():
                 n_st.save("iteration")
+                batch_start_st.with_timestamps().save_all("batch_start")
+                batch_end_st.with_timestamps().save_all("batch_end")
                 for i in range(len(self.qubit_pairs)):
                     state_st[i].buffer(self.node.parameters.num_circuits_per_length).buffer(len(self.node.parameters.circuit_lengths)).buffer(self.node.parameters.num_averages).save(
                         f"state{i + 1}"
@@ -303,8 +471,7 @@ class QuaProgramHandler:
     
     def _get_qua_program_without_input_stream(self):
         
-        job_sequence = list(flatten(self.circuits_as_ints))
-        sequence_length = len(job_sequence)
+        job_sequences = [list(flatten(circuits_as_ints)) for circuits_as_ints in self.pair_circuits_as_ints]
         
         
         with program() as rb:
@@ -312,7 +479,10 @@ class QuaProgramHandler:
             n = declare(int)
             n_st = declare_stream()
             
-            job_sequence_qua = declare(int, value=job_sequence)
+            if self.parallel:
+                job_sequences_qua = [declare(int, value=job_sequence) for job_sequence in job_sequences]
+            else:
+                job_sequences_qua = [declare(int, value=job_sequences[0])] * self.num_pairs
             
             # The relevant streams
             state_control = declare(int)
@@ -320,26 +490,31 @@ class QuaProgramHandler:
             state = declare(int)
             state_st = [declare_stream() for _ in range(self.num_pairs)]
 
-            for i, qubit_pair in enumerate(self.qubit_pairs):
+            for group in self.pair_groups:
+                group_pairs = [self.qubit_pairs[i] for i in group]
 
                 # Bring the active qubits to the desired frequency point
-                self.machine.set_all_fluxes(flux_point=self.node.parameters.flux_point_joint_or_independent, target=qubit_pair.qubit_control)
+                self.machine.set_all_fluxes(flux_point=self.node.parameters.flux_point_joint_or_independent, target=group_pairs[0].qubit_control)
 
                 # Initialize the qubits
-                if self.node.parameters.reset_type_thermal_or_active == "active":
-                    active_reset(qubit_pair.qubit_control, "readout")
-                    active_reset(qubit_pair.qubit_target, "readout")
-                else:
-                    # qubit_pair.qubit_control.resonator.wait(4)
-                    qubit_pair.qubit_control.resonator.wait(qubit_pair.qubit_control.thermalization_time * self.u.ns)
-                    qubit_pair.qubit_target.resonator.wait(qubit_pair.qubit_target.thermalization_time * self.u.ns)
+                for qubit_pair in group_pairs:
+                    if self.node.parameters.reset_type_thermal_or_active == "active":
+                        active_reset(qubit_pair.qubit_control, "readout")
+                        active_reset(qubit_pair.qubit_target, "readout")
+                    else:
+                        # qubit_pair.qubit_control.resonator.wait(4)
+                        qubit_pair.qubit_control.resonator.wait(qubit_pair.qubit_control.thermalization_time * self.u.ns)
+                        qubit_pair.qubit_target.resonator.wait(qubit_pair.qubit_target.thermalization_time * self.u.ns)
                 
                 # Align the two elements to play the sequence after qubit initialization
                 align()
                 
                 with for_(n, 0, n < self.node.parameters.num_averages, n + 1):
                     
-                    play_sequence(job_sequence_qua, sequence_length, qubit_pair, state, state_control, state_target, state_st[i], self.node.parameters.reset_type_thermal_or_active)
+                    play_parallel_sequences(
+                        [job_sequences_qua[i] for i in group], [len(job_sequences[i]) for i in group], group_pairs,
+                        state, state_control, state_target, [state_st[i] for i in group], self.node.parameters.reset_type_thermal_or_active
+                    )
                                 
                     save(n, n_st)
 
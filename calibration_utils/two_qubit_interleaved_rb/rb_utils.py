@@ -15,6 +15,8 @@ from more_itertools import flatten
 
 from scipy.optimize import curve_fit
 import xarray
+from calibration_utils.two_qubit_interleaved_rb.transpile_cache import TranspileCache
+from calibration_utils.two_qubit_interleaved_rb.clifford_tableau import compose_tableaux, sequence_inverse
 
 EPS = 1e-8
 
@@ -37,7 +39,8 @@ def rb_decay_curve(x, A, alpha, B):
 class RBBase:
     
     def __init__(self, circuit_lengths: list[int], num_circuits_per_length: int, basis_gates: list[str] = ['cz', 'rz', 'sx', 'x'], 
-                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None):
+                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None,
+                 use_transpile_cache: bool = True):
         
         self.num_qubits = num_qubits
         self.circuit_lengths = circuit_lengths
@@ -47,6 +50,8 @@ class RBBase:
         self.seed = seed if seed is not None else np.random.randint(0, 1000000)
         self.rolling_seed = copy.deepcopy(self.seed)
         self.reduce_to_1q_cliffords = reduce_to_1q_cliffords
+        # if optimization level is > 1 one might get fractional angles
+        self.transpile_cache = TranspileCache(basis_gates, optimization_level=1) if use_transpile_cache else None
     
     def generate_circuits_and_transpile(self, interleaved: bool = False):
         
@@ -56,13 +61,19 @@ class RBBase:
     def generate_circuits_per_length(self, length: int, interleaved: bool = False) -> list[QuantumCircuit]:
         
         circuits = []
+        # The Cliffords of each sequence as tableaux, the recovery Cliffords of all the sequences being computed at once
+        tableau_shape = (2 * self.num_qubits, 2 * self.num_qubits + 1)
+        tableaux = np.zeros((self.num_circuits_per_length, length) + tableau_shape, dtype=np.uint8)
+        if interleaved:
+            if not hasattr(self, 'target_gate_instruction'):
+                raise AttributeError("The attribute 'target_gate_instruction' is not defined in the class.")
+            target_tableau = Clifford(self.target_gate_instruction).tableau.astype(np.uint8)
         
-        for _ in range(self.num_circuits_per_length):
+        for circuit_index in range(self.num_circuits_per_length):
             qc = QuantumCircuit(self.num_qubits)
-            clifford_product = Clifford(qc)  # Identity Clifford
             
             # Apply random Clifford gates
-            for _ in range(length):
+            for depth in range(length):
                 if self.reduce_to_1q_cliffords and self.num_qubits == 2:
                     qc_temp = QuantumCircuit(2)
                     cliff = random_clifford(1, self.rolling_seed)
@@ -77,19 +88,19 @@ class RBBase:
                     self.rolling_seed += 1
                 
                 qc.append(cliff, range(self.num_qubits))
+                tableaux[circuit_index, depth] = cliff.tableau
                 
                 if interleaved:
-                    if not hasattr(self, 'target_gate_instruction'):
-                        raise AttributeError("The attribute 'target_gate_instruction' is not defined in the class.")
-                    
                     qc.append(self.target_gate_instruction, range(self.num_qubits))
-                    cliff = Clifford(self.target_gate_instruction) @ cliff
-                
-                clifford_product = cliff @ clifford_product  # Update the total Clifford
             
-            # Append the inverse Clifford
-            inverse_clifford = clifford_product.adjoint()
-            qc.append(inverse_clifford, range(self.num_qubits))
+            circuits.append(qc)
+        
+        if interleaved:
+            tableaux = compose_tableaux(tableaux, target_tableau)
+        
+        # Append the inverse Clifford
+        for qc, inverse_tableau in zip(circuits, sequence_inverse(tableaux)):
+            qc.append(Clifford(inverse_tableau.astype(bool)), range(self.num_qubits))
             
             # # Verify that the quantum circuit is an identity operator up to a phase
             # unitary = Operator(qc).data
@@ -97,8 +108,6 @@ class RBBase:
             # # Normalize the unitary to remove global phase
             # unitary_normalized = unitary / np.linalg.det(unitary)**(1/unitary.shape[0])
             # assert np.allclose(unitary_normalized, identity, atol=1e-8), "Circuit is not an identity operator up to a phase."
-            
-            circuits.append(qc)
         
         return circuits
     
@@ -121,7 +130,9 @@ class RBBase:
                 qc_per_inst = QuantumCircuit(len(instruction.qubits))
                 qc_per_inst.append(instruction)
                 
-                if isinstance(instruction.operation, Clifford):
+                if isinstance(instruction.operation, Clifford) and self.transpile_cache is not None:
+                    transpiled_gate = self.transpile_cache.transpile(qc_per_inst)
+                elif isinstance(instruction.operation, Clifford):
                     # if optimization level is > 1 one might get fractional angles
                     transpiled_gate = transpile(qc_per_inst, basis_gates=self.basis_gates, optimization_level=1)
                 else:
@@ -205,23 +216,29 @@ class RBBase:
 class StandardRB(RBBase):
     
     def __init__(self, amplification_lengths: list[int], num_circuits_per_length: int, basis_gates: list[str] = ['cz', 'rz', 'sx', 'x'], 
-                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None):
+                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None,
+                 use_transpile_cache: bool = True, generate_circuits: bool = True):
         
-        super().__init__(amplification_lengths, num_circuits_per_length, basis_gates, num_qubits, reduce_to_1q_cliffords, seed)
+        super().__init__(amplification_lengths, num_circuits_per_length, basis_gates, num_qubits, reduce_to_1q_cliffords, seed,
+                         use_transpile_cache)
         
-        self.generate_circuits_and_transpile()
+        if generate_circuits:
+            self.generate_circuits_and_transpile()
 
 class InterleavedRB(RBBase):
     
     def __init__(self, target_gate: Literal['cz', 'idle_2q'], amplification_lengths: list[int], num_circuits_per_length: int, basis_gates: list[str] = ['cz', 'rz', 'sx', 'x'], 
-                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None):
+                 num_qubits: int = 2, reduce_to_1q_cliffords: bool = False, seed: int | None = None,
+                 use_transpile_cache: bool = True, generate_circuits: bool = True):
         
         self.target_gate = target_gate
         self.target_gate_instruction = self.target_gate_to_instruction()
         
-        super().__init__(amplification_lengths, num_circuits_per_length, basis_gates, num_qubits, reduce_to_1q_cliffords, seed)
+        super().__init__(amplification_lengths, num_circuits_per_length, basis_gates, num_qubits, reduce_to_1q_cliffords, seed,
+                         use_transpile_cache)
         
-        self.generate_circuits_and_transpile(interleaved=True)
+        if generate_circuits:
+            self.generate_circuits_and_transpile(interleaved=True)
     
     def target_gate_to_instruction(self) -> Instruction:
         
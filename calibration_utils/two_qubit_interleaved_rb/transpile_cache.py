@@ -0,0 +1,96 @@
+"""
+Persistent cache of transpiled circuits.
+
+The RB circuits are transpiled one Clifford at a time, always with the same basis gates and optimization level, so
+that the same small circuits are transpiled over and over, in every run. The transpiled circuits are stored on disk
+(as QPY files) under a hash of the circuit content, the target basis, the optimization level and the qiskit version,
+and the next runs load them instead of calling 'transpile'.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import qiskit
+from qiskit import QuantumCircuit, qpy, transpile
+
+DEFAULT_CACHE_DIRECTORY = Path.home() / ".cache" / "iqcc_research" / "transpile"
+
+
+class TranspileCache:
+    """
+    Transpile circuits through an on-disk cache.
+
+    Args:
+        basis_gates (list[str]): The target basis gates.
+        optimization_level (int): The transpiler optimization level. Default is 1.
+        directory (str | Path | None): The cache directory. Default is '~/.cache/iqcc_research/transpile'.
+    """
+
+    def __init__(
+        self,
+        basis_gates: Sequence[str],
+        optimization_level: int = 1,
+        directory: Optional[Union[str, Path]] = None,
+    ):
+        self.basis_gates = list(basis_gates)
+        self.optimization_level = optimization_level
+        self.directory = Path(directory) if directory is not None else DEFAULT_CACHE_DIRECTORY
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._memory: Dict[str, QuantumCircuit] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, circuit: QuantumCircuit) -> str:
+        """The content hash of a circuit for the target of the cache."""
+        digest = hashlib.sha256()
+        digest.update(f"{qiskit.__version__}|{sorted(self.basis_gates)}|{self.optimization_level}|".encode())
+        digest.update(f"{circuit.num_qubits}|".encode())
+        for instruction in circuit.data:
+            operation = instruction.operation
+            qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+            params = [str(param) for param in getattr(operation, "params", [])]
+            digest.update(f"{operation.name}|{qubits}|{params}|".encode())
+            # A Clifford operation is identified by its stabilizer tableau
+            tableau = getattr(operation, "tableau", None)
+            if tableau is not None:
+                digest.update(np.ascontiguousarray(tableau, dtype=np.uint8).tobytes())
+        return digest.hexdigest()
+
+    def transpile(self, circuit: QuantumCircuit) -> QuantumCircuit:
+        """The transpiled circuit, loaded from the cache if it was transpiled before."""
+        key = self.key(circuit)
+        if key in self._memory:
+            self.hits += 1
+            return self._memory[key].copy()
+
+        path = self.directory / f"{key}.qpy"
+        if path.exists():
+            with open(path, "rb") as f:
+                transpiled = qpy.load(f)[0]
+            self.hits += 1
+        else:
+            transpiled = transpile(circuit, basis_gates=self.basis_gates, optimization_level=self.optimization_level)
+            self._store(path, transpiled)
+            self.misses += 1
+        self._memory[key] = transpiled
+        return transpiled.copy()
+
+    def _store(self, path: Path, circuit: QuantumCircuit):
+        # Written to a temporary file first, so that concurrent runs never read a partial file
+        buffer = io.BytesIO()
+        qpy.dump(circuit, buffer)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temporary_path, path)
+
+    def clear(self):
+        """Remove the cached circuits, from memory and from disk."""
+        self._memory.clear()
+        for path in self.directory.glob("*.qpy"):
+            path.unlink()
@@ -0,0 +1,196 @@
+"""
+Minimal-pulse compiler of the single-qubit Clifford group, shared by the single-qubit RB nodes.
+
+Every single-qubit Clifford is decomposed as Z(a) P Z(b), with P one of I, X90 or X180 and a, b multiples of
+90 degrees. The Z rotations are virtual (frame rotations), so every Clifford costs at most one physical pulse:
+the 4 Z-rotations cost none and the 20 other Cliffords a single x90 or x180 pulse, i.e. 5/6 pulse per Clifford on
+average. When a sequence is played, the Z rotation ending a Clifford is merged with the one starting the next
+Clifford, so that a single frame rotation is applied before each pulse.
+
+The Cliffords are indexed by their position in 'CLIFFORD_DECOMPOSITIONS'. The Cayley and inverse tables below
+use the same indexing and must be used together with 'play_clifford' and 'play_clifford_sequence'.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from qm.qua import Cast, assign, case_, declare, else_, for_, if_, reset_frame, switch_
+
+# The physical pulses used by the compiler, with their rotation angle around the x-axis
+PULSE_ANGLES = {"x90": np.pi / 2, "x180": np.pi}
+
+
+def _rx(angle: float) -> np.ndarray:
+    return np.array(
+        [[np.cos(angle / 2), -1j * np.sin(angle / 2)], [-1j * np.sin(angle / 2), np.cos(angle / 2)]]
+    )
+
+
+def _rz(quarter_turns: int) -> np.ndarray:
+    angle = quarter_turns * np.pi / 2
+    return np.diag([np.exp(-1j * angle / 2), np.exp(1j * angle / 2)])
+
+
+def _unitary_key(unitary: np.ndarray) -> tuple:
+    """Key identifying a unitary up to a global phase."""
+    pivot = unitary.flat[np.argmax(np.abs(unitary.flat) > 1e-6)]
+    normalized = unitary * np.abs(pivot) / pivot
+    return tuple(np.round(normalized.flatten(), 6).tolist())
+
+
+def decomposition_unitary(z_before: int, pulse: Optional[str], z_after: int) -> np.ndarray:
+    """The unitary Z(z_after) P Z(z_before) of a decomposition, with the Z rotations in quarter turns."""
+    physical = np.eye(2) if pulse is None else _rx(PULSE_ANGLES[pulse])
+    return _rz(z_after) @ physical @ _rz(z_before)
+
+
+def _minimal_decompositions() -> List[Tuple[int, Optional[str], int]]:
+    """The 24 Cliffords as (z_before, pulse, z_after), identity first, then by number of pulses and frame rotations."""
+    decompositions = {}
+    for pulse in [None, "x180", "x90"]:
+        for z_before in range(4):
+            for z_after in range(4):
+                key = _unitary_key(decomposition_unitary(z_before, pulse, z_after))
+                decompositions.setdefault(key, (z_before, pulse, z_after))
+    assert len(decompositions) == 24, "The decompositions do not span the single-qubit Clifford group."
+    return list(decompositions.values())
+
+
+CLIFFORD_DECOMPOSITIONS: List[Tuple[int, Optional[str], int]] = _minimal_decompositions()
+CLIFFORD_UNITARIES = np.array([decomposition_unitary(*d) for d in CLIFFORD_DECOMPOSITIONS])
+_INDEX_BY_KEY = {_unitary_key(u): i for i, u in enumerate(CLIFFORD_UNITARIES)}
+
+
+def clifford_index_of_unitary(unitary: np.ndarray) -> int:
+    """The index of the Clifford equal (up to a global phase) to the given 2x2 unitary."""
+    return _INDEX_BY_KEY[_unitary_key(unitary)]
+
+
+# CAYLEY_TABLE[state, step] is the Clifford obtained by applying 'step' after 'state'
+CAYLEY_TABLE = np.array(
+    [[clifford_index_of_unitary(CLIFFORD_UNITARIES[step] @ CLIFFORD_UNITARIES[state]) for step in range(24)]
+     for state in range(24)]
+)
+INVERSE_TABLE = np.array([int(np.where(CAYLEY_TABLE[state] == 0)[0][0]) for state in range(24)])
+PULSES_PER_CLIFFORD = np.array([0 if pulse is None else 1 for _, pulse, _ in CLIFFORD_DECOMPOSITIONS])
+# PULSE_COUNTS_PER_CLIFFORD[pulse][clifford] is the number of 'pulse' played for the Clifford
+PULSE_COUNTS_PER_CLIFFORD = {
+    name: np.array([int(pulse == name) for _, pulse, _ in CLIFFORD_DECOMPOSITIONS]) for name in PULSE_ANGLES
+}
+AVERAGE_PULSES_PER_CLIFFORD = float(PULSES_PER_CLIFFORD.mean())
+
+_NAMED_GATES = {
+    "I": np.eye(2),
+    "x180": _rx(np.pi),
+    "x90": _rx(np.pi / 2),
+    "-x90": _rx(-np.pi / 2),
+    "y180": _rz(1) @ _rx(np.pi) @ _rz(-1),
+    "y90": _rz(1) @ _rx(np.pi / 2) @ _rz(-1),
+    "-y90": _rz(1) @ _rx(-np.pi / 2) @ _rz(-1),
+    "z90": _rz(1),
+    "z180": _rz(2),
+    "-z90": _rz(-1),
+}
+
+
+def clifford_index(gate: str) -> int:
+    """The index of a named single-qubit gate, e.g. 'x180', '-y90' or 'z90'."""
+    if gate not in _NAMED_GATES:
+        raise ValueError(f"Gate operation {gate} not recognized, expected one of {list(_NAMED_GATES)}")
+    return clifford_index_of_unitary(_NAMED_GATES[gate])
+
+
+def recovery_gate(sequence: Sequence[int]) -> int:
+    """The Clifford bringing the qubit back to its initial state after the sequence."""
+    state = 0
+    for step in sequence:
+        state = CAYLEY_TABLE[state, step]
+    return int(INVERSE_TABLE[state])
+
+
+def compile_sequence(sequence: Sequence[int]) -> List[Tuple[int, str]]:
+    """
+    The physical pulses played for a sequence of Clifford indices, as (frame rotation in quarter turns, pulse) pairs.
+
+    This is the host-side equivalent of 'play_clifford_sequence': the frame rotation before each pulse merges the
+    end of the previous Clifford with the start of the current one. The frame left after the last pulse is a
+    Z rotation which does not affect a measurement along z, and is dropped.
+    """
+    pulses = []
+    frame = 0
+    for clifford in sequence:
+        z_before, pulse, z_after = CLIFFORD_DECOMPOSITIONS[clifford]
+        if pulse is None:
+            frame = (frame + z_before + z_after) % 4
+        else:
+            pulses.append(((frame + z_before) % 4, pulse))
+            frame = z_after
+    return pulses
+
+
+def sequence_pulse_counts(sequence: Sequence[int]) -> Dict[str, int]:
+    """The number of physical pulses of each type played for a sequence of Clifford indices."""
+    counts = {pulse: 0 for pulse in PULSE_ANGLES}
+    for _, pulse in compile_sequence(sequence):
+        counts[pulse] += 1
+    return counts
+
+
+def sequence_duration(sequence: Sequence[int], pulse_lengths: Dict[str, int]) -> int:
+    """The duration (in ns) of a sequence of Clifford indices, given the length of the 'x90' and 'x180' pulses."""
+    return sum(pulse_lengths[pulse] * count for pulse, count in sequence_pulse_counts(sequence).items())
+
+
+def play_clifford(qubit, clifford, frame):
+    """
+    Play a single Clifford on the qubit.
+
+    Parameters:
+    -----------
+    qubit : Transmon
+        The qubit, whose 'xy' channel plays the 'x90' and 'x180' operations.
+    clifford : QUA int
+        The index of the Clifford.
+    frame : QUA int
+        The pending virtual Z rotation in quarter turns, applied together with the Z rotation starting the Clifford.
+        It is updated to the Z rotation ending the Clifford.
+    """
+    with switch_(clifford, unsafe=True):
+        for index, (z_before, pulse, z_after) in enumerate(CLIFFORD_DECOMPOSITIONS):
+            with case_(index):
+                if pulse is None:
+                    assign(frame, (frame + z_before + z_after) & 3)
+                else:
+                    qubit.xy.frame_rotation_2pi(Cast.mul_fixed_by_int(0.25, frame + z_before))
+                    qubit.xy.play(pulse)
+                    assign(frame, z_after)
+
+
+def play_clifford_sequence(sequence_list, depth, qubit, interleaved_idle: Optional[int] = None):
+    """
+    Play the Cliffords 0 to depth (included) of a QUA array of Clifford indices, starting from a reset frame.
+
+    Parameters:
+    -----------
+    sequence_list : QUA int array
+        The indices of the Cliffords.
+    depth : QUA int
+        The index of the last Clifford played.
+    qubit : Transmon
+        The qubit, whose 'xy' channel plays the 'x90' and 'x180' operations.
+    interleaved_idle : int, optional
+        If given, the Cliffords at odd positions (the interleaved gates of an interleaved RB sequence) are played as
+        a wait of this duration in clock cycles, i.e. as a physical idle rather than as the identity, which costs no
+        time. Default is None.
+    """
+    i = declare(int)
+    frame = declare(int, value=0)
+    reset_frame(qubit.xy.name)
+    with for_(i, 0, i <= depth, i + 1):
+        if interleaved_idle is None:
+            play_clifford(qubit, sequence_list[i], frame)
+        else:
+            with if_((i & 1) == 1):
+                qubit.xy.wait(interleaved_idle)
+            with else_():
+                play_clifford(qubit, sequence_list[i], frame)
@@ -3,65 +3,82 @@ import xarray as xr
 import numpy as np
 from iqcc_research.quam_config.lib.qua_datasets import apply_angle
 from scipy.signal import savgol_filter
-from scipy.signal import deconvolve
+from scipy.signal import lfilter
+from scipy.linalg import toeplitz
 from scipy.optimize import minimize
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, least_squares
+from qualang_tools.digital_filters import calc_filter_taps
+from iqcc_research.quam_config.lib.instrument_limits import FilterLimits
+from iqcc_research.quam_config.lib.opx_filters import OPXFilterChain
+
+
+def fit_ellipse(x, y):
+    """
+    Direct least-squares ellipse fit (Fitzgibbon, in the numerically stable form of Halir & Flusser).
+
+    The conic 'A x^2 + B xy + C y^2 + D x + E y + F = 0' minimizing the algebraic distance to the points, under
+    the ellipse constraint '4AC - B^2 = 1', is the solution of a 3x3 eigenvalue problem. No initial guess or
+    iterative optimization is needed, and all the leading dimensions (e.g. qubits) are fitted at once.
+
+    :param x: x coordinates of the points, with shape (..., n_points)
+    :param y: y coordinates of the points, with the same shape as x
+    :return: (center, quadratic_form, level) such that the ellipse is '(p - center)^T quadratic_form (p - center) = level',
+        with shapes (..., 2), (..., 2, 2) and (...). The quadratic form is positive definite and the level positive.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # center and scale the points for a well-conditioned design matrix
+    x_mean, y_mean = x.mean(axis=-1, keepdims=True), y.mean(axis=-1, keepdims=True)
+    scale = np.sqrt(np.mean((x - x_mean) ** 2 + (y - y_mean) ** 2, axis=-1, keepdims=True))
+    xs, ys = (x - x_mean) / scale, (y - y_mean) / scale
+
+    quadratic = np.stack([xs**2, xs * ys, ys**2], axis=-1)
+    linear = np.stack([xs, ys, np.ones_like(xs)], axis=-1)
+    s1 = np.swapaxes(quadratic, -1, -2) @ quadratic
+    s2 = np.swapaxes(quadratic, -1, -2) @ linear
+    s3 = np.swapaxes(linear, -1, -2) @ linear
+    t = -np.linalg.solve(s3, np.swapaxes(s2, -1, -2))
+    m = s1 + s2 @ t
+    # premultiply by the inverse of the constraint matrix
+    m = np.stack([m[..., 2, :] / 2, -m[..., 1, :], m[..., 0, :] / 2], axis=-2)
+    _, eigenvectors = np.linalg.eig(m)
+    eigenvectors = eigenvectors.real
+    constraint = 4 * eigenvectors[..., 0, :] * eigenvectors[..., 2, :] - eigenvectors[..., 1, :] ** 2
+    quadratic_coefficients = np.take_along_axis(eigenvectors, np.argmax(constraint, axis=-1)[..., None, None], axis=-1)
+    linear_coefficients = t @ quadratic_coefficients
+    a, b, c = np.moveaxis(quadratic_coefficients[..., 0], -1, 0)
+    d, e, f = np.moveaxis(linear_coefficients[..., 0], -1, 0)
+
+    quadratic_form = np.stack([np.stack([a, b / 2], axis=-1), np.stack([b / 2, c], axis=-1)], axis=-2)
+    center = -np.linalg.solve(2 * quadratic_form, np.stack([d, e], axis=-1)[..., None])[..., 0]
+    level = np.einsum("...i,...ij,...j->...", center, quadratic_form, center) - f
+    # the conic is only defined up to its sign, choose the positive definite quadratic form
+    sign = np.sign(np.trace(quadratic_form, axis1=-2, axis2=-1))
+    quadratic_form, level = quadratic_form * sign[..., None, None], level * sign
+    # back to the original coordinates
+    center = center * scale + np.concatenate([x_mean, y_mean], axis=-1)
+    return center, quadratic_form / scale[..., None] ** 2, level
 
 
 def transform_to_circle(x, y):
-    def ellipse_residuals(params, x, y):
-        a, b, cx, cy, angle = params
-        cos_angle = np.cos(angle)
-        sin_angle = np.sin(angle)
-        x_rot = cos_angle * (x - cx) + sin_angle * (y - cy)
-        y_rot = -sin_angle * (x - cx) + cos_angle * (y - cy)
-        residuals = (x_rot / a) ** 2 + (y_rot / b) ** 2 - 1
-        return np.sum(residuals**2)  # Return the sum of squared residuals
-
-    # Fit ellipse to points
-    initial_guess = [0.5, 0.5, 0.5, 0.5, 0.0]  # Initial guess for ellipse parameters including angle
-    result = minimize(ellipse_residuals, initial_guess, args=(x, y))
-    a_fit, b_fit, cx_fit, cy_fit, angle_fit = result.x
-
-    # Transform ellipse to circle
-    scale_factor = max(a_fit, b_fit)
-    a_circle = scale_factor
-    b_circle = scale_factor
-    cx_circle = cx_fit
-    cy_circle = cy_fit
-
-    # Generate points for the fitted ellipse
-    theta = np.linspace(0, 2 * np.pi, 100)
-    ellipse_x = a_fit * np.cos(theta)
-    ellipse_y = b_fit * np.sin(theta)
-
-    # Rotate the ellipse points
-    cos_angle = np.cos(angle_fit)
-    sin_angle = np.sin(angle_fit)
-    x_ellipse_rot = cos_angle * ellipse_x - sin_angle * ellipse_y + cx_fit
-    y_ellipse_rot = sin_angle * ellipse_x + cos_angle * ellipse_y + cy_fit
-
-    # # Plot the original data points
-    # plt.scatter(x, y, label='Data Points')
-
-    # # Plot the fitted ellipse
-    # plt.plot(x_ellipse_rot, y_ellipse_rot, color='r', label='Fitted Ellipse')
-    # plt.show()
-
-    # Apply transform to xy points
-    # Step 1: Rotate the original points to align with the ellipse's axes
-    x_rot = cos_angle * (x - cx_fit) + sin_angle * (y - cy_fit)
-    y_rot = -sin_angle * (x - cx_fit) + cos_angle * (y - cy_fit)
-
-    # Step 2: Scale the rotated points to transform the ellipse into a circle
-    x_scaled = x_rot / a_fit * a_circle
-    y_scaled = y_rot / b_fit * b_circle
-
-    # Step 3: Rotate the scaled points back to the original orientation
-    x_transformed = cos_angle * x_scaled - sin_angle * y_scaled + cx_circle
-    y_transformed = sin_angle * x_scaled + cos_angle * y_scaled + cy_circle
-
-    return x_transformed, y_transformed
+    """
+    Map the points lying on an ellipse onto a circle with the same center and a radius equal to the major semi-axis.
+
+    The ellipse is fitted with 'fit_ellipse', and the points are scaled along its minor axis. The leading
+    dimensions of x and y (e.g. qubits) are transformed at once.
+
+    :param x: x coordinates of the points, with shape (..., n_points)
+    :param y: y coordinates of the points, with the same shape as x
+    :return: the transformed x and y coordinates
+    """
+    center, quadratic_form, level = fit_ellipse(x, y)
+    eigenvalues, axes = np.linalg.eigh(quadratic_form)
+    # the semi-axes are sqrt(level / eigenvalue), each of them is scaled to the major one
+    scaling = np.sqrt(eigenvalues / eigenvalues.min(axis=-1, keepdims=True))
+    transform = axes @ (scaling[..., :, None] * np.swapaxes(axes, -1, -2))
+    points = np.stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)], axis=-1) - center[..., None, :]
+    transformed = points @ np.swapaxes(transform, -1, -2) + center[..., None, :]
+    return transformed[..., 0], transformed[..., 1]
 
 
 def savgol(da, dim, range=3, order=2):
@@ -168,31 +185,61 @@ def single_exp(da, plot=True):
     return fir, iir, fig, ax, (da.time, expdecay(da.time, **fit_vals))
 
 
-def estimate_fir_coefficients(convolved_signal, step_response, num_coefficients):
+def estimate_fir_coefficients(convolved_signal, step_response, num_coefficients, regularization=1e-4, limits=None):
     """
-    Estimate the FIR filter coefficients from a convolved signal.
+    Estimate the FIR filter coefficients that map the measured step response onto the target signal.
+
+    The coefficients are the regularized (Tikhonov) least-squares solution of
+    'step_response * h = convolved_signal' over the length of 'step_response', with the convolution written as a
+    Toeplitz matrix. The regularization pulls the filter towards the identity filter, which keeps the solution
+    stable for noisy step responses where the direct deconvolution diverges.
 
-    :param convolved_signal: The signal after being convolved with the FIR filter.
-    :param step_response: The original step response signal.
+    :param convolved_signal: The target signal, i.e. the ideal step. Only its first len(step_response) points are used.
+    :param step_response: The measured step response signal.
     :param num_coefficients: Number of coefficients of the FIR filter to estimate.
+    :param regularization: Weight of the Tikhonov term, relative to the mean power of the step response.
+    :param limits: Optional 'FilterLimits' of the output port (see 'instrument_limits.filter_limits'). The number of
+        coefficients is capped to its feedforward taps and the coefficients are rescaled to its maximal amplitude.
     :return: Estimated FIR coefficients.
     """
-    # Deconvolve to estimate the impulse response
-    estimated_impulse_response, _ = deconvolve(convolved_signal, step_response)
-
-    # Truncate or zero-pad the estimated impulse response to match the desired number of coefficients
-    if len(estimated_impulse_response) > num_coefficients:
-        # Truncate if the estimated response is longer than the desired number of coefficients
-        estimated_coefficients = estimated_impulse_response[:num_coefficients]
-    else:
-        # Zero-pad if shorter
-        estimated_coefficients = np.pad(
-            estimated_impulse_response, (0, num_coefficients - len(estimated_impulse_response)), "constant"
-        )
+    step_response = np.asarray(step_response, dtype=float)
+    target = np.asarray(convolved_signal, dtype=float)[: len(step_response)]
+    if limits is not None:
+        num_coefficients = min(num_coefficients, limits.feedforward_taps())
+
+    # causal convolution matrix, truncated to the measured window
+    first_row = np.zeros(num_coefficients)
+    first_row[0] = step_response[0]
+    convolution_matrix = toeplitz(step_response, first_row)
+
+    weight = np.sqrt(regularization * np.mean(step_response**2) * len(step_response))
+    identity = np.zeros(num_coefficients)
+    identity[0] = target[-1] / step_response[-1] if step_response[-1] != 0 else 1
+    estimated_coefficients = np.linalg.lstsq(
+        np.vstack([convolution_matrix, weight * np.eye(num_coefficients)]),
+        np.concatenate([target, weight * identity]),
+        rcond=None,
+    )[0]
+
+    if limits is not None:
+        estimated_coefficients = rescale_feedforward_taps(estimated_coefficients, limits.max_feedforward_amplitude)
 
     return estimated_coefficients
 
 
+def rescale_feedforward_taps(taps, max_amplitude):
+    """
+    Rescale feedforward taps whose largest magnitude exceeds 'max_amplitude' down to it.
+
+    The rescaled taps are clipped to 'max_amplitude', since the float rounding of the rescaling can leave the largest
+    tap slightly above it.
+    """
+    taps = np.asarray(taps, dtype=float)
+    if np.max(np.abs(taps)) > max_amplitude:
+        taps = np.clip(max_amplitude * taps / np.max(np.abs(taps)), -max_amplitude, max_amplitude)
+    return taps
+
+
 def gaussian(x, a, x0, sigma, offset):
     """Gaussian function for fitting spectroscopy peaks.
     
@@ -460,4 +507,305 @@ def optimize_start_fractions(t, y, base_fractions, bounds_scale=0.5, verbose=Tru
         components, a_dc, best_residual = sequential_exp_fit(t, y, best_fractions, verbose=False)
         best_rms = np.sqrt(np.mean(best_residual**2))
     
-    return result.success, best_fractions, components, a_dc, best_rms
\ No newline at end of file
+    return result.success, best_fractions, components, a_dc, best_rms
+
+def _exp_basis(t, taus):
+    """Basis of the multi-exponential model: a constant column followed by one decaying exponential per time constant."""
+    return np.column_stack([np.ones_like(t), np.exp(-t[:, None] / taus[None, :])])
+
+
+def varpro_exp_fit(t, y, n_components, tau_min=None, tau_max=None, taus_init=None):
+    """
+    Fit a constant plus a sum of exponentials to the data, jointly for all components, by variable projection.
+
+    For a given set of time constants, the amplitudes and the constant term are the linear least-squares
+    solution, so only the time constants are optimized (in log scale). The Jacobian of the projected
+    residual is computed analytically with the Kaufman approximation, so each component costs a single
+    extra column of the basis instead of a separate nonlinear fit.
+
+    Args:
+        t (array): Time points in nanoseconds
+        y (array): Data points (normalized amplitude)
+        n_components (int): Number of exponential components to fit
+        tau_min (float): Smallest allowed time constant in ns. Defaults to the time step of the data.
+        tau_max (float): Largest allowed time constant in ns. Defaults to 10 times the time span of the data.
+        taus_init (list): Initial guess of the time constants in ns. Defaults to log-spaced values over the data.
+
+    Returns:
+        tuple: (success, components, a_dc, residual) where:
+            - success: Whether the optimization converged to finite time constants and amplitudes
+            - components: List of (amplitude, tau) pairs for each fitted component, slowest first
+            - a_dc: Fitted constant term
+            - residual: Residual after subtracting the full fit
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    t_offset = t - t[0]  # Make time start at 0
+    span = t_offset[-1]
+    tau_min = np.min(np.diff(t_offset)) if tau_min is None else tau_min
+    tau_max = 10 * span if tau_max is None else tau_max
+    if taus_init is None:
+        taus_init = np.geomspace(span / 3, max(span / 3 ** (2 * n_components - 1), 2 * tau_min), n_components)
+    log_taus_init = np.log(np.clip(taus_init, tau_min * (1 + 1e-6), tau_max * (1 - 1e-6)))
+
+    def linear_solution(log_taus):
+        basis = _exp_basis(t_offset, np.exp(log_taus))
+        q, r = np.linalg.qr(basis)
+        coefficients = np.linalg.lstsq(r, q.T @ y, rcond=None)[0]
+        return basis, q, coefficients
+
+    def residuals(log_taus):
+        basis, _, coefficients = linear_solution(log_taus)
+        return basis @ coefficients - y
+
+    def jacobian(log_taus):
+        basis, q, coefficients = linear_solution(log_taus)
+        # derivative of each exponential column with respect to its log time constant, times its amplitude
+        d_columns = basis[:, 1:] * (t_offset[:, None] / np.exp(log_taus)[None, :]) * coefficients[None, 1:]
+        return d_columns - q @ (q.T @ d_columns)
+
+    try:
+        result = least_squares(
+            residuals, log_taus_init, jac=jacobian, bounds=(np.log(tau_min), np.log(tau_max)), x_scale=1.0
+        )
+    except (ValueError, np.linalg.LinAlgError):
+        return False, [], np.nan, np.full_like(y, np.nan)
+
+    taus = np.exp(result.x)
+    basis, _, coefficients = linear_solution(result.x)
+    residual = y - basis @ coefficients
+    order = np.argsort(taus)[::-1]
+    components = [(coefficients[1 + i], taus[i]) for i in order]
+    success = bool(result.success and np.all(np.isfinite(coefficients)))
+    return success, components, coefficients[0], residual
+
+
+def exponential_filter_taps(components, a_dc):
+    """
+    Convert fitted exponential components to the OPX 'exponential_filter' format.
+
+    Args:
+        components (list): List of (amplitude, tau) pairs, as returned by 'varpro_exp_fit' or 'sequential_exp_fit'
+        a_dc (float): Fitted constant term
+
+    Returns:
+        list: List of [amplitude / a_dc, tau] pairs, to be set in 'qubit.z.opx_output.exponential_filter'
+    """
+    return [[float(amp / a_dc), float(tau)] for amp, tau in components]
+
+
+def unwrapped_phase(da, dim):
+    """Unwrapped phase of a complex DataArray along 'dim', for all the other dimensions at once."""
+    return xr.apply_ufunc(
+        lambda z: np.unwrap(np.angle(z), axis=-1), da, input_core_dims=[[dim]], output_core_dims=[[dim]]
+    )
+
+
+def cryoscope_flux(
+    da,
+    quad_terms=None,
+    stable_time_indices=(20, -20),
+    sg_range=3,
+    sg_order=2,
+    normalization_window=(80, 120),
+    ellipse_correction=False,
+):
+    """
+    Batched version of 'cryoscope_frequency': flux seen by all the qubits from the cryoscope Bloch vectors.
+
+    The offset removal, phase unwrapping and Savitzky-Golay differentiation are done on the whole
+    (qubit x time) array at once, and the frequency-to-flux conversion is done once per qubit.
+
+    Args:
+        da (xr.DataArray): Cryoscope data with dimensions 'qubit', 'axis' (with values 'x' and 'y') and 'time'
+        quad_terms (list or xr.DataArray): Quadratic term of the frequency vs flux of each qubit, in Hz/V^2.
+            If None, the flux is in arbitrary units, normalized to its mean over 'normalization_window'.
+        stable_time_indices (tuple): Positional indices of the time window used to find the center of the Bloch vector
+        sg_range (int): Window length of the Savitzky-Golay filter
+        sg_order (int): Polynomial order of the Savitzky-Golay filter
+        normalization_window (tuple): Time window (in ns) of the normalization when 'quad_terms' is None
+        ellipse_correction (bool): Map the Bloch vector trajectory of each qubit onto a circle with 'transform_to_circle'
+            before extracting its phase, to correct for unequal x and y contrasts
+
+    Returns:
+        xr.DataArray: The flux with dimensions 'qubit' and 'time'
+    """
+    if ellipse_correction:
+        x, y = xr.apply_ufunc(
+            transform_to_circle,
+            da.sel(axis="x", drop=True),
+            da.sel(axis="y", drop=True),
+            input_core_dims=[["time"], ["time"]],
+            output_core_dims=[["time"], ["time"]],
+        )
+        da = xr.concat([x, y], dim=da.axis).transpose(*da.dims)
+    stable = da.isel(time=slice(*stable_time_indices))
+    da = da - (stable.max(dim="time") + stable.min(dim="time")) / 2
+    angle = unwrapped_phase(da.sel(axis="x") + 1j * da.sel(axis="y"), "time").rename("angle")
+    freq = diff_savgol(angle, "time", range=sg_range, order=sg_order)
+    if quad_terms is None:
+        flux = np.sqrt(np.abs(1e9 * freq)).fillna(0)
+        return (flux / flux.sel(time=slice(*normalization_window)).mean(dim="time")).rename("flux")
+    if not isinstance(quad_terms, xr.DataArray):
+        quad_terms = xr.DataArray(np.asarray(quad_terms, dtype=float), dims=["qubit"], coords={"qubit": da.qubit})
+    return np.sqrt(np.abs(1e9 * freq / quad_terms)).fillna(0).rename("flux")
+
+
+def align_step_responses(flux, threshold=0.6, drop_margin=4):
+    """
+    Align the step responses of all the qubits on their rise.
+
+    Args:
+        flux (xr.DataArray): Flux with dimensions 'qubit' and 'time'
+        threshold (float): Fraction of the maximum of each trace that defines its rise
+        drop_margin (int): Number of points dropped at the end of the traces
+
+    Returns:
+        tuple: (aligned, rise_index) where:
+            - aligned: The traces starting at their rise, with a common length and a 'time' coordinate starting at 0
+            - rise_index: The positional index of the rise of each qubit
+    """
+    flux = flux.transpose("qubit", "time")
+    values = flux.values
+    rise_index = np.argmax(values > threshold * values.max(axis=1, keepdims=True), axis=1) + 1
+    length = values.shape[1] - rise_index.max() - drop_margin
+    aligned = np.take_along_axis(values, rise_index[:, None] + np.arange(length)[None, :], axis=1)
+    time = flux.time.values[:length] - flux.time.values[0]
+    aligned = xr.DataArray(aligned, dims=["qubit", "time"], coords={"qubit": flux.qubit, "time": time})
+    return aligned, xr.DataArray(rise_index, dims=["qubit"], coords={"qubit": flux.qubit})
+
+
+def _iir_denominator(feedback_taps):
+    """Denominator of the transfer function of the OPX exponential (IIR) filters, for 'scipy.signal.lfilter'."""
+    denominator = np.array([1.0])
+    for tap in feedback_taps:
+        denominator = np.convolve(denominator, [1, -tap])
+    return denominator
+
+
+def _filter_layout(limits, n_components, fir_length):
+    """
+    How the filters of a port are designed: whether the exponentials have their own sections, the FIR length, the
+    number of feedforward taps and their maximal amplitude.
+    """
+    if limits is None:
+        return False, fir_length, n_components + fir_length, 2 - 2**-16
+    if n_components > limits.max_exponential_filters:
+        raise ValueError(
+            f"{n_components} exponential filters requested, at most {limits.max_exponential_filters} are available"
+        )
+    if limits.exponential_filter_sections:
+        fir_length = min(fir_length, limits.feedforward_taps())
+        return True, fir_length, fir_length, limits.max_feedforward_amplitude
+    # the exponential corrections take n_components + 1 feedforward taps, the convolution with the FIR adds fir_length - 1
+    fir_length = min(fir_length, limits.feedforward_taps(n_components) - n_components)
+    return False, fir_length, n_components + fir_length, limits.max_feedforward_amplitude
+
+
+def design_cryoscope_filters(
+    flux,
+    n_components=2,
+    fir_length=28,
+    fir_window=200,
+    fit_start=4,
+    rise_threshold=0.6,
+    regularization=1e-4,
+    limits=None,
+):
+    """
+    Design the OPX flux line filters of all the qubits from their cryoscope step responses.
+
+    The slow distortions are corrected by exponential (IIR) filters, from a joint multi-exponential fit of each
+    step response ('varpro_exp_fit'). The remaining fast distortions are corrected by a FIR filter estimated
+    on the first 'fir_window' ns of the response corrected by the exponential filters.
+
+    When the limits have dedicated exponential filter sections (OPX1000 LF-FEM), the exponentials are kept as
+    (amplitude, tau) pairs for 'exponential_filter' and the feedforward taps are the FIR alone. Otherwise (OPX+),
+    the exponentials are merged into the feedforward and feedback taps, whose quantization limits the accuracy
+    of the correction of small, slow distortions.
+
+    Args:
+        flux (xr.DataArray): Flux with dimensions 'qubit' and 'time', e.g. from 'cryoscope_flux'
+        n_components (int): Number of exponentials to correct
+        fir_length (int): Number of taps of the FIR correction
+        fir_window (int): Length in ns of the start of the response used to estimate the FIR correction
+        fit_start (int): Number of points after the rise excluded from the exponential fit
+        rise_threshold (float): Fraction of the maximum of each trace that defines its rise
+        regularization (float): Relative weight of the Tikhonov term of the FIR estimation
+        limits (FilterLimits or list): Optional filter limits of the flux output ports (see
+            'instrument_limits.filter_limits'), either shared by all the qubits or one per qubit. The FIR length is
+            capped to the feedforward taps left next to the exponential filters, and the feedforward taps are
+            rescaled to the maximal tap amplitude. Without limits, the taps are kept below 2 and the exponentials
+            are merged into the feedforward and feedback taps.
+
+    Returns:
+        xr.Dataset: Per qubit, the fitted exponentials ('amplitude', 'tau'), the 'feedforward' and 'feedback'
+        taps, the corrected response 'corrected_flux' and a 'success' flag. 'exponential_sections' tells whether
+        the exponentials are to be set as 'exponential_filter', in which case 'feedback' is NaN. The feedforward
+        taps of the qubits with fewer taps than others are padded with NaN.
+    """
+    flux = flux.transpose("qubit", "time")
+    n_qubits = flux.sizes["qubit"]
+    if limits is None or isinstance(limits, FilterLimits):
+        limits = [limits] * n_qubits
+    if len(limits) != n_qubits:
+        raise ValueError(f"Expected the filter limits of {n_qubits} qubits, got {len(limits)}")
+    layouts = [_filter_layout(qubit_limits, n_components, fir_length) for qubit_limits in limits]
+
+    aligned, rise_index = align_step_responses(flux, threshold=rise_threshold)
+    t = aligned.time.values
+    amplitude = np.full((n_qubits, n_components), np.nan)
+    tau = np.full((n_qubits, n_components), np.nan)
+    feedforward = np.full((n_qubits, max(n_taps for _, _, n_taps, _ in layouts)), np.nan)
+    feedback = np.full((n_qubits, n_components), np.nan)
+    corrected = np.full(flux.shape, np.nan)
+    success = np.zeros(n_qubits, dtype=bool)
+    exponential_sections = np.array([sections for sections, _, _, _ in layouts])
+
+    for i, y in enumerate(aligned.values):
+        _, qubit_fir_length, n_taps, max_feedforward = layouts[i]
+        fit_successful, components, a_dc, _ = varpro_exp_fit(t[fit_start:], y[fit_start:], n_components)
+        if not fit_successful:
+            continue
+        # the fit is referenced to its first point, the filters to the rise of the step
+        components = [(amp * np.exp(t[fit_start] / tau_k), tau_k) for amp, tau_k in components]
+        amplitude[i], tau[i] = np.array(exponential_filter_taps(components, a_dc)).T
+        if exponential_sections[i]:
+            # emulate the exponential sections as the LF-FEM applies them, ahead of the FIR
+            sections = OPXFilterChain(exponential=list(zip(amplitude[i], tau[i])), hardware="opx1000")
+            exp_corrected = sections.apply(y, clip=False)
+            exp_corrected_flux = sections.apply(flux.values[i], clip=False)
+        else:
+            exp_feedforward, exp_feedback = calc_filter_taps(exponential=exponential_filter_taps(components, a_dc))
+            denominator = _iir_denominator(exp_feedback)
+            exp_corrected = lfilter(exp_feedforward, denominator, y)
+
+        long_corrected = exp_corrected[:fir_window]
+        final_value = np.mean(long_corrected[len(long_corrected) // 2 :])
+        step = np.ones(len(y) + 100) * final_value
+        fir = estimate_fir_coefficients(step, long_corrected, qubit_fir_length, regularization=regularization)
+
+        taps = fir if exponential_sections[i] else np.convolve(exp_feedforward, fir)
+        taps = rescale_feedforward_taps(taps, max_feedforward)
+        feedforward[i, :n_taps] = taps
+        if exponential_sections[i]:
+            corrected[i] = lfilter(taps, [1.0], exp_corrected_flux)
+        else:
+            feedback[i] = exp_feedback
+            corrected[i] = lfilter(taps, denominator, flux.values[i])
+        success[i] = True
+
+    qubit = {"qubit": flux.qubit}
+    return xr.Dataset(
+        {
+            "rise_index": rise_index,
+            "amplitude": (["qubit", "component"], amplitude),
+            "tau": (["qubit", "component"], tau),
+            "feedforward": (["qubit", "tap"], feedforward),
+            "feedback": (["qubit", "component"], feedback),
+            "corrected_flux": (["qubit", "time"], corrected),
+            "success": (["qubit"], success),
+            "exponential_sections": (["qubit"], exponential_sections),
+        },
+        coords={**qubit, "time": flux.time, "component": np.arange(n_components), "tap": np.arange(feedforward.shape[1])},
+    )
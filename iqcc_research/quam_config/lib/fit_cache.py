@@ -0,0 +1,289 @@
+"""
+Warm-start cache for the fits done in the calibration nodes.
+
+Retune graphs refit the same quantities on the same qubits many times a day. The cache stores the
+last successful fit parameters per (node name, qubit, fit model) in a small json file, so that the
+next fit can start from them, with bounds around the physically meaningful parameters. Whenever
+the warm fit fails, the regular (cold) fit with generic initial guesses is used instead.
+"""
+
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+from scipy.optimize import curve_fit
+from qualibration_libs.analysis import decay_exp, oscillation, oscillation_decay_exp
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FitModel:
+    """A fit model known to the cache, matching one of the qualibration_libs fitting functions."""
+
+    function: Callable
+    params: List[str]
+    bounded_params: List[str]
+    with_covariance: bool
+    positive_params: Sequence[str] = ()
+
+    @property
+    def fit_vals(self) -> List[str]:
+        """The 'fit_vals' coordinate of the corresponding qualibration_libs fit."""
+        if not self.with_covariance:
+            return list(self.params)
+        return list(self.params) + [f"{p}_{q}" for p in self.params for q in self.params]
+
+
+FIT_MODELS: Dict[str, FitModel] = {
+    "decay_exp": FitModel(decay_exp, ["a", "offset", "decay"], ["decay"], with_covariance=True),
+    "oscillation": FitModel(
+        oscillation, ["a", "f", "phi", "offset"], ["f"], with_covariance=False, positive_params=["a"]
+    ),
+    "oscillation_decay_exp": FitModel(
+        oscillation_decay_exp, ["a", "f", "phi", "offset", "decay"], ["f", "decay"], with_covariance=True
+    ),
+}
+
+
+def default_fit_cache_path() -> Path:
+    """
+    The path of the cache file: 'IQCC_FIT_CACHE_PATH' if set, else in the home folder.
+
+    The cache is never stored in the QuAM state folder, since QuAM loads and merges every json file found there.
+    """
+    if "IQCC_FIT_CACHE_PATH" in os.environ:
+        return Path(os.environ["IQCC_FIT_CACHE_PATH"])
+    return Path.home() / ".iqcc_research" / "fit_cache.json"
+
+
+class FitCache:
+    """Persistent store of the last successful fit parameters per (node name, qubit, fit model)."""
+
+    def __init__(self, path: Optional[os.PathLike] = None):
+        self.path = Path(path) if path is not None else default_fit_cache_path()
+        self._entries: Dict[str, Dict[str, Dict[str, dict]]] = {}
+        if self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read the fit cache {self.path}, starting from an empty cache: {e}")
+
+    def get(self, node_name: str, qubit: str, model: str) -> Optional[Dict[str, float]]:
+        """Return the cached fit parameters, or None if there are none."""
+        entry = self._entries.get(node_name, {}).get(qubit, {}).get(model)
+        return None if entry is None else entry["params"]
+
+    def update(self, node_name: str, qubit: str, model: str, params: Dict[str, float]):
+        """Store the parameters of a successful fit, replacing the previous ones."""
+        self._entries.setdefault(node_name, {}).setdefault(qubit, {})[model] = {
+            "params": {name: float(value) for name, value in params.items()},
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._entries, indent=2))
+
+
+def _trace_keys(da: xr.DataArray, dim: str) -> List[tuple]:
+    """The selections of all the 1D traces along 'dim', and the corresponding cache keys."""
+    other_dims = [d for d in da.dims if d != dim]
+    keys = []
+    for index in np.ndindex(*[da.sizes[d] for d in other_dims]):
+        selection = {d: da[d].values[i] for d, i in zip(other_dims, index)}
+        # the qubit is the main key, other dimensions (e.g. detuning signs) are appended to it
+        name = str(selection.get("qubit", ""))
+        extra = [f"{d}={selection[d]}" for d in other_dims if d != "qubit"]
+        keys.append((selection, "/".join([name] + extra)))
+    return keys
+
+
+def _warm_fit(
+    x: np.ndarray,
+    y: np.ndarray,
+    model: FitModel,
+    cached: Dict[str, float],
+    bound_factor: float,
+    min_rsquared: float,
+) -> Tuple[Optional[np.ndarray], Optional[int], Optional[float]]:
+    """
+    Fit a single trace starting from the cached parameters.
+
+    Returns the fit values (None if the warm fit fails), the number of function evaluations and the rms residual.
+    """
+    p0 = [cached[p] for p in model.params]
+    lower = [-np.inf] * len(p0)
+    upper = [np.inf] * len(p0)
+    for i, p in enumerate(model.params):
+        if p in model.bounded_params and p0[i] != 0:
+            lower[i], upper[i] = sorted([p0[i] / bound_factor, p0[i] * bound_factor])
+        elif p in model.positive_params:
+            lower[i] = 0
+            p0[i] = max(p0[i], np.finfo(float).eps)
+    # the model is wrapped to count all its evaluations, including those of the finite-difference jacobian
+    nfev = 0
+
+    def counted_model(*args):
+        nonlocal nfev
+        nfev += 1
+        return model.function(*args)
+
+    try:
+        popt, pcov = curve_fit(counted_model, x, y, p0=p0, bounds=(lower, upper))
+    except (RuntimeError, ValueError):
+        return None, nfev, None
+    if not (np.all(np.isfinite(popt)) and np.all(np.isfinite(pcov))):
+        return None, nfev, None
+    residuals = y - model.function(x, *popt)
+    residual_norm = float(np.sqrt(np.mean(residuals**2)))
+    # a parameter pinned to its bound means the cached value is not a good starting point anymore
+    for i, p in enumerate(model.params):
+        if p in model.bounded_params and np.isclose(popt[i], [lower[i], upper[i]], rtol=1e-6).any():
+            return None, nfev, residual_norm
+    rsquared = 1 - np.sum(residuals**2) / np.sum((y - np.mean(y)) ** 2)
+    if rsquared < min_rsquared:
+        return None, nfev, residual_norm
+    if model.with_covariance:
+        return np.concatenate([popt, pcov.flatten()]), nfev, residual_norm
+    return popt, nfev, residual_norm
+
+
+def fit_with_warm_start(
+    da: xr.DataArray,
+    dim: str,
+    model: str,
+    cold_fit: Callable[[xr.DataArray, str], xr.DataArray],
+    node_name: str,
+    cache: Optional[FitCache] = None,
+    bound_factor: float = 2.0,
+    min_rsquared: float = 0.5,
+    telemetry: Optional[FitTelemetry] = None,
+) -> xr.DataArray:
+    """
+    Fit every trace of ``da`` along ``dim``, starting from the cached parameters of the last successful fit.
+
+    Traces without cached parameters, or for which the warm fit fails (no convergence, a bounded
+    parameter pinned to its bound, or an R^2 below ``min_rsquared``), are fitted with ``cold_fit``.
+
+    Parameters:
+    -----------
+    da : xr.DataArray
+        The data to fit.
+    dim : str
+        The dimension along which to fit.
+    model : str
+        The name of the fit model, one of ``FIT_MODELS``. It must match ``cold_fit``.
+    cold_fit : callable
+        The regular fitting function, e.g. ``qualibration_libs.analysis.fit_decay_exp``.
+    node_name : str
+        The name of the node, used as part of the cache key.
+    cache : FitCache, optional
+        The cache to read the initial guesses from. If None, the default cache is loaded.
+    bound_factor : float, optional
+        The bounded parameters of the model (frequencies and decay rates) are constrained to within
+        this factor of their cached value. Default is 2.
+    min_rsquared : float, optional
+        The minimal R^2 for the warm fit to be accepted. Default is 0.5.
+    telemetry : FitTelemetry, optional
+        If given, the warm fits are recorded in it. To record the cold fits, pass an instrumented ``cold_fit``.
+
+    Returns:
+    --------
+    xr.DataArray
+        The fit results with the same 'fit_vals' as ``cold_fit``, and an additional 'warm_start'
+        coordinate flagging the traces that were fitted from the cache.
+    """
+    fit_model = FIT_MODELS[model]
+    cache = FitCache() if cache is None else cache
+    other_dims = [d for d in da.dims if d != dim]
+
+    fit = xr.DataArray(
+        np.full([da.sizes[d] for d in other_dims] + [len(fit_model.fit_vals)], np.nan),
+        dims=other_dims + ["fit_vals"],
+        coords={**{d: da[d] for d in other_dims}, "fit_vals": fit_model.fit_vals},
+    )
+    warm_start = xr.DataArray(
+        np.zeros([da.sizes[d] for d in other_dims], dtype=bool),
+        dims=other_dims,
+        coords={d: da[d] for d in other_dims},
+    )
+    cold_selections = []
+    for selection, key in _trace_keys(da, dim):
+        cached = cache.get(node_name, key, model)
+        values = None
+        if cached is not None:
+            trace = da.sel(selection)
+            start = time.perf_counter()
+            values, nfev, residual_norm = _warm_fit(
+                trace[dim].values, trace.values, fit_model, cached, bound_factor, min_rsquared
+            )
+            if telemetry is not None:
+                telemetry.record(
+                    f"{model} (warm start)", key, time.perf_counter() - start, nfev, residual_norm, values is not None
+                )
+            if values is None:
+                logger.info(f"Warm-start {model} fit failed for {key}, falling back to the cold fit.")
+        if values is None:
+            cold_selections.append(selection)
+        else:
+            fit.loc[selection] = values
+            warm_start.loc[selection] = True
+
+    if cold_selections:
+        # only the qubits with at least one trace to fit cold are passed to the cold fit
+        if "qubit" in da.dims:
+            cold_qubits = list(dict.fromkeys(selection["qubit"] for selection in cold_selections))
+            cold = cold_fit(da.sel(qubit=cold_qubits), dim)
+        else:
+            cold = cold_fit(da, dim)
+        cold = cold.reindex(fit_vals=fit_model.fit_vals)
+        for selection in cold_selections:
+            fit.loc[selection] = cold.sel(selection).values
+
+    return fit.assign_coords(warm_start=warm_start)
+
+
+def update_fit_cache(
+    fit: xr.DataArray,
+    success: xr.DataArray,
+    model: str,
+    node_name: str,
+    cache: Optional[FitCache] = None,
+):
+    """
+    Store the parameters of the successful fits in the cache and save it.
+
+    Parameters:
+    -----------
+    fit : xr.DataArray
+        The fit results, with a 'fit_vals' dimension, as returned by ``fit_with_warm_start``.
+    success : xr.DataArray
+        Boolean success flag of each fit, broadcastable against the non-'fit_vals' dimensions of ``fit``.
+    model : str
+        The name of the fit model, one of ``FIT_MODELS``.
+    node_name : str
+        The name of the node, used as part of the cache key.
+    cache : FitCache, optional
+        The cache to update. If None, the default cache is loaded.
+    """
+    fit_model = FIT_MODELS[model]
+    cache = FitCache() if cache is None else cache
+    params = fit.sel(fit_vals=fit_model.params)
+    success = success.broadcast_like(params.isel(fit_vals=0, drop=True))
+    for selection, key in _trace_keys(params, "fit_vals"):
+        values = params.sel(selection).values
+        if bool(success.sel(selection)) and np.all(np.isfinite(values)):
+            cache.update(node_name, key, model, dict(zip(fit_model.params, values)))
+    try:
+        cache.save()
+    except OSError as e:
+        logger.warning(f"Could not save the fit cache {cache.path}: {e}")
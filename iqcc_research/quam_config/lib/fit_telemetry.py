@@ -0,0 +1,293 @@
+"""
+Instrumentation of the fits done in the calibration nodes.
+
+Every instrumented fit records, per qubit, its residual norm and success flag, and its wall time and number of
+model function evaluations when they are measured. The records of a node are stored in
+``node.results["fit_telemetry"]`` and are also collected in-process, so that the fits of a whole graph run can be
+summarized at once.
+
+The wall time and the number of function evaluations of a qubit are only available for the fits done here one
+qubit at a time (e.g. 'fit_resonator' and the warm-start fits). The third-party fitters (``fit_decay_exp``,
+``fit_oscillation``, ``peaks_dips``, ...) fit all the qubits in a single batched call whose ``curve_fit`` calls
+are not accessible: their records have no ``nfev`` and no per-qubit ``wall_time``, only a
+``batch_wall_time_share``, the time of the batched call divided by the number of qubits.
+"""
+
+import functools
+import inspect
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+import xarray as xr
+
+# fit telemetry of all the nodes run in this process, keyed by node name
+_graph_run_telemetry: Dict[str, dict] = {}
+
+
+@dataclass
+class FitRecord:
+    """
+    Telemetry of a single fit of a single qubit. For fits done in a single call for all the qubits, the wall time
+    of the qubit is not measured ('wall_time' is None) and 'batch_wall_time_share' is the time of the call divided
+    by the number of qubits.
+    """
+
+    fit: str
+    qubit: str
+    wall_time: Optional[float]
+    nfev: Optional[int]
+    residual_norm: Optional[float]
+    success: bool
+    batch_wall_time_share: Optional[float] = None
+
+
+def _model_params(model: Callable, fit: xr.DataArray) -> List[str]:
+    """The parameters of the model function found in the 'fit_vals' of a fit, in the order of the model signature."""
+    names = list(inspect.signature(model).parameters)[1:]
+    return [name for name in names if name in fit.fit_vals.values]
+
+
+def _is_least_squares_solution(
+    model: Callable, x: np.ndarray, y: np.ndarray, params: np.ndarray, tolerance: float
+) -> bool:
+    """
+    Whether the parameters are a stationary point of the sum of squared residuals of the model.
+
+    The qualibration_libs fitters return their initial guess when ``curve_fit`` fails, which is generically
+    not a stationary point: at a least-squares solution, the residual is orthogonal to the derivative of the
+    model with respect to each parameter. The derivatives are taken by central differences.
+    """
+    if not np.all(np.isfinite(params)):
+        return False
+    mask = np.isfinite(y)
+    x, y = x[mask], y[mask]
+    residual = y - model(x, *params)
+    residual_norm = np.linalg.norm(residual)
+    if residual_norm <= 1e-12 * max(np.linalg.norm(y), 1.0):
+        return True
+    for i, value in enumerate(params):
+        step = 1e-6 * max(abs(value), 1e-9)
+        upper, lower = params.copy(), params.copy()
+        upper[i] += step
+        lower[i] -= step
+        derivative = (model(x, *upper) - model(x, *lower)) / (2 * step)
+        derivative_norm = np.linalg.norm(derivative)
+        if derivative_norm == 0 or not np.isfinite(derivative_norm):
+            continue
+        if abs(derivative @ residual) > tolerance * derivative_norm * residual_norm:
+            return False
+    return True
+
+
+def _trace_stats(
+    model: Callable, da: xr.DataArray, dim: str, fit: xr.DataArray, tolerance: float
+) -> tuple[Optional[float], bool]:
+    """The rms residual and the success of the fit of every trace of ``da`` (all the traces of a qubit)."""
+    names = _model_params(model, fit)
+    params = fit.sel(fit_vals=names)
+    other_dims = [d for d in da.dims if d != dim]
+    squared_residuals, success = [], True
+    for index in np.ndindex(*[da.sizes[d] for d in other_dims]):
+        selection = {d: i for d, i in zip(other_dims, index)}
+        trace = da.isel(selection)
+        trace_params = params.sel({d: trace[d].values for d in other_dims if d in params.dims})
+        values = np.asarray(trace_params.values, dtype=float)
+        x, y = np.asarray(trace[dim].values, dtype=float), np.asarray(trace.values, dtype=float)
+        success &= _is_least_squares_solution(model, x, y, values, tolerance)
+        if np.all(np.isfinite(values)):
+            squared_residuals.append((y - model(x, *values)) ** 2)
+    if not squared_residuals:
+        return None, False
+    return float(np.sqrt(np.nanmean(np.concatenate(squared_residuals)))), bool(success)
+
+
+def _fit_success(fit: Union[xr.DataArray, xr.Dataset]) -> bool:
+    """Without a model function, a fit is considered successful when all of its results are finite."""
+    if isinstance(fit, xr.Dataset):
+        return bool(all(np.all(np.isfinite(fit[v].values)) for v in fit.data_vars))
+    return bool(np.all(np.isfinite(fit.values)))
+
+
+class FitTelemetry:
+    """Collects the telemetry of the fits done during the analysis of a node."""
+
+    def __init__(self):
+        self.records: List[FitRecord] = []
+
+    def instrument(
+        self,
+        fit_function: Callable,
+        name: Optional[str] = None,
+        model: Optional[Callable] = None,
+        residual: Optional[Callable[[xr.DataArray, str, Union[xr.DataArray, xr.Dataset]], float]] = None,
+        stationarity_tolerance: float = 1e-3,
+    ) -> Callable:
+        """
+        Wrap a fitting function with signature ``fit_function(da, dim, *args, **kwargs)`` so that its fits are
+        recorded per qubit. The fitting function is called once, on all the qubits, as without instrumentation.
+
+        Parameters:
+        -----------
+        fit_function : callable
+            The fitting function, e.g. ``qualibration_libs.analysis.fit_decay_exp`` or ``peaks_dips``.
+        name : str, optional
+            The name of the fit in the records. Defaults to the name of ``fit_function``.
+        model : callable, optional
+            The model function of fits returned with a 'fit_vals' dimension, e.g.
+            ``qualibration_libs.analysis.decay_exp``. It is used for the residual and the success of each fit:
+            a fit fails when its parameters are not finite or are not a least-squares solution of the model
+            (e.g. the initial guess returned by a fitter whose ``curve_fit`` failed).
+        residual : callable, optional
+            Custom ``residual(da, dim, fit)`` returning the residual norm, for fits without a 'fit_vals' dimension.
+        stationarity_tolerance : float, optional
+            The largest cosine between the residual and the derivative of the model with respect to a parameter
+            for the fit to be considered converged. Default is 1e-3.
+
+        Returns:
+        --------
+        callable
+            The instrumented fitting function, returning the same result as ``fit_function``.
+        """
+        name = name or fit_function.__name__
+
+        @functools.wraps(fit_function)
+        def instrumented(da: xr.DataArray, dim: str, *args, **kwargs):
+            start = time.perf_counter()
+            fit = fit_function(da, dim, *args, **kwargs)
+            wall_time = time.perf_counter() - start
+
+            per_qubit = "qubit" in da.dims
+            if per_qubit:
+                qubits = list(da.qubit.values)
+            elif "qubit" in da.coords:
+                qubits = [da.qubit.values.item()]
+            else:
+                qubits = [None]
+            for qubit in qubits:
+                da_q = da.sel(qubit=qubit) if per_qubit else da
+                fit_q = fit.sel(qubit=qubit) if per_qubit and "qubit" in fit.dims else fit
+                if model is not None and isinstance(fit_q, xr.DataArray) and "fit_vals" in fit_q.dims:
+                    residual_norm, success = _trace_stats(model, da_q, dim, fit_q, stationarity_tolerance)
+                else:
+                    residual_norm = residual(da_q, dim, fit_q) if residual is not None else None
+                    success = _fit_success(fit_q)
+                self.records.append(
+                    FitRecord(
+                        fit=name,
+                        qubit=str(qubit),
+                        wall_time=None,
+                        nfev=None,
+                        residual_norm=residual_norm,
+                        success=success,
+                        batch_wall_time_share=wall_time / len(qubits),
+                    )
+                )
+            return fit
+
+        return instrumented
+
+    def record_model_result(self, name: str, qubit: str, result, wall_time: float):
+        """Record the telemetry of an lmfit ModelResult, e.g. as returned by 'fit_resonator'."""
+        self.records.append(
+            FitRecord(
+                fit=name,
+                qubit=str(qubit),
+                wall_time=wall_time,
+                nfev=int(result.nfev),
+                residual_norm=float(np.sqrt(np.mean(np.abs(result.residual) ** 2))),
+                success=bool(result.success),
+            )
+        )
+
+    def record(
+        self,
+        name: str,
+        qubit: str,
+        wall_time: Optional[float],
+        nfev: Optional[int],
+        residual_norm: Optional[float],
+        success: bool,
+        batch_wall_time_share: Optional[float] = None,
+    ):
+        """Record the telemetry of any other fit, with the share of a batched call instead of its wall time."""
+        self.records.append(
+            FitRecord(name, str(qubit), wall_time, nfev, residual_norm, success, batch_wall_time_share)
+        )
+
+    def to_dict(self) -> dict:
+        """The records and their summary per fit, in a json-serializable form."""
+        return {"records": [asdict(r) for r in self.records], "summary": _summarize(self.records)}
+
+    def attach_to_node(self, node):
+        """Store the telemetry in ``node.results["fit_telemetry"]`` and in the telemetry of the current graph run."""
+        node.results["fit_telemetry"] = self.to_dict()
+        _graph_run_telemetry[node.name] = node.results["fit_telemetry"]
+
+
+def _summarize(records: List[FitRecord]) -> Dict[str, dict]:
+    """Aggregate the records per fit name."""
+    summary = {}
+    for name in dict.fromkeys(r.fit for r in records):
+        group = [r for r in records if r.fit == name]
+        nfev = [r.nfev for r in group if r.nfev is not None]
+        wall_times = [r.wall_time for r in group if r.wall_time is not None]
+        summary[name] = {
+            "n_fits": len(group),
+            "n_failed": sum(not r.success for r in group),
+            "total_wall_time": _total_wall_time(group),
+            "max_wall_time": max(wall_times) if wall_times else None,
+            "total_nfev": sum(nfev) if nfev else None,
+            "failed_qubits": [r.qubit for r in group if not r.success],
+        }
+    return summary
+
+
+def _total_wall_time(records) -> float:
+    """The total time of the fits, the batched calls counting once through the shares of their qubits."""
+
+    def field(record, name):
+        return record[name] if isinstance(record, dict) else getattr(record, name)
+
+    return sum(
+        (field(r, "wall_time") or 0.0) + (field(r, "batch_wall_time_share") or 0.0) for r in records
+    )
+
+
+def reset_graph_run_telemetry():
+    """Clear the fit telemetry collected in this process, e.g. at the start of a graph run."""
+    _graph_run_telemetry.clear()
+
+
+def summarize_graph_run_telemetry(telemetry: Optional[Dict[str, dict]] = None) -> dict:
+    """
+    Aggregate the fit telemetry of all the nodes of a graph run.
+
+    Parameters:
+    -----------
+    telemetry : dict, optional
+        Mapping from node name to its ``node.results["fit_telemetry"]``. Defaults to the telemetry of all the
+        nodes run in this process since the last call to ``reset_graph_run_telemetry``.
+
+    Returns:
+    --------
+    dict
+        The per-node summaries, the overall totals, and the slowest fits of the run among the fits whose wall
+        time is measured.
+    """
+    telemetry = _graph_run_telemetry if telemetry is None else telemetry
+    records = [
+        dict(record, node=node_name)
+        for node_name, node_telemetry in telemetry.items()
+        for record in node_telemetry["records"]
+    ]
+    return {
+        "nodes": {node_name: node_telemetry["summary"] for node_name, node_telemetry in telemetry.items()},
+        "total_wall_time": _total_wall_time(records),
+        "n_fits": len(records),
+        "n_failed": sum(not r["success"] for r in records),
+        "slowest_fits": sorted(
+            (r for r in records if r.get("wall_time") is not None), key=lambda r: r["wall_time"], reverse=True
+        )[:10],
+    }
@@ -2,7 +2,10 @@ import numpy as np
 import xarray as xr
 from lmfit import Model, Parameter, Parameters
 from scipy.signal import find_peaks
-from iqcc_research.quam_config.lib.fit import peaks_dips
+
+# Maximum rms distance of the data from the fitted resonator circle for the circle fit to be trusted. The distance is
+# in units of the circle radius: 0.05 means the points scatter by 5% of the radius around the circle.
+CIRCLE_FIT_MAX_RESIDUAL = 0.05
 
 
 def _S21_abs(w, A, k, phi, kappa_p, omega_p, omega_r, J):
@@ -34,6 +37,97 @@ def _S21_single(w, A, k, omega_0, omega_r, Q, Qe_real, Qe_imag):
     return (A + k * w) * (1 - ((Q / Qe) / (1 + 2 * 1j * Q * (w - omega_r) / (omega_0 + omega_r))))
 
 
+def _S21_abs_jac(w, A, k, phi, kappa_p, omega_p, omega_r, J):
+
+    # analytic partial derivatives of _S21_abs with respect to each of its parameters, so that
+    # the least-squares solver does not need extra model evaluations for finite differences.
+    # Writing G = cos(phi) - exp(i phi) H, with H = kappa_p R / N, R = -2 i Delta_r and
+    # N = 4 J^2 + (kappa_p - 2 i Delta_p) R, the derivative of |G| is Re(conj(G) dG) / |G|
+
+    Delta_p = omega_p - w
+    Delta_r = omega_r - w
+
+    R = -2 * 1j * Delta_r
+    P = kappa_p - 2 * 1j * Delta_p
+    N = 4 * J**2 + P * R
+    H = kappa_p * R / N
+    G = np.cos(phi) - np.exp(1j * phi) * H
+    G_abs = np.abs(G)
+    B = A + k * w
+
+    dH = {
+        "kappa_p": R * (1 - H) / N,
+        "omega_p": 2 * 1j * R * H / N,
+        "omega_r": -2 * 1j * (kappa_p - H * P) / N,
+        "J": -8 * J * H / N,
+    }
+    dG = {name: -np.exp(1j * phi) * d for name, d in dH.items()}
+    dG["phi"] = -np.sin(phi) - 1j * np.exp(1j * phi) * H
+
+    jac = {name: B * np.real(np.conj(G) * d) / G_abs for name, d in dG.items()}
+    jac["A"] = G_abs
+    jac["k"] = w * G_abs
+    return jac
+
+
+def _S21_single_jac(w, A, k, omega_0, omega_r, Q, Qe_real, Qe_imag):
+
+    # analytic partial derivatives of _S21_single with respect to each of its parameters.
+    # Writing S21 = (A + k w) (1 - F), with F = (Q / Qe) / D and D = 1 + 2 i Q x / s,
+    # where x = w - omega_r and s = omega_0 + omega_r
+
+    Qe = Qe_real + 1j * Qe_imag
+    x = w - omega_r
+    s = omega_0 + omega_r
+    D = 1 + 2 * 1j * Q * x / s
+    F = (Q / Qe) / D
+    B = A + k * w
+
+    dF = {
+        "omega_0": F / D * 2 * 1j * Q * x / s**2,
+        "omega_r": F / D * 2 * 1j * Q * (w + omega_0) / s**2,
+        "Q": F / Q - F / D * 2 * 1j * x / s,
+        "Qe_real": -F / Qe,
+        "Qe_imag": -1j * F / Qe,
+    }
+
+    jac = {name: -B * d for name, d in dF.items()}
+    jac["A"] = 1 - F
+    jac["k"] = w * (1 - F)
+    return jac
+
+
+def _jacobian_dfun(jac_func):
+
+    # wraps an analytic jacobian of a model function into the 'Dfun' callable expected by
+    # lmfit's leastsq, i.e. the derivative of lmfit's residual (data - model) with respect to
+    # the varying parameters only, in the order lmfit uses for its internal variables. Complex
+    # models are handled the same way lmfit does for the residual, by interleaving the real
+    # and imaginary parts
+
+    def dfun(params, data, weights, **kwargs):
+        values = {name: par.value for name, par in params.items()}
+        jac = jac_func(**kwargs, **values)
+        var_names = [name for name, par in params.items() if par.vary and par.expr is None]
+        is_complex = np.iscomplexobj(data)
+        columns = []
+        for name in var_names:
+            column = -np.broadcast_to(jac[name], np.shape(data))
+            if is_complex:
+                column = np.ascontiguousarray(column, dtype=complex).ravel().view(float)
+            columns.append(column)
+        jacobian = np.stack(columns, axis=-1)
+        if weights is not None:
+            weights = np.asarray(weights)
+            if is_complex:
+                weights = weights if np.iscomplexobj(weights) else weights + 1j * weights
+                weights = weights.ravel().view(float)
+            jacobian = jacobian * weights[:, np.newaxis]
+        return jacobian
+
+    return dfun
+
+
 def _truncate_data(transmission, window):
     ds_diff = np.abs(transmission.diff(dim="freq"))
     peak_freq = ds_diff.IQ_abs.idxmax(dim="freq")
@@ -98,7 +192,7 @@ class _two_resonator_model(Model):
         data = transmission_trunc.IQ_abs.values
         f = transmission_trunc.freq.values
 
-        result = self.fit(data, w=f, params=init_guess)
+        result = self.fit(data, w=f, params=init_guess, fit_kws={"Dfun": _jacobian_dfun(_S21_abs_jac)})
 
         return result
 
@@ -195,7 +289,9 @@ def _guess_single(transmission, frequency_LO_IF, rolling_window, window):
     init_params.add("A", value=A)
     init_params.add("Q", value=Q, min=0)
     init_params.add("Qe_real", value=Qe.values, min=0)
-    init_params.add("Qe_imag", value=0, min=0)
+    # start slightly away from the lower bound: at the bound itself the gradient of lmfit's
+    # bounds transformation vanishes, and the analytic jacobian would never move Qe_imag
+    init_params.add("Qe_imag", value=1, min=0)
 
     return init_params
 
@@ -229,7 +325,7 @@ class _single_resonator(Model):
         data = (transmission_trunc.IQ_abs * np.exp(1j * transmission_trunc.phase)).values
         f = transmission_trunc.freq.values
 
-        result = self.fit(data, w=f, params=init_guess)
+        result = self.fit(data, w=f, params=init_guess, fit_kws={"Dfun": _jacobian_dfun(_S21_single_jac)})
 
         return result
 
@@ -284,3 +380,237 @@ def fit_resonator(s21_data: xr.Dataset, frequency_LO_IF: float, print_report: bo
         fit.params.pretty_print()
 
     return fit, fit_eval
+
+
+def _remove_cable_delay(z, f, edge_fraction=0.1, n_refine=21, refine_levels=3):
+
+    # removes the linear phase winding exp(-2 pi i f tau) caused by the electrical delay of the
+    # lines. A first estimate of the slope comes from a linear fit to the unwrapped phase at the
+    # edges of the sweep (where the resonator barely contributes), and it is then refined by
+    # picking, among successively finer grids of slopes around that estimate, the one for which
+    # the data lies best on a circle. Works on arrays of shape (..., n_freq).
+
+    f_rel = f - f.mean(axis=-1, keepdims=True)
+    phase = np.unwrap(np.angle(z), axis=-1)
+    n_edge = max(int(edge_fraction * z.shape[-1]), 2)
+    edges = np.concatenate([np.arange(n_edge), np.arange(z.shape[-1] - n_edge, z.shape[-1])])
+    f_edge = f_rel[..., edges]
+    p_edge = phase[..., edges]
+    f_edge_c = f_edge - f_edge.mean(axis=-1, keepdims=True)
+    slope = np.sum(f_edge_c * (p_edge - p_edge.mean(axis=-1, keepdims=True)), axis=-1) / np.sum(
+        f_edge_c**2, axis=-1
+    )
+
+    # refine the slope, starting within +-1 rad of accumulated phase over the sweep
+    span = f_rel.max(axis=-1) - f_rel.min(axis=-1)
+    offsets = np.linspace(-1, 1, n_refine)
+    step = 1 / span
+    for _ in range(refine_levels):
+        candidates = slope[..., np.newaxis] + offsets * step[..., np.newaxis]
+        z_candidates = z[..., np.newaxis, :] * np.exp(-1j * candidates[..., np.newaxis] * f_rel[..., np.newaxis, :])
+        _, _, _, residual = _algebraic_circle_fit(z_candidates)
+        best = np.argmin(residual, axis=-1)
+        slope = np.take_along_axis(candidates, best[..., np.newaxis], axis=-1)[..., 0]
+        step = step * 2 / (n_refine - 1)
+
+    z_corrected = z * np.exp(-1j * slope[..., np.newaxis] * f_rel)
+    return z_corrected, -slope / (2 * np.pi)
+
+
+def _algebraic_circle_fit(z, n_iterations=20):
+
+    # algebraic circle fit with the Pratt normalization, following the Newton-based solution of
+    # Chernov (N. Chernov, "Circular and linear regression", 2010), as used for resonator data
+    # by Probst et al. (arxiv:1410.3365). Vectorized over all leading dimensions of z, returns the
+    # center, the radius and the normalized rms distance of the points from the circle.
+
+    scale = np.median(np.abs(z), axis=-1, keepdims=True)
+    scale = np.where(scale > 0, scale, 1)
+    zs = z / scale
+    centroid = zs.mean(axis=-1, keepdims=True)
+    x = (zs - centroid).real
+    y = (zs - centroid).imag
+    r2 = x**2 + y**2
+
+    Mxx = np.mean(x * x, axis=-1)
+    Myy = np.mean(y * y, axis=-1)
+    Mxy = np.mean(x * y, axis=-1)
+    Mxz = np.mean(x * r2, axis=-1)
+    Myz = np.mean(y * r2, axis=-1)
+    Mzz = np.mean(r2 * r2, axis=-1)
+    Mz = Mxx + Myy
+    Cov_xy = Mxx * Myy - Mxy * Mxy
+
+    A2 = 4 * Cov_xy - 3 * Mz * Mz - Mzz
+    A1 = Mzz * Mz + 4 * Cov_xy * Mz - Mxz**2 - Myz**2 - Mz**3
+    A0 = Mxz**2 * Myy + Myz**2 * Mxx - Mzz * Cov_xy - 2 * Mxz * Myz * Mxy + Mz * Mz * Cov_xy
+
+    # Newton iterations on the characteristic polynomial, starting from zero, converge to its
+    # smallest non-negative root which is the Pratt solution
+    eta = np.zeros_like(Mz)
+    for _ in range(n_iterations):
+        value = A0 + eta * (A1 + eta * (A2 + 4 * eta * eta))
+        derivative = A1 + eta * (2 * A2 + 16 * eta * eta)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eta = np.where(derivative != 0, eta - value / derivative, eta)
+    eta = np.where(np.isfinite(eta) & (eta > 0), eta, 0)
+
+    det = eta * eta - eta * Mz + Cov_xy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xc = (Mxz * (Myy - eta) - Myz * Mxy) / det / 2
+        yc = (Myz * (Mxx - eta) - Mxz * Mxy) / det / 2
+    radius = np.sqrt(xc**2 + yc**2 + Mz + 2 * eta)
+    center = xc + 1j * yc
+
+    distance = np.abs((zs - centroid) - center[..., np.newaxis]) - radius[..., np.newaxis]
+    residual = np.sqrt(np.mean(distance**2, axis=-1)) / radius
+
+    center = (center + centroid[..., 0]) * scale[..., 0]
+    radius = radius * scale[..., 0]
+    return center, radius, eta, residual
+
+
+def _phase_vs_frequency_fit(theta, f, n_iterations=50):
+
+    # fits the phase of the data around the circle center to
+    # theta(f) = theta_0 + 2 arctan(2 Q (1 - f / omega_r))
+    # using a Levenberg-Marquardt iteration that is run simultaneously on all leading dimensions
+
+    f_ref = f.mean(axis=-1, keepdims=True)
+    span = f.max(axis=-1, keepdims=True) - f.min(axis=-1, keepdims=True)
+    x = (f - f_ref) / span
+
+    # initial guess: the resonance is where the phase winds the fastest
+    slope = np.gradient(theta, axis=-1) / np.gradient(x, axis=-1)
+    i_res = np.argmax(np.abs(slope), axis=-1)[..., np.newaxis]
+    x_r = np.take_along_axis(x, i_res, axis=-1)[..., 0]
+    theta_0 = np.take_along_axis(theta, i_res, axis=-1)[..., 0]
+    omega_r_guess = f_ref[..., 0] + x_r * span[..., 0]
+    Q = np.abs(np.take_along_axis(slope, i_res, axis=-1)[..., 0]) * omega_r_guess / span[..., 0] / 4
+
+    params = np.stack([theta_0, Q, x_r], axis=-1)
+
+    def model_and_jacobian(p):
+        theta_0, Q, x_r = p[..., 0:1], p[..., 1:2], p[..., 2:3]
+        omega_r = f_ref + x_r * span
+        u = (omega_r - f) / omega_r
+        g = 2 * Q * u
+        model = theta_0 + 2 * np.arctan(g)
+        dg = 2 / (1 + g**2)
+        jac = np.stack(
+            [np.ones_like(model), dg * 2 * u, dg * 2 * Q * f / omega_r**2 * span],
+            axis=-1,
+        )
+        return model, jac
+
+    model, jac = model_and_jacobian(params)
+    cost = np.sum((theta - model) ** 2, axis=-1)
+    damping = np.full(cost.shape, 1e-3)
+    for _ in range(n_iterations):
+        JTJ = np.einsum("...ni,...nj->...ij", jac, jac)
+        JTr = np.einsum("...ni,...n->...i", jac, theta - model)
+        diag = np.einsum("...ii->...i", JTJ)
+        A = JTJ + damping[..., np.newaxis, np.newaxis] * (diag[..., np.newaxis, :] * np.eye(3))
+        step = np.einsum("...ij,...j->...i", np.linalg.pinv(np.nan_to_num(A)), np.nan_to_num(JTr))
+        new_params = params + step
+        new_model, new_jac = model_and_jacobian(new_params)
+        new_cost = np.sum((theta - new_model) ** 2, axis=-1)
+        better = np.isfinite(new_cost) & (new_cost < cost)
+        params = np.where(better[..., np.newaxis], new_params, params)
+        model = np.where(better[..., np.newaxis], new_model, model)
+        jac = np.where(better[..., np.newaxis, np.newaxis], new_jac, jac)
+        cost = np.where(better, new_cost, cost)
+        damping = np.where(better, damping / 10, damping * 10)
+
+    theta_0, Q, x_r = params[..., 0], params[..., 1], params[..., 2]
+    omega_r = f_ref[..., 0] + x_r * span[..., 0]
+    phase_residual = np.sqrt(cost / theta.shape[-1])
+    return theta_0, Q, omega_r, phase_residual
+
+
+def _circle_fit_pipeline(z, f):
+
+    # cable-delay removal -> algebraic circle fit -> phase vs frequency fit, followed by the
+    # calibration of the environment (amplitude and phase of the off-resonant point) to extract
+    # the quality factors of a notch-type resonator (Probst et al., arxiv:1410.3365)
+
+    z, f = np.broadcast_arrays(z, f)
+    z, delay = _remove_cable_delay(z, f)
+    center, radius, _, residual = _algebraic_circle_fit(z)
+
+    # the model winds clockwise in the complex plane with increasing frequency. Depending on the
+    # down-conversion convention the data may wind the other way, in which case it is conjugated.
+    theta = np.unwrap(np.angle(z - center[..., np.newaxis]), axis=-1)
+    counter_clockwise = (theta[..., -1] - theta[..., 0]) > 0
+    z = np.where(counter_clockwise[..., np.newaxis], np.conj(z), z)
+    center = np.where(counter_clockwise, np.conj(center), center)
+    theta = np.where(counter_clockwise[..., np.newaxis], -theta, theta)
+
+    theta_0, Q, omega_r, phase_residual = _phase_vs_frequency_fit(theta, f)
+
+    # the off-resonant point sits opposite to the resonance on the circle
+    off_resonant = center + radius * np.exp(1j * (theta_0 + np.pi))
+    center_norm = center / off_resonant
+    radius_norm = radius / np.abs(off_resonant)
+    phi = np.angle(1 - center_norm)
+    Qe = Q / (2 * radius_norm)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Qi = 1 / (1 / Q - np.cos(phi) / Qe)
+
+    return omega_r, Q, Qe, Qi, phi, delay, residual, phase_residual
+
+
+def fit_resonator_circle(
+    s21: xr.DataArray, freq: xr.DataArray, dim: str, max_residual: float = CIRCLE_FIT_MAX_RESIDUAL
+) -> xr.Dataset:
+    """Fits the complex transmission of a notch-type resonator using the closed-form circle-fit
+    procedure of Probst et al. (arxiv:1410.3365): removal of the cable delay, an algebraic
+    (Pratt) circle fit, and a fit of the phase around the circle center vs frequency.
+
+    Unlike 'fit_resonator', no nonlinear fit of the full complex model is done, and all the
+    traces in the data (e.g. all qubits, powers or fluxes) are fitted at once.
+
+    The transmission function is the same as in 'fit_resonator':
+    S_{21} = a exp(i alpha) exp(-2 pi i f tau) (
+        1 - ((Q/|Qe|) exp(i phi) / (1 + 2 i Q  (f / omega_r - 1))))
+
+    Args:
+        s21 (xarray.DataArray): The complex transmission, e.g. I + 1j * Q.
+        freq (xarray.DataArray): The absolute frequency of each point in 's21'. It is broadcast
+                                 against 's21' and must contain the dimension 'dim'.
+        dim (str): The dimension along which the frequency is swept.
+        max_residual (float, optional): The maximum rms distance of the data from the fitted
+                                 circle, relative to its radius, for the fit to be considered
+                                 successful. Defaults to CIRCLE_FIT_MAX_RESIDUAL (0.05).
+
+    Returns:
+        xarray.Dataset: Dataset with the dimension 'dim' reduced, containing:
+                            omega_r - resonator frequency [Hz]
+                            Q - the loaded (total) quality factor
+                            Qe - the absolute value of the external quality factor
+                            Qi - the internal quality factor
+                            phi - the impedance mismatch angle, phi = -arg(Qe)
+                            cable_delay - the removed electrical delay [s]
+                            circle_residual - normalized rms distance of the data from the circle
+                            phase_residual - rms residual of the phase fit [rad]
+                            success - whether the fit quality is good enough to be trusted
+    """
+    names = ["omega_r", "Q", "Qe", "Qi", "phi", "cable_delay", "circle_residual", "phase_residual"]
+    outputs = xr.apply_ufunc(
+        _circle_fit_pipeline,
+        s21,
+        freq,
+        input_core_dims=[[dim], [dim]],
+        output_core_dims=[[] for _ in names],
+    )
+    fit = xr.Dataset(dict(zip(names, outputs)))
+    f_min = freq.min(dim=dim)
+    f_max = freq.max(dim=dim)
+    fit["success"] = (
+        (fit.circle_residual < max_residual)
+        & (fit.Q > 0)
+        & (fit.Qe > 0)
+        & (fit.omega_r > f_min)
+        & (fit.omega_r < f_max)
+    )
+    return fit
@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from typing import Union
 
 from quam.components.channels import IQChannel, MWChannel
+from quam.components.ports import LFFEMAnalogOutputPort, OPXPlusAnalogOutputPort
 
 
 @dataclass(frozen=True)
@@ -32,4 +33,50 @@ def instrument_limits(channel: Union[IQChannel, MWChannel]) -> InstrumentLimits:
     else:
         raise TypeError()
 
-    return limits
\ No newline at end of file
+    return limits
+
+@dataclass(frozen=True)
+class FilterLimits:
+    max_feedforward_taps: int
+    max_feedforward_amplitude: float
+    max_feedback_amplitude: float
+    max_exponential_filters: int
+    feedforward_taps_per_feedback_tap: int  # FIR taps taken by each IIR tap when they share the same resources
+    exponential_filter_sections: bool = False  # the exponentials are set as (amplitude, tau) on their own IIR sections
+    feedforward_resolution: float = 2**-16
+    feedback_resolution: float = 2**-20
+
+    def feedforward_taps(self, n_feedback_taps: int = 0) -> int:
+        """The number of feedforward taps available next to 'n_feedback_taps' feedback (IIR) taps."""
+        return self.max_feedforward_taps - self.feedforward_taps_per_feedback_tap * n_feedback_taps
+
+
+LF_FEM_FILTER_LIMITS = FilterLimits(
+    max_feedforward_taps=44,
+    max_feedforward_amplitude=2 - 2**-16,
+    max_feedback_amplitude=1 - 2**-20,
+    max_exponential_filters=4,  # QOP >= 3.3, the exponential filters have their own resources
+    feedforward_taps_per_feedback_tap=0,
+    exponential_filter_sections=True,
+)
+
+OPX_PLUS_FILTER_LIMITS = FilterLimits(
+    max_feedforward_taps=44,
+    max_feedforward_amplitude=2 - 2**-16,
+    max_feedback_amplitude=1 - 2**-20,
+    max_exponential_filters=2,
+    feedforward_taps_per_feedback_tap=7,
+)
+
+
+def filter_limits(port: Union[OPXPlusAnalogOutputPort, LFFEMAnalogOutputPort]) -> FilterLimits:
+    if isinstance(port, LFFEMAnalogOutputPort):
+        limits = LF_FEM_FILTER_LIMITS
+    elif isinstance(port, OPXPlusAnalogOutputPort):
+        limits = OPX_PLUS_FILTER_LIMITS
+    else:
+        raise TypeError(
+            f"Expected port to be type OPXPlusAnalogOutputPort or LFFEMAnalogOutputPort, got {type(port)}."
+        )
+
+    return limits
@@ -0,0 +1,173 @@
+"""
+Offline emulation of the OPX analog output filters.
+
+The flux line predistortion filters of the OPX (exponential / IIR sections and the feedforward FIR) are
+emulated in numpy, with the tap quantization and limits of the OPX1000 LF-FEM and of the OPX+. This allows
+to predict the effect of a candidate set of taps on a waveform, or on a measured step response, and to reject
+bad candidates before using the machine.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Literal, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.signal import lfilter
+from qualang_tools.digital_filters import QOPVersion, calc_filter_taps
+from iqcc_research.quam_config.lib.instrument_limits import (
+    LF_FEM_FILTER_LIMITS,
+    OPX_PLUS_FILTER_LIMITS,
+    FilterLimits,
+)
+
+
+@dataclass
+class OPXFilterChain:
+    """
+    The filters of an OPX analog output port.
+
+    On the OPX1000 LF-FEM (QOP >= 3.3) the exponential corrections are given directly as 'exponential' (amplitude,
+    tau) pairs and have their own IIR sections, followed by the feedforward FIR. On the OPX+ the exponential
+    corrections are part of the feedforward and feedback taps, each feedback tap being a single-pole section.
+    """
+
+    feedforward: Sequence[float] = (1.0,)
+    feedback: Sequence[float] = ()
+    exponential: Sequence[Tuple[float, float]] = ()
+    high_pass: Optional[float] = None
+    hardware: Literal["opx1000", "opx+"] = "opx1000"
+    quantize: bool = True
+    max_amplitude: float = 0.5
+    sampling_period: float = 1.0
+    limits: FilterLimits = field(init=False)
+
+    def __post_init__(self):
+        self.limits = LF_FEM_FILTER_LIMITS if self.hardware == "opx1000" else OPX_PLUS_FILTER_LIMITS
+
+    @classmethod
+    def from_port(cls, port, **kwargs) -> "OPXFilterChain":
+        """
+        The filters currently set on a QuAM analog output port, e.g. 'qubit.z.opx_output'.
+        The keyword arguments override them, e.g. to emulate candidate taps on the hardware of the port.
+        """
+        from quam.components.ports import LFFEMAnalogOutputPort
+
+        properties = dict(
+            feedforward=port.feedforward_filter or (1.0,),
+            feedback=port.feedback_filter or (),
+            exponential=getattr(port, "exponential_filter", None) or (),
+            high_pass=getattr(port, "high_pass_filter", None),
+            hardware="opx1000" if isinstance(port, LFFEMAnalogOutputPort) else "opx+",
+        )
+        return cls(**{**properties, **kwargs})
+
+    def _quantized(self, taps: Sequence[float], resolution: float, max_value: float) -> np.ndarray:
+        taps = np.asarray(taps, dtype=float)
+        if not self.quantize:
+            return taps
+        return np.clip(np.round(taps / resolution) * resolution, -max_value, max_value)
+
+    def sections(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """The (numerator, denominator) of the filter sections applied in sequence to the waveform."""
+        limits = self.limits
+        sections = []
+        # the exponential and high-pass corrections, as single-pole sections
+        iir_corrections = [{"exponential": [tuple(e)]} for e in self.exponential]
+        if self.high_pass is not None:
+            iir_corrections.append({"highpass": [self.high_pass]})
+        for correction in iir_corrections:
+            feedforward, feedback = calc_filter_taps(
+                **correction, Ts=self.sampling_period, qop_version=QOPVersion.NONE
+            )
+            feedforward = self._quantized(feedforward, limits.feedforward_resolution, limits.max_feedforward_amplitude)
+            feedback = self._quantized(feedback, limits.feedback_resolution, limits.max_feedback_amplitude)
+            sections.append((feedforward, np.array([1.0, -feedback[0]])))
+        feedforward = self._quantized(self.feedforward, limits.feedforward_resolution, limits.max_feedforward_amplitude)
+        sections.append((feedforward, np.array([1.0])))
+        for tap in self._quantized(self.feedback, limits.feedback_resolution, limits.max_feedback_amplitude):
+            sections.append((np.array([1.0]), np.array([1.0, -tap])))
+        return sections
+
+    def apply(self, waveform: Sequence[float], clip: bool = True) -> np.ndarray:
+        """The output of the port for the given waveform, clipped to the maximal output amplitude."""
+        output = np.asarray(waveform, dtype=float)
+        for numerator, denominator in self.sections():
+            output = lfilter(numerator, denominator, output)
+        if clip:
+            output = np.clip(output, -self.max_amplitude, self.max_amplitude)
+        return output
+
+    def apply_to_pulse(self, pulse, padding: int = 0, clip: bool = True) -> np.ndarray:
+        """The output of the port for a QuAM pulse, e.g. a 'FluxPulse' or an 'SNZPulse', followed by 'padding' zeros."""
+        waveform = np.asarray(pulse.waveform_function(), dtype=float).real
+        return self.apply(np.concatenate([waveform, np.zeros(padding)]), clip=clip)
+
+    def predict_step_response(self, measured_step_response: Sequence[float]) -> np.ndarray:
+        """
+        The step response expected with these filters, from the step response measured without filters.
+
+        The line and the filters are linear and time invariant, so the expected response is the measured one
+        passed through the filters (without clipping, the measured response being normalized).
+        """
+        return self.apply(measured_step_response, clip=False)
+
+    def violations(self) -> List[str]:
+        """The hardware limits violated by the unquantized taps."""
+        limits = self.limits
+        violations = []
+        n_feedback = len(self.feedback) if self.hardware == "opx+" else 0
+        if len(self.feedforward) > limits.feedforward_taps(n_feedback):
+            violations.append(
+                f"{len(self.feedforward)} feedforward taps, at most {limits.feedforward_taps(n_feedback)} are available"
+            )
+        if np.max(np.abs(self.feedforward)) > limits.max_feedforward_amplitude:
+            violations.append(f"feedforward taps exceed {limits.max_feedforward_amplitude}")
+        if len(self.feedback) and np.max(np.abs(self.feedback)) > limits.max_feedback_amplitude:
+            violations.append(f"feedback taps exceed {limits.max_feedback_amplitude}")
+        if len(self.exponential) + len(self.feedback) > limits.max_exponential_filters:
+            violations.append(
+                f"{len(self.exponential) + len(self.feedback)} exponential filters, "
+                f"at most {limits.max_exponential_filters} are available"
+            )
+        if self.hardware == "opx+" and len(self.exponential):
+            violations.append("exponential filters are only available on the OPX1000 LF-FEM (QOP >= 3.3)")
+        return violations
+
+
+def validate_step_response(
+    chain: OPXFilterChain,
+    measured_step_response: Sequence[float],
+    settling_time: int = 10,
+    tolerance: float = 1e-2,
+) -> Tuple[bool, dict]:
+    """
+    Check a candidate filter chain against a measured (unfiltered) step response.
+
+    Parameters:
+    -----------
+    chain : OPXFilterChain
+        The candidate filters.
+    measured_step_response : array
+        The step response measured without filters, starting at the rise of the step.
+    settling_time : int, optional
+        The number of samples after the rise that are not checked. Default is 10.
+    tolerance : float, optional
+        The maximal relative deviation of the predicted response from its final value after the settling time.
+        Default is 1e-2.
+
+    Returns:
+    --------
+    tuple
+        Whether the candidate is accepted, and a dictionary with the hardware limit violations, the predicted
+        response and its maximal and rms relative deviations.
+    """
+    predicted = chain.predict_step_response(measured_step_response)
+    final_value = np.mean(predicted[-max(len(predicted) // 4, 1) :])
+    deviation = predicted[settling_time:] / final_value - 1
+    report = {
+        "violations": chain.violations(),
+        "predicted_step_response": predicted,
+        "max_deviation": float(np.max(np.abs(deviation))),
+        "rms_deviation": float(np.sqrt(np.mean(deviation**2))),
+    }
+    accepted = not report["violations"] and report["max_deviation"] < tolerance
+    return accepted, report
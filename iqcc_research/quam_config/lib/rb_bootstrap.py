@@ -0,0 +1,132 @@
+"""
+Vectorized bootstrap of randomized benchmarking decays.
+
+The random sequences of an RB experiment are resampled with replacement, and the decay A * alpha**m + B of every
+resampled mean is fitted at once: the resampled means are a single matrix product of the resampling counts with
+the per-sequence data, and the fits are done by a batched variable-projection solver (A and B are linear for a
+given alpha, and alpha is found by a vectorized grid and golden-section search). A thousand resamples of tens of
+qubits are fitted in about a second, instead of one curve_fit per resample.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+_GOLDEN = (np.sqrt(5) - 1) / 2
+
+
+def _linear_parameters(depths: np.ndarray, y: np.ndarray, u: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    The least-squares amplitude and offset of the decays for alpha = 1 - exp(u), and the squared residual norm.
+    """
+    basis = np.exp(np.log1p(-np.exp(u))[..., None] * depths)
+    n = depths.size
+    s_b, s_bb = basis.sum(-1), np.einsum("...d,...d->...", basis, basis)
+    s_y, s_by = y.sum(-1), np.einsum("...d,...d->...", basis, y)
+    determinant = n * s_bb - s_b**2
+    determinant = np.where(np.abs(determinant) < 1e-300, np.nan, determinant)
+    amplitude = (n * s_by - s_b * s_y) / determinant
+    offset = (s_bb * s_y - s_b * s_by) / determinant
+    residual = np.einsum("...d,...d->...", y, y) - amplitude * s_by - offset * s_y
+    return amplitude, offset, residual
+
+
+def fit_rb_decay(
+    depths: np.ndarray,
+    y: np.ndarray,
+    min_error: float = 1e-7,
+    grid_points: int = 24,
+    iterations: int = 30,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit A * alpha**depths + B to a batch of decay curves.
+
+    Parameters:
+    -----------
+    depths : np.ndarray
+        The circuit depths.
+    y : np.ndarray
+        The decay curves, with the depths along the last axis and any batch shape before.
+    min_error : float, optional
+        The smallest 1 - alpha searched for. Default is 1e-7.
+    grid_points : int, optional
+        The number of points of the initial logarithmic grid in 1 - alpha. Default is 24.
+    iterations : int, optional
+        The number of golden-section iterations refining the best grid point. Default is 30.
+
+    Returns:
+    --------
+    tuple
+        The amplitude A, the decay constant alpha and the offset B, each with the batch shape of y.
+    """
+    depths = np.asarray(depths, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # The decay constant is searched as alpha = 1 - exp(u), with u uniform between log(min_error) and 0
+    grid = np.linspace(np.log(min_error), 0, grid_points + 1)[:-1]
+    residuals = np.stack([_linear_parameters(depths, y, np.full(y.shape[:-1], u))[2] for u in grid], axis=-1)
+    best = np.argmin(np.where(np.isfinite(residuals), residuals, np.inf), axis=-1)
+    low = grid[np.clip(best - 1, 0, grid_points - 1)]
+    high = grid[np.clip(best + 1, 0, grid_points - 1)]
+
+    def residual(u):
+        return _linear_parameters(depths, y, u)[2]
+
+    # Golden-section search of the residual in the bracket around the best grid point
+    u1 = high - _GOLDEN * (high - low)
+    u2 = low + _GOLDEN * (high - low)
+    r1, r2 = residual(u1), residual(u2)
+    for _ in range(iterations):
+        left = r1 < r2
+        # The minimum is in [low, u2] if left, else in [u1, high], and one of the two points is kept
+        high = np.where(left, u2, high)
+        low = np.where(left, low, u1)
+        kept_u, kept_r = np.where(left, u1, u2), np.where(left, r1, r2)
+        new_u = np.where(left, high - _GOLDEN * (high - low), low + _GOLDEN * (high - low))
+        new_r = residual(new_u)
+        u1, r1 = np.where(left, new_u, kept_u), np.where(left, new_r, kept_r)
+        u2, r2 = np.where(left, kept_u, new_u), np.where(left, kept_r, new_r)
+    u = (low + high) / 2
+    amplitude, offset, _ = _linear_parameters(depths, y, u)
+    return amplitude, 1 - np.exp(u), offset
+
+
+def bootstrap_rb_decay(
+    depths: np.ndarray,
+    sequences: np.ndarray,
+    num_resamples: int = 1000,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Bootstrap distribution of the RB decay constant, resampling the random sequences with replacement.
+
+    Parameters:
+    -----------
+    depths : np.ndarray
+        The circuit depths.
+    sequences : np.ndarray
+        The decay curve of each random sequence, with shape (..., num_sequences, num_depths).
+    num_resamples : int, optional
+        The number of bootstrap resamples. Default is 1000.
+    seed : int, optional
+        Seed of the resampling. Default is None.
+
+    Returns:
+    --------
+    np.ndarray
+        The decay constant alpha of each resample, with shape (..., num_resamples).
+    """
+    sequences = np.asarray(sequences, dtype=float)
+    num_sequences = sequences.shape[-2]
+    rng = np.random.default_rng(seed)
+    # Number of times each sequence is drawn in each resample, the resampled means being a single matrix product
+    draws = rng.integers(0, num_sequences, size=(num_resamples, num_sequences))
+    counts = np.zeros((num_resamples, num_sequences))
+    np.add.at(counts, (np.arange(num_resamples)[:, None], draws), 1)
+    resampled = np.einsum("rs,...sd->...rd", counts / num_sequences, sequences)
+    return fit_rb_decay(depths, resampled)[1]
+
+
+def confidence_interval(samples: np.ndarray, confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """The percentile confidence interval of bootstrap samples along the last axis."""
+    tail = 100 * (1 - confidence) / 2
+    return np.nanpercentile(samples, tail, axis=-1), np.nanpercentile(samples, 100 - tail, axis=-1)
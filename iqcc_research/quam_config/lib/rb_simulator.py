@@ -0,0 +1,190 @@
+"""
+Host-side simulation of single-qubit RB sequences.
+
+The integer Clifford sequences played by the RB nodes are replayed in numpy exactly as 'play_clifford' plays them:
+the virtual Z rotations are merged into a frame that is applied before each physical x90/x180 pulse, and the
+recovery gate is taken from the same Cayley and inverse tables. Without noise every sequence must return the
+qubit to its ground state, which validates the tables and the pulse mapping before using the machine. With a
+noise model, the simulation produces synthetic RB data to test and benchmark the analysis.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import xarray as xr
+from iqcc_research.quam_config.lib.clifford_compiler import (
+    CAYLEY_TABLE,
+    CLIFFORD_DECOMPOSITIONS,
+    INVERSE_TABLE,
+    PULSE_ANGLES,
+)
+
+_PULSES = [None] + list(PULSE_ANGLES)
+_Z_BEFORE = np.array([z_before for z_before, _, _ in CLIFFORD_DECOMPOSITIONS])
+_PULSE_CODE = np.array([_PULSES.index(pulse) for _, pulse, _ in CLIFFORD_DECOMPOSITIONS])
+_Z_AFTER = np.array([z_after for _, _, z_after in CLIFFORD_DECOMPOSITIONS])
+
+
+def _pulse_unitaries() -> np.ndarray:
+    """The unitaries Rx(pulse) Rz(frame) of a pulse played in a frame rotated by 'frame' quarter turns."""
+    unitaries = np.zeros((4, len(_PULSES), 2, 2), dtype=complex)
+    for frame in range(4):
+        rz = np.diag([np.exp(-1j * frame * np.pi / 4), np.exp(1j * frame * np.pi / 4)])
+        for code, pulse in enumerate(_PULSES):
+            angle = 0 if pulse is None else PULSE_ANGLES[pulse]
+            rx = np.array(
+                [[np.cos(angle / 2), -1j * np.sin(angle / 2)], [-1j * np.sin(angle / 2), np.cos(angle / 2)]]
+            )
+            unitaries[frame, code] = rx @ rz
+    return unitaries
+
+
+_PULSE_UNITARIES = _pulse_unitaries()
+
+
+@dataclass
+class NoiseModel:
+    """Errors applied after each physical pulse, and at the readout."""
+
+    depolarizing: float = 0.0
+    """Probability of a full depolarization after each pulse."""
+    amplitude_damping: float = 0.0
+    """Probability of a decay from |1> to |0> after each pulse (e.g. the pulse length divided by T1)."""
+    readout_error: float = 0.0
+    """Probability of reading the wrong state, for both states."""
+
+    def apply(self, rho: np.ndarray) -> np.ndarray:
+        """Apply the pulse errors to a stack of density matrices."""
+        if self.amplitude_damping:
+            gamma = self.amplitude_damping
+            decayed = rho.copy()
+            decayed[..., 0, 0] = rho[..., 0, 0] + gamma * rho[..., 1, 1]
+            decayed[..., 1, 1] = (1 - gamma) * rho[..., 1, 1]
+            decayed[..., 0, 1] = np.sqrt(1 - gamma) * rho[..., 0, 1]
+            decayed[..., 1, 0] = np.sqrt(1 - gamma) * rho[..., 1, 0]
+            rho = decayed
+        if self.depolarizing:
+            rho = (1 - self.depolarizing) * rho + self.depolarizing * np.eye(2) / 2
+        return rho
+
+
+def random_sequences(num_sequences: int, max_circuit_depth: int, seed: Optional[int] = None) -> np.ndarray:
+    """Random Clifford indices, as a (num_sequences, max_circuit_depth) array."""
+    return np.random.default_rng(seed).integers(0, 24, size=(num_sequences, max_circuit_depth))
+
+
+def simulate_rb(
+    sequences: np.ndarray,
+    depths: Sequence[int],
+    noise: Optional[NoiseModel] = None,
+    num_shots: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Simulate the RB sequences as played by the RB nodes: for each depth d, the first d Cliffords of the sequence
+    followed by the recovery gate.
+
+    Parameters:
+    -----------
+    sequences : np.ndarray
+        The random Clifford indices, as a (num_sequences, max_circuit_depth) integer array.
+    depths : sequence of int
+        The measured depths (number of random Cliffords before the recovery gate), in increasing order.
+    noise : NoiseModel, optional
+        The errors of the pulses and of the readout. Default is None (noiseless).
+    num_shots : int, optional
+        If given, the excited state population is sampled with this number of shots. Default is None.
+    seed : int, optional
+        Seed of the shot sampling. Default is None.
+
+    Returns:
+    --------
+    np.ndarray
+        The (num_sequences, num_depths) excited state population after the recovery gate.
+    """
+    sequences = np.asarray(sequences)
+    depths = np.asarray(depths, dtype=int)
+    num_sequences = sequences.shape[0]
+    rows = np.arange(num_sequences)
+    rho = np.zeros((num_sequences, 2, 2), dtype=complex)
+    rho[:, 0, 0] = 1
+    frame = np.zeros(num_sequences, dtype=int)
+    state = np.zeros(num_sequences, dtype=int)
+    population = np.zeros((num_sequences, len(depths)))
+
+    def play(rho, frame, cliffords):
+        """Play one Clifford per sequence, returning the new density matrices and pending frames."""
+        code = _PULSE_CODE[cliffords]
+        unitaries = _PULSE_UNITARIES[(frame + _Z_BEFORE[cliffords]) % 4, code]
+        played = np.einsum("sij,sjk,slk->sil", unitaries, rho, unitaries.conj())
+        has_pulse = code > 0
+        if noise is not None:
+            played = noise.apply(played)
+        rho = np.where(has_pulse[:, None, None], played, rho)
+        frame = np.where(has_pulse, _Z_AFTER[cliffords], (frame + _Z_BEFORE[cliffords] + _Z_AFTER[cliffords]) % 4)
+        return rho, frame
+
+    depth = 0
+    for index, depth_target in enumerate(depths):
+        # Extend the sequences up to the next measured depth
+        while depth < depth_target:
+            rho, frame = play(rho, frame, sequences[:, depth])
+            state = CAYLEY_TABLE[state, sequences[:, depth]]
+            depth += 1
+        # Play the recovery gate on a copy, the sequences being extended from their state before recovery
+        recovered, _ = play(rho, frame, INVERSE_TABLE[state])
+        population[:, index] = recovered[rows, 1, 1].real
+
+    if noise is not None and noise.readout_error:
+        population = population * (1 - 2 * noise.readout_error) + noise.readout_error
+    if num_shots is not None:
+        rng = np.random.default_rng(seed)
+        population = rng.binomial(num_shots, np.clip(population, 0, 1)) / num_shots
+    return population
+
+
+def max_recovery_error(sequences: np.ndarray, depths: Sequence[int]) -> float:
+    """
+    The maximal excited state population after recovery without noise, which must vanish.
+    A recovery gate wrong only by a Z rotation leaves the ground state unchanged, and is not detected.
+    """
+    return float(np.max(simulate_rb(sequences, depths)))
+
+
+def synthetic_rb_dataset(
+    noise: Dict[str, NoiseModel],
+    num_random_sequences: int = 100,
+    max_circuit_depth: int = 1000,
+    delta_clifford: int = 20,
+    num_shots: Optional[int] = 20,
+    seed: Optional[int] = None,
+) -> xr.Dataset:
+    """
+    Synthetic data of the single-qubit RB node (10a) with state discrimination, with a noise model per qubit.
+
+    Returns:
+    --------
+    xr.Dataset
+        The shot-averaged 'state' with dimensions (qubit, nb_of_sequences, depths), as fetched by the node.
+    """
+    rng = np.random.default_rng(seed)
+    depths = np.arange(1, max_circuit_depth + 0.1, delta_clifford).astype(int)
+    state = [
+        simulate_rb(
+            random_sequences(num_random_sequences, max_circuit_depth, seed=rng.integers(2**32)),
+            depths,
+            noise=qubit_noise,
+            num_shots=num_shots,
+            seed=rng.integers(2**32),
+        )
+        for qubit_noise in noise.values()
+    ]
+    return xr.Dataset(
+        {"state": (("qubit", "nb_of_sequences", "depths"), np.array(state))},
+        coords={
+            "qubit": list(noise),
+            "nb_of_sequences": np.arange(num_random_sequences),
+            "depths": depths,
+        },
+    )
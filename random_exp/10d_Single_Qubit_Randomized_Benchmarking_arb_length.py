@@ -21,13 +21,18 @@ Prerequisites:
 
 # %% {Imports}
 from qualibrate import QualibrationNode, NodeParameters
-from iqcc_research.quam_config.components import Quam, Transmon
+from iqcc_research.quam_config.components import Quam
 from iqcc_research.quam_config.macros import qua_declaration, active_reset, readout_state
 from iqcc_research.quam_config.lib.plot_utils import QubitGrid, grid_iter
 from iqcc_research.quam_config.lib.save_utils import fetch_results_as_xarray, load_dataset
 from qualibration_libs.analysis.fitting import fit_decay_exp, decay_exp
 from qualang_tools.results import progress_counter, fetching_tool
-from qualang_tools.bakery.randomized_benchmark_c1 import c1_table
+from iqcc_research.quam_config.lib.clifford_compiler import (
+    AVERAGE_PULSES_PER_CLIFFORD,
+    CAYLEY_TABLE,
+    INVERSE_TABLE,
+    play_clifford,
+)
 from qualang_tools.multi_user import qm_session
 from qualang_tools.units import unit
 from qm import SimulationConfig
@@ -96,8 +101,6 @@ seed = node.parameters.seed  # Pseudo-random number generator seed
 # Flag to enable state discrimination if the readout has been calibrated (rotated blobs and threshold)
 state_discrimination = node.parameters.use_state_discrimination
 strict_timing = node.parameters.use_strict_timing
-# List of recovery gates from the lookup table
-inv_gates = [int(np.where(c1_table[i, :] == 0)[0][0]) for i in range(24)]
 
 
 # %% {Utility functions}
@@ -106,8 +109,8 @@ def power_law(power, a, b, p):
 
 
 def generate_sequence():
-    cayley = declare(int, value=c1_table.flatten().tolist())
-    inv_list = declare(int, value=inv_gates)
+    cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+    inv_list = declare(int, value=INVERSE_TABLE.tolist())
     current_state = declare(int)
     step = declare(int)
     sequence = declare(int, size=max_circuit_depth + 1)
@@ -125,8 +128,8 @@ def generate_sequence():
     return sequence, inv_gate
 
 def generate_gate(current_state):
-    cayley = declare(int, value=c1_table.flatten().tolist())
-    inv_list = declare(int, value=inv_gates)    
+    cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+    inv_list = declare(int, value=INVERSE_TABLE.tolist())    
     gate = declare(int)
     inv_gate = declare(int)
     rand = Random(seed=seed)
@@ -135,153 +138,6 @@ def generate_gate(current_state):
     assign(inv_gate, inv_list[current_state])
     return gate, current_state, inv_gate
 
-def play_gate(gate, qubit: Transmon):
-    with switch_(gate, unsafe=True):
-        with case_(0):
-            qubit.xy.wait(qubit.xy.operations["x180"].length // 4)
-        with case_(1):  # x180
-            qubit.xy.play("x180")
-        with case_(2):  # y180
-            qubit.xy.play("y180")
-        with case_(3):  # Z180
-            qubit.xy.play("y180")
-            qubit.xy.play("x180")
-        with case_(4):  # Z90 X180 Z-180
-            qubit.xy.play("x90")
-            qubit.xy.play("y90")
-        with case_(5):  # Z-90 Y-90 Z-90
-            qubit.xy.play("x90")
-            qubit.xy.play("-y90")
-        with case_(6):  # Z-90 X180 Z-180
-            qubit.xy.play("-x90")
-            qubit.xy.play("y90")
-        with case_(7):  # Z-90 Y90 Z-90
-            qubit.xy.play("-x90")
-            qubit.xy.play("-y90")
-        with case_(8):  # X90 Z90
-            qubit.xy.play("y90")
-            qubit.xy.play("x90")
-        with case_(9):  # X-90 Z-90
-            qubit.xy.play("y90")
-            qubit.xy.play("-x90")
-        with case_(10):  # z90 X90 Z90
-            qubit.xy.play("-y90")
-            qubit.xy.play("x90")
-        with case_(11):  # z90 X-90 Z90
-            qubit.xy.play("-y90")
-            qubit.xy.play("-x90")
-        with case_(12):  # x90
-            qubit.xy.play("x90")
-        with case_(13):  # -x90
-            qubit.xy.play("-x90")
-        with case_(14):  # y90
-            qubit.xy.play("y90")
-        with case_(15):  # -y90
-            qubit.xy.play("-y90")
-        with case_(16):  # Z90
-            qubit.xy.play("-x90")
-            qubit.xy.play("y90")
-            qubit.xy.play("x90")
-        with case_(17):  # -Z90
-            qubit.xy.play("-x90")
-            qubit.xy.play("-y90")
-            qubit.xy.play("x90")
-        with case_(18):  # Y-90 Z-90
-            qubit.xy.play("x180")
-            qubit.xy.play("y90")
-        with case_(19):  # Y90 Z90
-            qubit.xy.play("x180")
-            qubit.xy.play("-y90")
-        with case_(20):  # Y90 Z-90
-            qubit.xy.play("y180")
-            qubit.xy.play("x90")
-        with case_(21):  # Y-90 Z90
-            qubit.xy.play("y180")
-            qubit.xy.play("-x90")
-        with case_(22):  # x90 Z-90
-            qubit.xy.play("x90")
-            qubit.xy.play("y90")
-            qubit.xy.play("x90")
-        with case_(23):  # -x90 Z90
-            qubit.xy.play("-x90")
-            qubit.xy.play("y90")
-            qubit.xy.play("-x90")
-
-def play_sequence(sequence_list, depth, qubit: Transmon):
-    i = declare(int)
-    with for_(i, 0, i <= depth, i + 1):
-        with switch_(sequence_list[i], unsafe=True):
-            with case_(0):
-                qubit.xy.wait(qubit.xy.operations["x180"].length // 4)
-            with case_(1):  # x180
-                qubit.xy.play("x180")
-            with case_(2):  # y180
-                qubit.xy.play("y180")
-            with case_(3):  # Z180
-                qubit.xy.play("y180")
-                qubit.xy.play("x180")
-            with case_(4):  # Z90 X180 Z-180
-                qubit.xy.play("x90")
-                qubit.xy.play("y90")
-            with case_(5):  # Z-90 Y-90 Z-90
-                qubit.xy.play("x90")
-                qubit.xy.play("-y90")
-            with case_(6):  # Z-90 X180 Z-180
-                qubit.xy.play("-x90")
-                qubit.xy.play("y90")
-            with case_(7):  # Z-90 Y90 Z-90
-                qubit.xy.play("-x90")
-                qubit.xy.play("-y90")
-            with case_(8):  # X90 Z90
-                qubit.xy.play("y90")
-                qubit.xy.play("x90")
-            with case_(9):  # X-90 Z-90
-                qubit.xy.play("y90")
-                qubit.xy.play("-x90")
-            with case_(10):  # z90 X90 Z90
-                qubit.xy.play("-y90")
-                qubit.xy.play("x90")
-            with case_(11):  # z90 X-90 Z90
-                qubit.xy.play("-y90")
-                qubit.xy.play("-x90")
-            with case_(12):  # x90
-                qubit.xy.play("x90")
-            with case_(13):  # -x90
-                qubit.xy.play("-x90")
-            with case_(14):  # y90
-                qubit.xy.play("y90")
-            with case_(15):  # -y90
-                qubit.xy.play("-y90")
-            with case_(16):  # Z90
-                qubit.xy.play("-x90")
-                qubit.xy.play("y90")
-                qubit.xy.play("x90")
-            with case_(17):  # -Z90
-                qubit.xy.play("-x90")
-                qubit.xy.play("-y90")
-                qubit.xy.play("x90")
-            with case_(18):  # Y-90 Z-90
-                qubit.xy.play("x180")
-                qubit.xy.play("y90")
-            with case_(19):  # Y90 Z90
-                qubit.xy.play("x180")
-                qubit.xy.play("-y90")
-            with case_(20):  # Y90 Z-90
-                qubit.xy.play("y180")
-                qubit.xy.play("x90")
-            with case_(21):  # Y-90 Z90
-                qubit.xy.play("y180")
-                qubit.xy.play("-x90")
-            with case_(22):  # x90 Z-90
-                qubit.xy.play("x90")
-                qubit.xy.play("y90")
-                qubit.xy.play("x90")
-            with case_(23):  # -x90 Z90
-                qubit.xy.play("-x90")
-                qubit.xy.play("y90")
-                qubit.xy.play("-x90")
-
-
 # %% {QUA_program}
 with program() as randomized_benchmarking:
     depth = declare(int)  # QUA variable for the varying depth
@@ -297,8 +153,8 @@ with program() as randomized_benchmarking:
     # state_st = declare_stream()
     state_st = [declare_stream() for _ in range(num_qubits)]
     g = declare(int)
-    cayley = declare(int, value=c1_table.flatten().tolist())
-    inv_list = declare(int, value=inv_gates) 
+    cayley = declare(int, value=CAYLEY_TABLE.flatten().tolist())
+    inv_list = declare(int, value=INVERSE_TABLE.tolist()) 
 
     for i, qubit in enumerate(qubits):
 
@@ -310,6 +166,8 @@ with program() as randomized_benchmarking:
         inv_gate = declare(int)
         rand = Random(seed=seed)
         current_state = declare(int)
+        # Pending virtual Z rotation of the Clifford compiler, in quarter turns
+        frame = declare(int)
         with for_(m, 0, m < num_of_sequences, m + 1):
             assign(depth_target, 0)  # Initialize the current depth to 0
             with for_(depth, 1, depth <= max_circuit_depth, depth + 1):
@@ -326,15 +184,17 @@ with program() as randomized_benchmarking:
                         qubit.align()
                         # The strict_timing ensures that the sequence will be played without gaps
                         assign(current_state, 0)
+                        assign(frame, 0)
+                        reset_frame(qubit.xy.name)
                         with for_(g, 0, g < depth, g + 1):
                             # gate, current_state, inv_gate = generate_gate(current_state)
 
                             assign(gate, rand.rand_int(24))
                             assign(current_state, cayley[current_state * 24 + gate])
                             assign(inv_gate, inv_list[current_state])
-                            play_gate(gate, qubit)
+                            play_clifford(qubit, gate, frame)
                             qubit.align()
-                        play_gate(inv_gate, qubit)
+                        play_clifford(qubit, inv_gate, frame)
                         # Align the two elements to measure after playing the circuit.
                         qubit.align()
                         readout_state(qubit, state[i])
@@ -407,8 +267,8 @@ elif node.parameters.load_data_id is None:
     da_fit = fit_decay_exp(da_state, "m")
     # Extract the decay rate
     alpha = np.exp(da_fit.sel(fit_vals="decay"))
-    # average_gate_per_clifford = 45/24 = 1.875
-    average_gate_per_clifford = (1 * 3 + 9 * 2 + 1 * 4 + 2 * 3 + 4 * 2 + 2 * 3) / 24
+    # Physical pulses per Clifford with the virtual-Z decomposition of the Clifford compiler (5/6)
+    average_gate_per_clifford = AVERAGE_PULSES_PER_CLIFFORD
     # EPC from here: https://qiskit.org/textbook/ch-quantum-hardware/randomized-benchmarking.html#Step-5:-Fit-the-results
     EPC = (1 - alpha) - (1 - alpha) / 2
     EPG = EPC / average_gate_per_clifford
@@ -9,9 +9,11 @@ from matplotlib import pyplot as plt
 from qiskit.transpiler import CouplingMap
 from qiskit.circuit import QuantumCircuit, QuantumRegister
 from typing import List
+import warnings
 from qm.qua import *
 from qualang_tools.addons.variables import assign_variables_to_element
 import numpy as np
+import xarray as xr
 from iqcc_research.quam_config.components import TransmonPair, Transmon
 from scipy import optimize
 from scipy.stats import stats
@@ -276,6 +278,80 @@ def compute_log_fidelity(incoherent_dist, expected_probs, measured_probs):
     return f_xeb
 
 
+def compute_xeb_fidelities(
+    expected_probs: np.ndarray,
+    measured_probs: np.ndarray,
+    depths,
+    n_bootstrap: int = 1000,
+    seed: int = None,
+    epsilon: float = 1e-15,
+) -> xr.Dataset:
+    """
+    Compute the linear and log XEB fidelities of all sequences and depths at once, with numpy reductions.
+
+    The linear fidelity of a depth is the least-squares estimate of the Cirq-like processing (sum of x * y over sum of
+    x ** 2 over the sequences, see `update_record` and `update_data_frame`). The log
+    fidelity of a depth is the mean over the sequences of `compute_log_fidelity`, the singularities and outliers
+    (see `evaluate_log_fidelity`) being excluded. The errors are the standard deviations of the estimates over
+    bootstrap resamplings of the sequences.
+
+    Parameters:
+    - expected_probs: numpy array of shape (seqs, depths, dim), the ideal probabilities of the bitstrings
+    - measured_probs: numpy array of shape (seqs, depths, dim), the measured probabilities of the bitstrings
+    - depths: the depths of the second axis
+    - n_bootstrap: number of bootstrap resamplings of the sequences
+    - seed: seed of the bootstrap resampling
+    - epsilon: small value to avoid taking the logarithm of zero
+
+    Returns:
+    - xr.Dataset with the variables linear_fidelity, linear_fidelity_error, log_fidelity and log_fidelity_error
+      (over depth), and log_fidelity_per_sequence (over sequence and depth, NaN for singularities and outliers)
+    """
+    expected_probs = np.asarray(expected_probs, dtype=float)
+    measured_probs = np.asarray(measured_probs, dtype=float)
+    seqs, _, dim = expected_probs.shape
+
+    # Linear XEB: x * y and x ** 2 of each (sequence, depth)
+    u_u = expected_probs.sum(axis=-1) / dim
+    x = np.sum(expected_probs**2, axis=-1) - u_u
+    y = np.sum(measured_probs * expected_probs, axis=-1) - u_u
+    numerator, denominator = x * y, x**2
+
+    # Log XEB: cross entropies with the expected probabilities, as in compute_log_fidelity
+    log_expected = np.log(np.maximum(expected_probs, epsilon))
+    xe_incoherent = -np.sum(log_expected, axis=-1) / dim
+    xe_measured = -np.sum(measured_probs * log_expected, axis=-1)
+    xe_expected = -np.sum(expected_probs * log_expected, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_fidelities = (xe_incoherent - xe_measured) / (xe_incoherent - xe_expected)
+    log_fidelities[~np.isfinite(log_fidelities) | (log_fidelities < 0) | (log_fidelities > 1)] = np.nan
+
+    # Bootstrap resamplings of the sequences, as the number of times each sequence is drawn, shape (n_bootstrap, seqs)
+    resamples = np.random.default_rng(seed).integers(0, seqs, size=(n_bootstrap, seqs))
+    weights = np.bincount((resamples + seqs * np.arange(n_bootstrap)[:, None]).ravel(), minlength=n_bootstrap * seqs)
+    weights = weights.reshape(n_bootstrap, seqs).astype(float)
+    valid = ~np.isnan(log_fidelities)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        linear_bootstrap = (weights @ numerator) / (weights @ denominator)
+        # Depths with only singularities and outliers give NaN
+        log_fidelity = np.nansum(log_fidelities, axis=0) / valid.sum(axis=0)
+        log_bootstrap = (weights @ np.where(valid, log_fidelities, 0)) / (weights @ valid)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        log_fidelity_error = np.nanstd(log_bootstrap, axis=0)
+
+    return xr.Dataset(
+        data_vars={
+            "linear_fidelity": (["depth"], numerator.sum(axis=0) / denominator.sum(axis=0)),
+            "linear_fidelity_error": (["depth"], np.std(linear_bootstrap, axis=0)),
+            "log_fidelity": (["depth"], log_fidelity),
+            "log_fidelity_error": (["depth"], log_fidelity_error),
+            "log_fidelity_per_sequence": (["sequence", "depth"], log_fidelities),
+        },
+        coords={"sequence": np.arange(seqs), "depth": np.asarray(depths)},
+    )
+
+
 def evaluate_log_fidelity(f_xeb, singularity, outlier, seq, depth):
     """
     Evaluate the log fidelity and return the corresponding value.
@@ -0,0 +1,106 @@
+"""
+Incremental ideal simulation of the XEB circuits.
+
+The circuit of a sequence at a given depth is a prefix of the circuit of the same sequence at the maximum depth. Each
+sequence is therefore evolved once, gate by gate, and the ideal probabilities are taken at the end of every prefix,
+which makes the cost linear in the maximum depth instead of quadratic when every circuit is simulated from scratch.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from qiskit.circuit import QuantumCircuit
+from qiskit.quantum_info import Operator
+
+_IGNORED_INSTRUCTIONS = ("barrier", "measure")
+
+
+def _num_instructions_before_measurements(circuit: QuantumCircuit) -> int:
+    """Number of instructions of the circuit up to its last gate, i.e. without the final barriers and measurements."""
+    for index in range(len(circuit.data) - 1, -1, -1):
+        if circuit.data[index].operation.name not in _IGNORED_INSTRUCTIONS:
+            return index + 1
+    return 0
+
+
+def _apply_gate(state: np.ndarray, matrix: np.ndarray, qubits: List[int]) -> np.ndarray:
+    """
+    Apply a gate to a state stored as a tensor with one axis per qubit, the axis of qubit q being n_qubits - 1 - q
+    (so that the flattened state follows the qiskit ordering, qubit 0 being the least significant bit).
+    """
+    n_qubits = state.ndim
+    k = len(qubits)
+    # The matrix of a gate on qubits [q_0, ..., q_{k-1}] acts on the axes (q_{k-1}, ..., q_0), as the state does
+    axes = [n_qubits - 1 - q for q in reversed(qubits)]
+    state = np.tensordot(matrix.reshape((2,) * 2 * k), state, axes=(list(range(k, 2 * k)), axes))
+    return np.moveaxis(state, list(range(k)), axes)
+
+
+def prefix_probabilities(
+    circuit: QuantumCircuit, prefix_lengths: Sequence[int], matrices: Optional[Dict[int, tuple]] = None
+) -> np.ndarray:
+    """
+    Ideal probabilities at the end of prefixes of a circuit, from a single statevector evolution starting from |0...0>
+
+    Args:
+        circuit: Circuit to simulate. Barriers are skipped and measurements are only allowed at the end.
+        prefix_lengths: Number of instructions of each prefix.
+        matrices: Cache of the gate matrices, by id of the gate (shared between calls to only compute the matrix of
+            each gate of the gate set once).
+
+    Returns:
+        Array of shape (len(prefix_lengths), 2**n_qubits), in the qiskit ordering of the basis states.
+    """
+    matrices = {} if matrices is None else matrices
+    n_qubits = circuit.num_qubits
+    state = np.zeros((2,) * n_qubits, dtype=complex)
+    state[(0,) * n_qubits] = 1
+
+    snapshots = {}
+    order = np.argsort(prefix_lengths, kind="stable")
+    position = 0
+    for index in order:
+        for instruction in circuit.data[position : prefix_lengths[index]]:
+            operation = instruction.operation
+            if operation.name in _IGNORED_INSTRUCTIONS:
+                if operation.name == "measure":
+                    raise ValueError("Measurements are only supported at the end of the circuit")
+                continue
+            if id(operation) not in matrices:
+                # The gate is kept with its matrix, so that its id is not reused by another object
+                matrices[id(operation)] = (operation, Operator(operation).data)
+            qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+            state = _apply_gate(state, matrices[id(operation)][1], qubits)
+        position = max(position, prefix_lengths[index])
+        snapshots[index] = np.abs(state.reshape(-1)) ** 2
+
+    return np.array([snapshots[index] for index in range(len(prefix_lengths))])
+
+
+def expected_probabilities(circuits: List[List[QuantumCircuit]]) -> np.ndarray:
+    """
+    Ideal probabilities of the XEB circuits, evolving each sequence once up to its deepest circuit.
+
+    Args:
+        circuits: Circuits of the experiment, indexed by sequence then depth. The circuits of a sequence must be
+            prefixes of its deepest circuit (up to their final measurements), as built by `generate_circuits`.
+
+    Returns:
+        Array of shape (seqs, len(depths), 2**n_qubits), in the qiskit ordering of the basis states.
+    """
+    matrices = {}
+    probabilities = []
+    for sequence_circuits in circuits:
+        prefix_lengths = [_num_instructions_before_measurements(qc) for qc in sequence_circuits]
+        deepest = sequence_circuits[int(np.argmax(prefix_lengths))]
+        probabilities.append(prefix_probabilities(deepest, prefix_lengths, matrices))
+    return np.array(probabilities)
+
+
+def marginal_probabilities(probabilities: np.ndarray, qubit: int) -> np.ndarray:
+    """Marginal probabilities [p(0), p(1)] of a qubit, from probabilities in the qiskit ordering."""
+    n_qubits = int(np.log2(probabilities.shape[-1]))
+    tensor = probabilities.reshape(probabilities.shape[:-1] + (2,) * n_qubits)
+    qubit_axis = tensor.ndim - 1 - qubit
+    other_axes = tuple(axis for axis in range(probabilities.ndim - 1, tensor.ndim) if axis != qubit_axis)
+    return tensor.sum(axis=other_axes)
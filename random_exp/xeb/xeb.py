@@ -13,6 +13,7 @@ from .macros import (
     align_transmon_pair,
     generate_circuits,
     compute_log_fidelity,
+    compute_xeb_fidelities,
     evaluate_log_fidelity,
     update_record,
     update_data_frame,
@@ -20,11 +21,12 @@ from .macros import (
 import matplotlib.pyplot as plt
 from qiskit_aer import AerJob
 import pandas as pd
+import xarray as xr
 from .xeb_config import XEBConfig
+from .simulation import expected_probabilities, marginal_probabilities
 from qiskit.circuit import QuantumCircuit
 from qiskit.providers import BackendV2
 from qiskit.transpiler import CouplingMap
-from qiskit.quantum_info import Statevector
 from qualang_tools.results import DataHandler
 
 from iqcc_research.quam_config.components import Quam, Transmon
@@ -816,18 +818,20 @@ class XEBResult:
             incoherent_distribution = np.ones(2) / 2
             log_fidelities = np.zeros((n_qubits, seqs, len(depths)))
 
+        if not existing_data:
+            # Each sequence is simulated once, its shallower circuits being prefixes of the deepest one
+            ideal_probs = expected_probabilities(self.circuits)
+
         for s in range(seqs):
             for d_, depth in enumerate(depths):
-                qc = self.circuits[s][d_].remove_final_measurements(inplace=False)
                 if not existing_data:
-                    statevector = Statevector(qc)
-                    joint_expected_probs[s, d_] = statevector.probabilities(decimals=5)
+                    joint_expected_probs[s, d_] = np.round(ideal_probs[s, d_], 5)
                     joint_measured_probs[s, d_] = (
                         np.array([counts[binary(i, n_qubits)][s][d_] for i in range(dim)]) / self.xeb_config.n_shots
                     )
 
                     for q in range(n_qubits):
-                        disjoint_expected_probs[q, s, d_] = statevector.probabilities([q], 5)
+                        disjoint_expected_probs[q, s, d_] = np.round(marginal_probabilities(ideal_probs[s, d_], q), 5)
                         qubit_state = states[f"state_{self.qubit_names[q]}"][s, d_]
                         disjoint_measured_probs[q, s, d_] = np.array([1 - qubit_state, qubit_state])
 
@@ -923,6 +927,36 @@ class XEBResult:
         return layer_fid
 
 
+    def get_fidelity_dataset(
+        self, n_bootstrap: int = 1000, seed: Optional[int] = None, disjoint_processing: Optional[bool] = None
+    ) -> xr.Dataset:
+        """
+        Returns the linear and log XEB fidelities per depth and their bootstrap errors, computed from the measured and
+        expected probability arrays with numpy reductions (see `compute_xeb_fidelities`)
+        Args:
+            n_bootstrap: Number of bootstrap resamplings of the sequences
+            seed: Seed of the bootstrap resampling
+            disjoint_processing: Indicate if disjoint processing should be applied to the results. With disjoint
+                processing, the fidelities of each qubit are stacked along a "qubit" dimension
+        """
+        if disjoint_processing is not None:
+            assert isinstance(disjoint_processing, bool), "disjoint_processing should be a boolean"
+        else:
+            disjoint_processing = self.xeb_config.disjoint_processing
+
+        depths = self.xeb_config.depths
+        if not disjoint_processing:
+            return compute_xeb_fidelities(self.expected_probs, self.measured_probs, depths, n_bootstrap, seed)
+        return xr.concat(
+            [
+                compute_xeb_fidelities(
+                    self.disjoint_expected_probs[q], self.disjoint_measured_probs[q], depths, n_bootstrap, seed
+                )
+                for q in range(len(self.qubit_names))
+            ],
+            dim=xr.DataArray(self.qubit_names, dims="qubit", name="qubit"),
+        )
+
     def plot_fidelities(self, fit_linear: bool = True, fit_log_entropy: bool = True, separate_plots: bool = False):
         """
         Plot the cross-entropy fidelities for the XEB experiment
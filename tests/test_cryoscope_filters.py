@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+pytest.importorskip("quam")
+
+from iqcc_research.quam_config.lib.cryoscope_tools import (
+    align_step_responses,
+    design_cryoscope_filters,
+    rescale_feedforward_taps,
+    transform_to_circle,
+)
+from iqcc_research.quam_config.lib.instrument_limits import LF_FEM_FILTER_LIMITS, OPX_PLUS_FILTER_LIMITS
+from iqcc_research.quam_config.lib.opx_filters import OPXFilterChain, validate_step_response
+
+
+def synthetic_step(rise=10, length=240, components=((0.05, 30.0), (0.03, 150.0))):
+    t = np.arange(1, length + 1)
+    elapsed = np.clip(t - rise, 0, None)
+    y = 1 - sum(amplitude * np.exp(-elapsed / tau) for amplitude, tau in components)
+    y = np.where(t > rise, y, 0.0)
+    return xr.DataArray(y[None], dims=["qubit", "time"], coords={"qubit": ["q1"], "time": t})
+
+
+@pytest.mark.parametrize("rotation", [0.0, 0.7, 1.9, 3.0])
+def test_rotated_ellipse_is_mapped_to_its_major_circle(rotation):
+    a, b, center = 0.3, 0.15, np.array([0.1, -0.05])
+    phase = np.linspace(0, 2 * np.pi, 50, endpoint=False)
+    rotation_matrix = np.array([[np.cos(rotation), -np.sin(rotation)], [np.sin(rotation), np.cos(rotation)]])
+    x, y = rotation_matrix @ np.stack([a * np.cos(phase), b * np.sin(phase)]) + center[:, None]
+
+    x_circle, y_circle = transform_to_circle(x, y)
+
+    np.testing.assert_allclose(np.hypot(x_circle - center[0], y_circle - center[1]), a, rtol=1e-6)
+
+
+def test_ideal_step_passes_the_gate_on_the_lf_fem():
+    flux = synthetic_step()
+    filters = design_cryoscope_filters(flux, limits=LF_FEM_FILTER_LIMITS)
+    assert filters.success.sel(qubit="q1")
+    assert filters.exponential_sections.sel(qubit="q1")
+
+    chain = OPXFilterChain(
+        feedforward=filters.feedforward.sel(qubit="q1").values,
+        exponential=list(zip(filters.amplitude.sel(qubit="q1").values, filters.tau.sel(qubit="q1").values)),
+        hardware="opx1000",
+    )
+    aligned, _ = align_step_responses(flux)
+    accepted, report = validate_step_response(chain, aligned.sel(qubit="q1").values)
+
+    assert report["violations"] == []
+    assert report["max_deviation"] < 1e-2
+    assert accepted
+
+
+def test_rescaled_taps_stay_within_the_limit():
+    max_amplitude = OPX_PLUS_FILTER_LIMITS.max_feedforward_amplitude
+    # 2.1 rescaled to max_amplitude rounds slightly above it
+    taps = rescale_feedforward_taps([2.1, -0.5], max_amplitude)
+
+    assert np.max(np.abs(taps)) <= max_amplitude
+    assert OPXFilterChain(feedforward=taps, hardware="opx+").violations() == []
+
+
+def test_too_many_exponentials_are_rejected():
+    with pytest.raises(ValueError):
+        design_cryoscope_filters(synthetic_step(), n_components=3, limits=OPX_PLUS_FILTER_LIMITS)
+
+
+def test_limits_are_applied_per_qubit():
+    flux = xr.concat([synthetic_step(), synthetic_step().assign_coords(qubit=["q2"])], dim="qubit")
+    filters = design_cryoscope_filters(flux, limits=[LF_FEM_FILTER_LIMITS, OPX_PLUS_FILTER_LIMITS])
+
+    assert filters.exponential_sections.values.tolist() == [True, False]
+    assert np.isnan(filters.feedback.sel(qubit="q1")).all()
+    assert not np.isnan(filters.feedback.sel(qubit="q2")).any()
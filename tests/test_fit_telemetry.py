@@ -0,0 +1,57 @@
+import numpy as np
+import xarray as xr
+from scipy.optimize import curve_fit
+
+from iqcc_research.quam_config.lib.fit_telemetry import FitTelemetry
+
+
+def decay_exp(t, a, offset, decay):
+    return a * np.exp(t * decay) + offset
+
+
+def fit_decay_exp(da, dim):
+    """A batched fitter returning its initial guess when curve_fit fails, like the qualibration_libs fitters."""
+    fit_decay_exp.calls += 1
+
+    def apply_fit(x, y):
+        guess = [y[0] - y[-1], y[-1], -1 / x.mean()]
+        try:
+            popt, _ = curve_fit(decay_exp, x, y, p0=guess, maxfev=2 if y[0] > 5 else 1000)
+        except RuntimeError:
+            return np.array(guess)
+        return popt
+
+    fit = xr.apply_ufunc(
+        apply_fit, da[dim], da, input_core_dims=[[dim], [dim]], output_core_dims=[["fit_vals"]], vectorize=True
+    )
+    return fit.assign_coords(fit_vals=["a", "offset", "decay"])
+
+
+def make_data():
+    t = np.linspace(0, 50e3, 101)
+    rng = np.random.default_rng(0)
+    traces = [decay_exp(t, 1.0, 0.1, -1 / 12e3), decay_exp(t, 0.8, 0.05, -1 / 20e3), decay_exp(t, 10.0, 0.0, -1 / 5e3)]
+    data = np.array(traces) + 0.01 * rng.normal(size=(3, len(t)))
+    return xr.DataArray(data, dims=["qubit", "idle_time"], coords={"qubit": ["q1", "q2", "q3"], "idle_time": t})
+
+
+def test_instrument_keeps_the_batched_fit_and_flags_returned_guesses():
+    da = make_data()
+    telemetry = FitTelemetry()
+    fit_decay_exp.calls = 0
+
+    fit = telemetry.instrument(fit_decay_exp, model=decay_exp)(da, "idle_time")
+
+    # the fitter is called once for all the qubits, and its result is unchanged
+    assert fit_decay_exp.calls == 1
+    reference = fit_decay_exp(da, "idle_time")
+    xr.testing.assert_identical(fit, reference)
+    assert [r.qubit for r in telemetry.records] == ["q1", "q2", "q3"]
+    # q3 hits maxfev, and the fitter returns its initial guess: the fit is not a success
+    assert [r.success for r in telemetry.records] == [True, True, False]
+    assert all(r.residual_norm is not None for r in telemetry.records)
+    # the batched call is not timed per qubit, only its share per qubit is recorded
+    assert all(r.wall_time is None and r.nfev is None for r in telemetry.records)
+    assert all(r.batch_wall_time_share > 0 for r in telemetry.records)
+    assert telemetry.to_dict()["summary"]["fit_decay_exp"]["max_wall_time"] is None
+    assert telemetry.to_dict()["summary"]["fit_decay_exp"]["failed_qubits"] == ["q3"]
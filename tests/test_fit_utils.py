@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+import xarray as xr
+from lmfit import Model, Parameters
+
+from iqcc_research.quam_config.lib.fit_utils import (
+    _S21_abs,
+    _S21_abs_jac,
+    _S21_single,
+    _S21_single_jac,
+    _guess_single,
+    _jacobian_dfun,
+)
+
+S21_ABS_PARAMS = dict(A=1.2, k=1e-9, phi=0.3, kappa_p=20e6, omega_p=7.01e9, omega_r=7.0e9, J=8e6)
+S21_SINGLE_PARAMS = dict(A=0.9, k=2e-10, omega_0=7.0e9, omega_r=7.0002e9, Q=8e3, Qe_real=1.2e4, Qe_imag=3e3)
+
+
+def numeric_jacobian(model, w, params, relative_step=1e-8):
+    jac = {}
+    for name, value in params.items():
+        step = relative_step * max(abs(value), 1e-6)
+        upper = model(w, **{**params, name: value + step})
+        lower = model(w, **{**params, name: value - step})
+        jac[name] = (upper - lower) / (2 * step)
+    return jac
+
+
+@pytest.mark.parametrize(
+    "model, jacobian, params, span",
+    [
+        (_S21_abs, _S21_abs_jac, S21_ABS_PARAMS, 60e6),
+        (_S21_single, _S21_single_jac, S21_SINGLE_PARAMS, 5e6),
+    ],
+)
+def test_analytic_jacobian_matches_finite_differences(model, jacobian, params, span):
+    w = params["omega_r"] + np.linspace(-span / 2, span / 2, 201)
+    analytic = jacobian(w, **params)
+    numeric = numeric_jacobian(model, w, params)
+
+    assert set(analytic) == set(params)
+    for name in params:
+        scale = np.max(np.abs(numeric[name]))
+        np.testing.assert_allclose(analytic[name], numeric[name], rtol=1e-4, atol=1e-5 * scale, err_msg=name)
+
+
+def test_dfun_matches_finite_differences_of_the_complex_residual():
+    params = Parameters()
+    for name, value in S21_SINGLE_PARAMS.items():
+        params.add(name, value=value)
+    params["k"].vary = False
+    w = S21_SINGLE_PARAMS["omega_r"] + np.linspace(-2.5e6, 2.5e6, 101)
+    data = _S21_single(w, **S21_SINGLE_PARAMS) * 1.01
+
+    jacobian = _jacobian_dfun(_S21_single_jac)(params, data, None, w=w)
+
+    varying = [name for name, par in params.items() if par.vary]
+    assert jacobian.shape == (2 * len(w), len(varying))
+    numeric = numeric_jacobian(_S21_single, w, S21_SINGLE_PARAMS)
+    for column, name in enumerate(varying):
+        # lmfit's residual is data - model, with the real and imaginary parts interleaved
+        expected = np.ascontiguousarray(-numeric[name], dtype=complex).view(float)
+        scale = np.max(np.abs(expected))
+        np.testing.assert_allclose(jacobian[:, column], expected, rtol=1e-4, atol=1e-5 * scale, err_msg=name)
+
+
+def fit_with_and_without_dfun(model, jacobian, data, w, params):
+    lmfit_model = Model(model)
+    analytic = lmfit_model.fit(data, w=w, params=params.copy(), fit_kws={"Dfun": _jacobian_dfun(jacobian)})
+    numeric = lmfit_model.fit(data, w=w, params=params.copy())
+    return analytic, numeric
+
+
+def assert_same_fit(analytic, numeric, data, physical_params):
+    # A and k are nearly degenerate (A + k * w with w ~ 7 GHz), so they are compared through the fitted curve
+    for name in physical_params:
+        np.testing.assert_allclose(analytic.params[name].value, numeric.params[name].value, rtol=1e-3, err_msg=name)
+    np.testing.assert_allclose(analytic.best_fit, numeric.best_fit, atol=1e-3 * np.max(np.abs(data)))
+    assert analytic.nfev < numeric.nfev
+
+
+def test_single_resonator_fit_matches_the_finite_difference_fit():
+    rng = np.random.default_rng(0)
+    w = S21_SINGLE_PARAMS["omega_r"] + np.linspace(-2.5e6, 2.5e6, 301)
+    data = _S21_single(w, **S21_SINGLE_PARAMS) + 2e-3 * (rng.normal(size=w.size) + 1j * rng.normal(size=w.size))
+    transmission = xr.Dataset(
+        {"IQ_abs": ("freq", np.abs(data)), "phase": ("freq", np.angle(data))}, coords={"freq": w}
+    )
+    # the initial guess of fit_resonator, whose Qe_imag starts off its lower bound
+    params = _guess_single(
+        transmission, frequency_LO_IF=S21_SINGLE_PARAMS["omega_0"], rolling_window=1, window=15e6
+    )
+
+    analytic, numeric = fit_with_and_without_dfun(_S21_single, _S21_single_jac, data, w, params)
+
+    assert_same_fit(analytic, numeric, data, ["omega_r", "Q", "Qe_real", "Qe_imag"])
+    np.testing.assert_allclose(analytic.params["Qe_imag"].value, S21_SINGLE_PARAMS["Qe_imag"], rtol=1e-2)
+
+
+def test_two_resonator_fit_matches_the_finite_difference_fit():
+    rng = np.random.default_rng(1)
+    w = S21_ABS_PARAMS["omega_r"] + np.linspace(-30e6, 30e6, 301)
+    data = _S21_abs(w, **S21_ABS_PARAMS) + 2e-3 * rng.normal(size=w.size)
+    params = Parameters()
+    for name, value in S21_ABS_PARAMS.items():
+        # start the frequencies a few hundred kHz and the other parameters 0.2% away from the truth
+        params.add(name, value=value * (1.00002 if name.startswith("omega") else 1.002))
+    params["J"].min = 0
+    params["kappa_p"].min = 0
+
+    analytic, numeric = fit_with_and_without_dfun(_S21_abs, _S21_abs_jac, data, w, params)
+
+    assert_same_fit(analytic, numeric, data, ["omega_r", "omega_p", "kappa_p", "J", "phi"])